@@ -1,8 +1,13 @@
 import streamlit as st
 import os
 from rag_engine_enhanced import RAGEngine
+from retrieval_client import RemoteRAGEngine
 import time
 
+# Set to a retrieval_server.py address (e.g. http://retrieval:8600) to share one
+# embedding model and index between app replicas instead of loading them here
+RETRIEVAL_SERVER = os.environ.get("RAG_RETRIEVAL_SERVER")
+
 FORMAT_ICONS = {
     'pdf': '📕', 'docx': '📘', 'doc': '📘', 'txt': '📄', 'rtf': '📋', 'md': '📄',
     'csv': '📊', 'xlsx': '📈', 'xls': '📈', 'ods': '📊',
@@ -87,6 +92,8 @@ if 'edit_mode' not in st.session_state:
     st.session_state.edit_mode = False
 if 'edit_index' not in st.session_state:
     st.session_state.edit_index = None
+if 'collection' not in st.session_state:
+    st.session_state.collection = "default"
 
 st.markdown('<h1 style="color: red; text-align: center;">Ready To Go TTZ.KT AI Platform 2025</h1>', unsafe_allow_html=True)
 st.markdown("### *Files Assistant + General Chat - Ollama Powered*")
@@ -191,11 +198,26 @@ with st.sidebar:
     
     if not st.session_state.rag_engine:
         with st.spinner("Initializing RAG engine..."):
-            st.session_state.rag_engine = RAGEngine(
-                model=selected_model,
-                vision_model="llama3.2-vision:latest"
-            )
+            if RETRIEVAL_SERVER:
+                st.session_state.rag_engine = RemoteRAGEngine(
+                    RETRIEVAL_SERVER,
+                    model=selected_model,
+                    vision_model="llama3.2-vision:latest",
+                    collection=st.session_state.collection
+                )
+            else:
+                st.session_state.rag_engine = RAGEngine(
+                    model=selected_model,
+                    vision_model="llama3.2-vision:latest",
+                    collection=st.session_state.collection
+                )
             st.session_state.current_model = selected_model
+            
+            # Pick up the index saved by a previous session
+            if st.session_state.rag_engine.load_index():
+                st.session_state.processed_files = list(st.session_state.rag_engine.processed_documents)
+                st.session_state.rag_engine.setup_chain()
+                st.session_state.document_processed = True
     
     if st.session_state.rag_engine and selected_model != st.session_state.current_model:
         if st.button("🔄 Switch Model", type="secondary"):
@@ -209,11 +231,54 @@ with st.sidebar:
                 except Exception as e:
                     st.error(f"Failed to switch model: {str(e)}")
     
+    st.markdown("---")
+    st.subheader("🗂️ Collection")
+    
+    # Each collection has its own index - teams and sessions don't overwrite each other
+    collections = st.session_state.rag_engine.list_collections()
+    new_collection_label = "➕ New collection..."
+    chosen_collection = st.selectbox(
+        "Collection",
+        collections + [new_collection_label],
+        index=collections.index(st.session_state.collection) if st.session_state.collection in collections else 0,
+        label_visibility="collapsed"
+    )
+    target_collection = None
+    if chosen_collection == new_collection_label:
+        new_collection = st.text_input("Collection name", placeholder="e.g. finance-team")
+        if new_collection and st.button("Create", type="secondary"):
+            target_collection = new_collection.strip()
+    elif chosen_collection != st.session_state.collection:
+        target_collection = chosen_collection
+    
+    if target_collection:
+        try:
+            with st.spinner(f"Opening {target_collection}..."):
+                st.session_state.rag_engine.open_collection(target_collection)
+            st.session_state.collection = target_collection
+            st.session_state.chat_history = []
+            st.session_state.processed_files = list(st.session_state.rag_engine.processed_documents)
+            st.session_state.document_processed = bool(st.session_state.processed_files)
+            if st.session_state.document_processed:
+                st.session_state.rag_engine.setup_chain()
+            st.rerun()
+        except ValueError as e:
+            st.error(str(e))
+    
     st.markdown("---")
     st.subheader("📚 Upload Documents")
     
     st.info("💡 Supports 13+ formats: PDF, Word, Excel, Images, JSON, XML, etc.")
     
+    parent_child = st.checkbox(
+        "🧩 Parent-child chunking",
+        value=st.session_state.rag_engine.chunking_mode == "parent_child",
+        help="Match on small chunks, answer from the full sections they belong to. Applies to newly processed files."
+    )
+    new_chunking_mode = "parent_child" if parent_child else "standard"
+    if new_chunking_mode != st.session_state.rag_engine.chunking_mode:
+        st.session_state.rag_engine.set_chunking_mode(new_chunking_mode)
+    
     uploaded_files = st.file_uploader(
         "Drop files here",
         type=["pdf", "docx", "doc", "txt", "rtf", "md", "csv", "xlsx", "xls", "ods", 
@@ -226,24 +291,27 @@ with st.sidebar:
         if st.button("🚀 Process Documents", type="primary"):
             with st.spinner("Processing documents..."):
                 try:
-                    all_chunks = []
+                    progress = st.progress(0.0, text="Starting...")
+                    
+                    def on_file_done(file_name, done, total):
+                        progress.progress(done / total, text=f"📄 Processed: {file_name} ({done}/{total})")
+                    
+                    # Images go to the vision model concurrently; text files are
+                    # embedded while images are still being analysed
+                    num_chunks = st.session_state.rag_engine.process_uploaded_files(
+                        uploaded_files, progress_callback=on_file_done
+                    )
                     for uploaded_file in uploaded_files:
-                        st.info(f"📄 Processing: {uploaded_file.name}")
-                        chunks = st.session_state.rag_engine.process_uploaded_file(uploaded_file)
-                        all_chunks.extend(chunks)
                         if uploaded_file.name not in st.session_state.processed_files:
                             st.session_state.processed_files.append(uploaded_file.name)
                     
-                    if st.session_state.document_processed:
-                        existing_docs = st.session_state.rag_engine.vectorstore
-                        st.session_state.rag_engine.create_vectorstore(all_chunks)
-                    else:
-                        st.session_state.rag_engine.create_vectorstore(all_chunks)
+                    if not num_chunks and not st.session_state.rag_engine.vectorstore:
+                        raise ValueError("No content could be extracted from the uploaded files")
                     
                     st.session_state.rag_engine.setup_chain()
                     st.session_state.document_processed = True
                     
-                    st.success(f"✅ Processed {len(uploaded_files)} file(s) - {len(all_chunks)} chunks")
+                    st.success(f"✅ Processed {len(uploaded_files)} file(s) - {num_chunks} chunks")
                     time.sleep(1)
                     st.rerun()
                     
@@ -256,12 +324,39 @@ with st.sidebar:
     if st.session_state.rag_engine:
         st.success("✅ Engine Ready")
         
+        stats = st.session_state.rag_engine.collection_stats()
+        read_only = stats.get("read_only", False)
+        st.caption(f"🗂️ {stats['name']}{' 🔒 read-only bundle' if read_only else ''}: "
+                   f"{stats['documents']} file(s), {stats['chunks']} chunks, {stats['disk_mb']:.1f} MB on disk")
+        
         if st.session_state.processed_files:
             with st.expander("📂 Processed Files"):
                 for file in st.session_state.processed_files:
                     ext = file.split('.')[-1].lower()
                     icon = FORMAT_ICONS.get(ext, '🔎')
-                    st.caption(f"{icon} {file}")
+                    name_col, remove_col = st.columns([5, 1])
+                    with name_col:
+                        st.caption(f"{icon} {file}")
+                    with remove_col:
+                        if not read_only and st.button("🗑️", key=f"remove_{file}", help=f"Remove {file}"):
+                            # Only this file's chunks are dropped - nothing is re-embedded
+                            st.session_state.rag_engine.delete_document(file)
+                            st.session_state.processed_files.remove(file)
+                            if not st.session_state.processed_files:
+                                st.session_state.document_processed = False
+                            st.rerun()
+                    summary = st.session_state.rag_engine.get_document_summary(file)
+                    if summary:
+                        st.caption(f"_{summary}_")
+            
+            if len(st.session_state.processed_files) > 1:
+                search_in = st.multiselect(
+                    "🔎 Search only in",
+                    st.session_state.processed_files,
+                    help="Restrict answers to these files (file names mentioned in a question are detected automatically)"
+                )
+                if search_in != st.session_state.rag_engine.search_filters.get("source", []):
+                    st.session_state.rag_engine.set_search_filters(source=search_in)
         else:
             st.warning("🟡 No files")
         
@@ -276,7 +371,9 @@ with st.sidebar:
             st.session_state.document_processed = False
             st.session_state.processed_files = []
             if st.session_state.rag_engine:
-                st.session_state.rag_engine.clear_documents()
+                # A mounted bundle is shared and read-only - only the session is reset
+                if not st.session_state.rag_engine.collection_stats().get("read_only"):
+                    st.session_state.rag_engine.clear_documents()
                 st.session_state.rag_engine = None
             st.rerun()
 
@@ -403,6 +500,10 @@ else:
                                 icon = FORMAT_ICONS.get(file_ext, '🔎')
                                 st.caption(f"**{source_idx}.** {icon} {source_file} (Page: {source_page})")
                                 st.caption(f"_{source.page_content[:200]}..._")
+                                duplicates = source.metadata.get('duplicate_sources', [])
+                                if duplicates:
+                                    also_in = sorted({d.get('source', 'Unknown') for d in duplicates})
+                                    st.caption(f"↳ Also appears {len(duplicates)}x in: {', '.join(also_in)}")
     
     if not st.session_state.edit_mode:
         if prompt := st.chat_input("Chat or ask about documents..."):
@@ -424,7 +525,14 @@ else:
             with st.chat_message("assistant"):
                 with st.spinner(f"🤔 {st.session_state.current_model} thinking..."):
                     try:
-                        response = st.session_state.rag_engine.ask_question(prompt)
+                        progress_slot = st.empty()
+                        
+                        def on_progress(stage, done, total):
+                            progress_slot.progress(done / total if total else 1.0,
+                                                   text=f"📖 Reading all sections - {stage} {done}/{total}")
+                        
+                        response = st.session_state.rag_engine.ask_question(prompt, progress_callback=on_progress)
+                        progress_slot.empty()
                         
                         st.markdown(response["answer"])
                         
@@ -438,6 +546,10 @@ else:
                                     icon = FORMAT_ICONS.get(file_ext, '🔎')
                                     st.caption(f"**{idx}.** {icon} {source_file} (Page: {source_page})")
                                     st.caption(f"_{source.page_content[:200]}..._")
+                                    duplicates = source.metadata.get('duplicate_sources', [])
+                                    if duplicates:
+                                        also_in = sorted({d.get('source', 'Unknown') for d in duplicates})
+                                        st.caption(f"↳ Also appears {len(duplicates)}x in: {', '.join(also_in)}")
                         
                         st.session_state.chat_history.append({
                             "role": "assistant",
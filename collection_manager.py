@@ -0,0 +1,301 @@
+import os
+import re
+import time
+import atexit
+import weakref
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from dedup import ChunkDeduplicator
+from doc_index import DocumentIndex
+from index_store import SegmentStore
+from kb_bundle import BUNDLES_DIR, is_bundle, read_bundle
+from metadata_index import MetadataIndex
+from sqlite_docstore import SQLiteDocstore
+
+
+DEFAULT_COLLECTION = "default"
+MAX_OPEN_COLLECTIONS = 4
+DOCSTORE_NAME = "docstore.sqlite"
+
+_NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$")
+
+
+def validate_collection_name(name):
+    if not isinstance(name, str) or not _NAME_PATTERN.match(name) or ".." in name:
+        raise ValueError(f"Invalid collection name '{name}' (letters, digits, '_', '-', '.'; up to 64 characters)")
+    return name
+
+
+class ReadWriteLock:
+    """
+    Many readers or one writer - searches share the FAISS index, an
+    in-place add waits for them and holds new ones back (a waiting writer
+    goes first, so a steady stream of searches can't starve ingestion)
+
+    Writers take it inside index_lock; readers must not take index_lock
+    while holding it.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def reading(self):
+        with self._condition:
+            while self._writing or self._writers_waiting:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def writing(self):
+        with self._condition:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._condition.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+class Collection:
+    """
+    Index state of one named collection
+
+    Vectorstore, docstores, segment manifest, side indexes, deduplicator
+    signatures and unsaved changes all live here, so every engine that
+    opens the same collection shares one copy in memory - and one writer.
+    A read-only collection is a mounted knowledge-base bundle.
+    """
+
+    def __init__(self, name, directory, dedup_threshold=0.85, compress_docstore=True, read_only=False):
+        self.name = name
+        self.directory = directory
+        self.compress_docstore = compress_docstore
+        self.read_only = read_only
+        self.loaded = False
+        self.last_used = time.time()
+        self.engines = weakref.WeakSet()  # engines that currently have it open
+
+        self.index_lock = threading.RLock()
+        self.search_lock = ReadWriteLock()  # searches vs. in-place adds to the FAISS index
+        self.vectorstore = None
+        self.processed_documents = []
+        self.deduplicator = ChunkDeduplicator(threshold=dedup_threshold) if dedup_threshold else None
+        self.doc_index = DocumentIndex()
+        self.pending_documents = set()
+        self.metadata_index = MetadataIndex()
+        self.tombstones = set()
+        self.index_epoch = 0  # bumped whenever FAISS positions are renumbered (compaction, clear, reload)
+        self.summary_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"doc-index-{name}")
+        self.maintenance_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"compact-{name}")
+        self.segment_store = SegmentStore(directory, read_only=read_only)
+        self.open_docstores()
+        self.reset_unsaved()
+
+    def open_docstores(self):
+        path = os.path.join(self.directory, DOCSTORE_NAME)
+        self.docstore = SQLiteDocstore(path, "chunks", compress=self.compress_docstore, read_only=self.read_only)
+        self.parent_store = SQLiteDocstore(path, "parents", compress=self.compress_docstore, read_only=self.read_only)
+        self.looked_up = {}           # chunk_id → Document whose metadata dedup is changing
+        self.docstore_changes = 0
+        self.docstore_current = True  # invalidated on the first change
+
+    def close_docstores(self):
+        self.docstore.close()
+        self.parent_store.close()
+
+    def reset_unsaved(self):
+        self.unsaved_chunks = []    # (chunk_id, float32 vector) added since the last save
+        self.dirty_chunks = set()   # stored chunks whose metadata changed
+        self.unsaved_parents = []   # parent_ids
+        self.unsaved_deletes = []   # chunk and parent ids
+
+    def has_unsaved_changes(self):
+        return bool(self.unsaved_chunks or self.dirty_chunks or self.unsaved_parents or self.unsaved_deletes)
+
+    def stats(self):
+        """Size and state of the collection, for the UI and logs"""
+        disk_bytes = 0
+        if os.path.isdir(self.directory):
+            for file_name in os.listdir(self.directory):
+                path = os.path.join(self.directory, file_name)
+                if os.path.isfile(path):
+                    disk_bytes += os.path.getsize(path)
+        with self.index_lock:
+            chunks = self.vectorstore.index.ntotal - len(self.tombstones) if self.vectorstore is not None else 0
+            return {
+                "name": self.name,
+                "documents": len(self.processed_documents),
+                "chunks": chunks,
+                "parents": len(self.parent_store),
+                "segments": len(self.segment_store.manifest["segments"]),
+                "tombstones": len(self.tombstones),
+                "read_only": self.read_only,
+                "disk_mb": disk_bytes / (1024 * 1024),
+                "open_engines": len(self.engines),
+                "dedup": dict(self.deduplicator.stats) if self.deduplicator else None
+            }
+
+    def close(self):
+        """Finish background jobs and release the docstores (the collection must not be used afterwards)"""
+        self.summary_pool.shutdown(wait=True)
+        self.maintenance_pool.shutdown(wait=True)
+        with self.index_lock:
+            self.vectorstore = None
+            self.close_docstores()
+
+
+class CollectionManager:
+    """
+    Named collections under one root directory, opened on demand
+
+    At most max_open collections stay in memory; the least recently used
+    one that no engine has open is closed when another is needed. The
+    'default' collection keeps the original vectors/faiss_index location.
+
+    Knowledge-base bundles in vectors/bundles/<name> (or mounted from
+    anywhere with mount()) open as read-only collections, unless a
+    writable collection has the same name.
+    """
+
+    def __init__(self, root="vectors", max_open=MAX_OPEN_COLLECTIONS):
+        self.root = root
+        self.max_open = max(1, max_open)
+        self._open = OrderedDict()  # name → Collection, least recently used first
+        self._mounts = {}           # name → bundle directory
+        self._lock = threading.Lock()
+
+    def directory(self, name):
+        validate_collection_name(name)
+        if name == DEFAULT_COLLECTION:
+            return os.path.join(self.root, "faiss_index")
+        return os.path.join(self.root, "collections", name)
+
+    def locate(self, name):
+        """
+        Where a collection lives
+
+        Returns:
+            (directory, read_only) - read_only for a mounted bundle
+        """
+        if name in self._mounts:
+            return self._mounts[name], True
+        directory = self.directory(name)
+        bundle = os.path.join(self.root, BUNDLES_DIR, name)
+        if name != DEFAULT_COLLECTION and not os.path.isdir(directory) and is_bundle(bundle):
+            return bundle, True
+        return directory, False
+
+    def mount(self, name, path, verify=False):
+        """
+        Serve a bundle directory in place as a read-only collection (for this process)
+
+        Args:
+            verify: Check every file's SHA-256 first (reads the whole bundle)
+        """
+        validate_collection_name(name)
+        read_bundle(path, verify=verify)
+        if name == DEFAULT_COLLECTION or os.path.isdir(self.directory(name)):
+            raise ValueError(f"A writable collection named '{name}' already exists")
+        with self._lock:
+            if name in self._open and self._open[name].directory != path:
+                raise ValueError(f"Collection '{name}' is open - close it before mounting another bundle")
+            self._mounts[name] = path
+
+    def names(self):
+        """Collections that exist on disk, are mounted or are open, default first"""
+        names = [DEFAULT_COLLECTION]
+        for directory, wanted in ((os.path.join(self.root, "collections"), os.path.isdir),
+                                  (os.path.join(self.root, BUNDLES_DIR), is_bundle)):
+            if os.path.isdir(directory):
+                names += sorted(name for name in os.listdir(directory) if name not in names
+                                and _NAME_PATTERN.match(name) and wanted(os.path.join(directory, name)))
+        names += list(self._mounts) + list(self._open)
+        return list(dict.fromkeys(names))
+
+    def acquire(self, name, engine, dedup_threshold=0.85, compress_docstore=True):
+        """
+        Open (or reuse) a collection for an engine
+
+        The first engine to open a collection decides its dedup threshold
+        and docstore compression.
+        """
+        with self._lock:
+            collection = self._open.get(name)
+            if collection is None:
+                directory, read_only = self.locate(name)
+                if read_only:
+                    # Refuses bundles of another embedding model
+                    read_bundle(directory)
+                collection = Collection(name, directory, dedup_threshold=dedup_threshold,
+                                        compress_docstore=compress_docstore, read_only=read_only)
+                self._open[name] = collection
+                print(f"[Collections] 📂 Opened '{name}'{' (read-only bundle)' if read_only else ''} "
+                      f"({len(self._open)}/{self.max_open} open)")
+            self._open.move_to_end(name)
+            collection.engines.add(engine)
+            collection.last_used = time.time()
+            evicted = self._evict()
+        for old in evicted:
+            old.close()
+            print(f"[Collections] 💤 Closed '{old.name}' (least recently used)")
+        return collection
+
+    def release(self, collection, engine):
+        collection.engines.discard(engine)
+
+    def _evict(self):
+        """Pick collections to close until max_open fit (caller holds _lock) - open ones are skipped"""
+        evicted = []
+        for name in list(self._open):
+            if len(self._open) <= self.max_open:
+                break
+            collection = self._open[name]
+            if collection.engines or collection.has_unsaved_changes():
+                continue
+            evicted.append(self._open.pop(name))
+        return evicted
+
+    def stats(self):
+        with self._lock:
+            collections = list(self._open.values())
+        return [collection.stats() for collection in collections]
+
+    def shutdown(self):
+        with self._lock:
+            collections = list(self._open.values())
+            self._open.clear()
+        for collection in collections:
+            collection.close()
+
+
+_COLLECTION_MANAGER = None
+_COLLECTION_MANAGER_LOCK = threading.Lock()
+
+
+def get_collection_manager():
+    """Process-wide collection manager - shared by every engine (and Streamlit session)"""
+    global _COLLECTION_MANAGER
+    with _COLLECTION_MANAGER_LOCK:
+        if _COLLECTION_MANAGER is None:
+            _COLLECTION_MANAGER = CollectionManager()
+            atexit.register(_COLLECTION_MANAGER.shutdown)
+        return _COLLECTION_MANAGER
@@ -0,0 +1,166 @@
+import uuid
+import zlib
+
+import numpy as np
+
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_SHINGLE_BASE = np.uint64(1000003)
+
+
+class MinHasher:
+    """
+    MinHash signatures over word shingles, vectorised with numpy
+
+    Text is normalised (lower-cased, split on whitespace) so chunks that
+    differ only in layout or case fingerprint the same.
+    """
+
+    def __init__(self, num_perm=64, shingle_size=3, seed=1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        # a < 2^31 and shingle hashes < 2^32 keep a*x + b inside uint64
+        self._a = rng.randint(1, 1 << 31, size=(num_perm, 1), dtype=np.int64).astype(np.uint64)
+        self._b = rng.randint(0, 1 << 31, size=(num_perm, 1), dtype=np.int64).astype(np.uint64)
+
+    def _shingle_hashes(self, text):
+        words = text.lower().split()
+        if not words:
+            return None
+        # crc32 is stable across processes, unlike hash()
+        codes = np.fromiter((zlib.crc32(word.encode('utf-8')) for word in words),
+                            dtype=np.uint64, count=len(words))
+        k = min(self.shingle_size, len(codes))
+
+        # Polynomial hash of every k-word shingle (uint64 wraps around), folded to 32 bits
+        hashes = np.zeros(len(codes) - k + 1, dtype=np.uint64)
+        for offset in range(k):
+            hashes = hashes * _SHINGLE_BASE + codes[offset:len(codes) - k + 1 + offset]
+        return np.unique((hashes ^ (hashes >> np.uint64(32))) & np.uint64(0xFFFFFFFF))
+
+    def signature(self, text):
+        """MinHash signature (uint64 array of num_perm), or None for empty text"""
+        hashes = self._shingle_hashes(text)
+        if hashes is None:
+            return None
+        return ((self._a * hashes[None, :] + self._b) % _MERSENNE_PRIME).min(axis=1)
+
+
+class ChunkDeduplicator:
+    """
+    Ingest-time near-duplicate elimination with MinHash + LSH
+
+    Signatures are split into bands; chunks sharing any band bucket are
+    candidates and are confirmed by estimated Jaccard similarity. The first
+    chunk seen stays (the representative), later near-duplicates are dropped
+    and recorded in the representative's 'duplicate_sources' metadata.
+    The index lives as long as the engine, so duplicates across files and
+    uploads collapse too.
+    """
+
+    def __init__(self, threshold=0.85, num_perm=64, bands=16):
+        """
+        Args:
+            threshold: Estimated Jaccard similarity at which chunks count as duplicates
+            num_perm: MinHash permutations
+            bands: LSH bands (num_perm must divide evenly) - more bands, more recall
+        """
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.hasher = MinHasher(num_perm=num_perm)
+        self.reset()
+
+    def reset(self):
+        self._buckets = [{} for _ in range(self.bands)]  # band bytes → [chunk_id]
+        self._signatures = {}  # chunk_id → signature
+        self.stats = {"seen": 0, "removed": 0}
+
+    def _band_keys(self, signature):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def find(self, signature):
+        """chunk_id of a stored near-duplicate, or None"""
+        candidates = []
+        for band, key in self._band_keys(signature):
+            for chunk_id in self._buckets[band].get(key, ()):
+                if chunk_id not in candidates:
+                    candidates.append(chunk_id)
+
+        for chunk_id in candidates:
+            similarity = float(np.mean(self._signatures[chunk_id] == signature))
+            if similarity >= self.threshold:
+                return chunk_id
+        return None
+
+    def add(self, signature, chunk_id):
+        self._signatures[chunk_id] = signature
+        for band, key in self._band_keys(signature):
+            self._buckets[band].setdefault(key, []).append(chunk_id)
+
+    def remove(self, chunk_ids):
+        """Forget deleted chunks - later copies of their text are kept again"""
+        for chunk_id in chunk_ids:
+            signature = self._signatures.pop(chunk_id, None)
+            if signature is None:
+                continue
+            for band, key in self._band_keys(signature):
+                bucket = self._buckets[band].get(key)
+                if bucket and chunk_id in bucket:
+                    bucket.remove(chunk_id)
+                    if not bucket:
+                        del self._buckets[band][key]
+
+    @staticmethod
+    def _reference(chunk):
+        return {key: chunk.metadata[key] for key in ("source", "page", "row", "sheet") if key in chunk.metadata}
+
+    def deduplicate(self, chunks, lookup=None):
+        """
+        Drop near-duplicate chunks
+
+        Every kept chunk gets a metadata['chunk_id'] (its vectorstore id).
+
+        Args:
+            chunks: Documents about to be embedded
+            lookup: fn(chunk_id) → stored Document, for representatives from
+                    earlier batches (their metadata is updated in place)
+
+        Returns:
+            Kept chunks, in order
+        """
+        kept = []
+        pending = {}
+        removed = 0
+
+        for chunk in chunks:
+            chunk_id = chunk.metadata.setdefault("chunk_id", uuid.uuid4().hex)
+            signature = self.hasher.signature(chunk.page_content)
+            if signature is None:
+                kept.append(chunk)
+                continue
+
+            duplicate_of = self.find(signature)
+            representative = None
+            if duplicate_of is not None:
+                representative = pending.get(duplicate_of) or (lookup(duplicate_of) if lookup else None)
+
+            if representative is None:
+                self.add(signature, chunk_id)
+                pending[chunk_id] = chunk
+                kept.append(chunk)
+                continue
+
+            representative.metadata.setdefault("duplicate_sources", []).append(self._reference(chunk))
+            removed += 1
+
+        self.stats["seen"] += len(chunks)
+        self.stats["removed"] += removed
+        if removed:
+            print(f"[Dedup] 🧹 {removed} of {len(chunks)} chunks were near-duplicates "
+                  f"({removed / len(chunks):.0%}); session total {self.stats['removed']} of {self.stats['seen']}")
+        return kept
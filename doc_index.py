@@ -0,0 +1,160 @@
+import re
+
+import numpy as np
+
+
+SECTION_PAGES = 10      # PDF pages per section
+SECTION_CHUNKS = 24     # chunks per section for documents without pages
+
+_SUMMARY_PATTERNS = [
+    r'\bsummar(y|ise|ize|ies)\b',
+    r'\boverview\b',
+    r'\bwhat (is|are) (this|that|the)? ?(\S+ )?(file|document|pdf|sheet|report)s? about\b',
+    r'\bmain (points|topics|ideas)\b',
+    r'\btl;?dr\b',
+]
+
+SUMMARY_PROMPT = """Summarize the document below for a search index.
+
+Document: {source}
+Excerpts:
+{context}
+
+Write 4-6 sentences: what the document is, its main topics and sections, and the key facts, names and numbers it contains.
+
+Summary:"""
+
+
+def is_summary_question(question):
+    question = question.lower()
+    return any(re.search(pattern, question) for pattern in _SUMMARY_PATTERNS)
+
+
+def _normalize(vector):
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _section_key(metadata, order):
+    page = metadata.get("page")
+    if isinstance(page, int):
+        return f"pages {page // SECTION_PAGES * SECTION_PAGES + 1}-{(page // SECTION_PAGES + 1) * SECTION_PAGES}"
+    return f"part {order // SECTION_CHUNKS + 1}"
+
+
+class DocumentIndex:
+    """
+    Document-level index over the chunk vectorstore
+
+    Per source file: centroid of its chunk vectors, per-section centroids
+    (page ranges, or runs of chunks) with the FAISS positions they cover,
+    and an LLM summary plus its embedding. Queries are routed to the best
+    documents first, then to their best sections.
+    """
+
+    def __init__(self):
+        self.entries = {}  # source → entry dict
+
+    def __contains__(self, source):
+        return source in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def build_entry(self, source, positions, vectors, metadatas):
+        """
+        Args:
+            source: File name
+            positions: FAISS positions of the file's chunks
+            vectors: Their vectors (n × dim)
+            metadatas: Their metadata dicts (document order is taken from page/start_index)
+        """
+        order = sorted(range(len(positions)), key=lambda i: (
+            metadatas[i].get("page", 0) if isinstance(metadatas[i].get("page"), int) else 0,
+            metadatas[i].get("row", 0), metadatas[i].get("start_index", 0)))
+
+        sections = {}
+        for rank, i in enumerate(order):
+            key = _section_key(metadatas[i], rank)
+            sections.setdefault(key, []).append(i)
+
+        self.entries[source] = {
+            "source": source,
+            "centroid": _normalize(vectors.mean(axis=0)),
+            "positions": [int(positions[i]) for i in order],
+            "sections": [
+                {"label": label, "centroid": _normalize(vectors[members].mean(axis=0)),
+                 "positions": [int(positions[i]) for i in members]}
+                for label, members in sections.items()
+            ],
+            "summary": None,
+            "summary_vector": None
+        }
+        return self.entries[source]
+
+    def set_summary(self, source, summary, summary_vector):
+        entry = self.entries.get(source)
+        if entry is not None:
+            entry["summary"] = summary
+            entry["summary_vector"] = _normalize(np.asarray(summary_vector, dtype=np.float32))
+
+    def remove(self, source):
+        self.entries.pop(source, None)
+
+    def remap(self, mapping):
+        """Apply a position mapping after compaction (mapping[old] = new, -1 = dropped)"""
+        def _remap(positions):
+            return [int(mapping[p]) for p in positions if mapping[p] >= 0]
+
+        for entry in self.entries.values():
+            entry["positions"] = _remap(entry["positions"])
+            for section in entry["sections"]:
+                section["positions"] = _remap(section["positions"])
+
+    def _score(self, entry, query_vector):
+        score = float(entry["centroid"] @ query_vector)
+        if entry["summary_vector"] is not None:
+            score = max(score, float(entry["summary_vector"] @ query_vector))
+        return score
+
+    def route(self, query_vector, max_documents=3, margin=0.1):
+        """Best-matching sources: up to max_documents within margin of the top score"""
+        if not self.entries:
+            return []
+        query_vector = _normalize(np.asarray(query_vector, dtype=np.float32))
+        scored = sorted(((self._score(entry, query_vector), source) for source, entry in self.entries.items()),
+                        reverse=True)
+        best = scored[0][0]
+        return [source for score, source in scored[:max_documents] if score >= best - margin]
+
+    def positions_for(self, sources, query_vector, min_sections=4, keep_fraction=0.5):
+        """
+        FAISS positions to search for the routed sources
+
+        Long documents are narrowed to their best-matching sections (at
+        least min_sections, or keep_fraction of them).
+        """
+        query_vector = _normalize(np.asarray(query_vector, dtype=np.float32))
+        positions = []
+        for source in sources:
+            sections = self.entries[source]["sections"]
+            keep = max(min_sections, int(len(sections) * keep_fraction + 0.5))
+            if len(sections) > keep:
+                sections = sorted(sections, key=lambda s: float(s["centroid"] @ query_vector), reverse=True)[:keep]
+            for section in sections:
+                positions.extend(section["positions"])
+        return positions
+
+    def summaries_for(self, sources):
+        return [(source, self.entries[source]["summary"]) for source in sources
+                if source in self.entries and self.entries[source]["summary"]]
+
+    def to_json(self):
+        return {
+            source: {
+                "positions": entry["positions"],
+                "summary": entry["summary"],
+                "sections": [{"label": s["label"], "positions": s["positions"]} for s in entry["sections"]]
+            }
+            for source, entry in self.entries.items()
+        }
@@ -0,0 +1,397 @@
+import os
+import json
+import time
+import inspect
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from ingest_cache import CACHE_ROOT
+from index_store import write_json_atomic
+
+try:
+    import onnxruntime as ort
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    ONNXRUNTIME_AVAILABLE = False
+
+
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+MAX_SEQ_LENGTH = 256           # sentence-transformers' limit for MiniLM - longer inputs are truncated
+ONNX_DIR = os.path.join(CACHE_ROOT, "onnx")
+
+# A backend is only used when its vectors agree with the reference
+# (HuggingFaceEmbeddings on PyTorch) at least this well
+AGREEMENT_MIN_COSINE = 0.98
+
+BACKENDS = ("torch", "onnx", "onnx-int8")
+
+_PROBE_TEXTS = [
+    "What are the rules for a player's turn?",
+    "Invoice total: 1,245.00 EUR, due within 30 days of receipt.",
+    "The quick brown fox jumps over the lazy dog.",
+    "Section 4.2 - Termination. Either party may terminate this agreement with ninety days written notice.",
+    "name: Alice\nrole: engineer\nteam: platform",
+    "Die Sitzung wurde um 14 Uhr beendet.",
+    "[Image: a bar chart comparing quarterly revenue across four regions]",
+    "ok",
+    " ".join(["The committee reviewed every submitted proposal in detail."] * 40),
+    "Rule 12: A card played face down cannot be revealed until the end of the round, "
+    "unless another rule explicitly allows it.",
+]
+
+
+def _model_dir(model_name):
+    safe = "".join(c if c.isalnum() or c in "-_." else "_" for c in model_name)
+    return os.path.join(ONNX_DIR, safe)
+
+
+def export_onnx(model_name=MODEL_NAME, quantize=False):
+    """
+    Export the transformer to ONNX once (and optionally int8-quantize it)
+
+    Returns:
+        Path of the .onnx file (cached under vectors/cache/onnx)
+    """
+    model_dir = _model_dir(model_name)
+    fp32_path = os.path.join(model_dir, "model.onnx")
+    int8_path = os.path.join(model_dir, "model.int8.onnx")
+    os.makedirs(model_dir, exist_ok=True)
+
+    if not os.path.exists(fp32_path):
+        import torch
+        from transformers import AutoModel
+
+        print(f"[Embed] Exporting {model_name} to ONNX (one-time)...")
+
+        class _LastHiddenState(torch.nn.Module):
+            def __init__(self, model):
+                super().__init__()
+                self.model = model
+
+            def forward(self, input_ids, attention_mask, token_type_ids):
+                return self.model(input_ids=input_ids, attention_mask=attention_mask,
+                                  token_type_ids=token_type_ids)[0]
+
+        model = _LastHiddenState(AutoModel.from_pretrained(model_name)).eval()
+        dummy = torch.ones((2, 16), dtype=torch.long)
+        dynamic = {0: "batch", 1: "sequence"}
+
+        export_kwargs = {}
+        if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+            export_kwargs["dynamo"] = False  # newer torch defaults to the dynamo exporter
+
+        tmp_path = f"{fp32_path}.tmp"
+        with torch.no_grad():
+            torch.onnx.export(
+                model, (dummy, dummy, torch.zeros_like(dummy)), tmp_path,
+                input_names=["input_ids", "attention_mask", "token_type_ids"],
+                output_names=["last_hidden_state"],
+                dynamic_axes={"input_ids": dynamic, "attention_mask": dynamic,
+                              "token_type_ids": dynamic, "last_hidden_state": dynamic},
+                opset_version=17,
+                **export_kwargs
+            )
+        os.replace(tmp_path, fp32_path)
+
+    if not quantize:
+        return fp32_path
+
+    if not os.path.exists(int8_path):
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+
+        print(f"[Embed] Quantizing {model_name} to int8 (one-time)...")
+        tmp_path = f"{int8_path}.tmp"
+        quantize_dynamic(fp32_path, tmp_path, weight_type=QuantType.QInt8)
+        os.replace(tmp_path, int8_path)
+    return int8_path
+
+
+class BatchedEmbeddings(Embeddings):
+    """
+    CPU-friendly sentence embeddings (mean pooling + L2 norm, same as all-MiniLM-L6-v2)
+
+    - Inputs are tokenized once, sorted by length and grouped into batches
+      by token budget, so short chunks aren't padded to the longest one
+    - Backend: 'torch' (transformers), 'onnx' (exported graph on
+      onnxruntime) or 'onnx-int8' (dynamically quantized graph)
+    - Every call reports its throughput
+    """
+
+    def __init__(self, model_name=MODEL_NAME, backend="onnx-int8", max_tokens_per_batch=8192,
+                 max_batch_size=128, max_length_ratio=2.0, num_threads=None):
+        """
+        Args:
+            model_name: HF model id or local path
+            backend: 'torch', 'onnx' or 'onnx-int8'
+            max_tokens_per_batch: Padded tokens per forward pass (batch size × longest input)
+            max_batch_size: Upper bound on inputs per forward pass
+            max_length_ratio: Start a new batch once the longest input would be this
+                              many times the shortest (caps padding at ~50%)
+            num_threads: Intra-op threads (default: all cores)
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown embedding backend '{backend}' (use one of {', '.join(BACKENDS)})")
+        if backend != "torch" and not ONNXRUNTIME_AVAILABLE:
+            raise RuntimeError("onnxruntime is not installed")
+
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        self.backend = backend
+        self.max_tokens_per_batch = max_tokens_per_batch
+        self.max_batch_size = max_batch_size
+        self.max_length_ratio = max_length_ratio
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self._pad_id = self.tokenizer.pad_token_id or 0
+        num_threads = num_threads or os.cpu_count() or 1
+
+        if backend == "torch":
+            import torch
+            from transformers import AutoModel
+            torch.set_num_threads(num_threads)
+            self._torch = torch
+            self._model = AutoModel.from_pretrained(model_name).eval()
+        else:
+            options = ort.SessionOptions()
+            options.intra_op_num_threads = num_threads
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            model_path = export_onnx(model_name, quantize=backend == "onnx-int8")
+            self._session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+
+    def _forward(self, input_ids, attention_mask):
+        """Token embeddings (batch, sequence, hidden) as float32 numpy"""
+        token_type_ids = np.zeros_like(input_ids)
+        if self.backend == "torch":
+            with self._torch.no_grad():
+                output = self._model(
+                    input_ids=self._torch.from_numpy(input_ids),
+                    attention_mask=self._torch.from_numpy(attention_mask),
+                    token_type_ids=self._torch.from_numpy(token_type_ids)
+                )[0]
+            return output.numpy()
+        return self._session.run(None, {
+            "input_ids": input_ids,
+            "attention_mask": attention_mask,
+            "token_type_ids": token_type_ids
+        })[0]
+
+    def _batches(self, lengths):
+        """Length-sorted index batches within the token budget"""
+        order = sorted(range(len(lengths)), key=lengths.__getitem__)
+        batch = []
+        for index in order:
+            # Sorted ascending, so the newest item is the longest in the batch
+            if batch and ((len(batch) + 1) * lengths[index] > self.max_tokens_per_batch
+                          or len(batch) >= self.max_batch_size
+                          or lengths[index] > self.max_length_ratio * lengths[batch[0]]):
+                yield batch
+                batch = []
+            batch.append(index)
+        if batch:
+            yield batch
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        start_time = time.time()
+
+        token_ids = self.tokenizer(list(texts), truncation=True, max_length=MAX_SEQ_LENGTH,
+                                   add_special_tokens=True)["input_ids"]
+        lengths = [len(ids) for ids in token_ids]
+        vectors = [None] * len(texts)
+        padded_tokens = 0
+
+        for batch in self._batches(lengths):
+            width = max(lengths[i] for i in batch)
+            padded_tokens += width * len(batch)
+            input_ids = np.full((len(batch), width), self._pad_id, dtype=np.int64)
+            attention_mask = np.zeros((len(batch), width), dtype=np.int64)
+            for row, index in enumerate(batch):
+                input_ids[row, :lengths[index]] = token_ids[index]
+                attention_mask[row, :lengths[index]] = 1
+
+            hidden = self._forward(input_ids, attention_mask)
+            mask = attention_mask[:, :, None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            for row, index in enumerate(batch):
+                vectors[index] = pooled[row].tolist()
+
+        elapsed = time.time() - start_time
+        if len(texts) > 1:
+            print(f"[Embed] {self.backend}: {len(texts)} chunks in {elapsed:.2f}s "
+                  f"({len(texts) / elapsed if elapsed else 0:.0f} chunks/s, "
+                  f"{sum(lengths) / padded_tokens:.0%} of padded tokens real)")
+        return vectors
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    LRU cache of query embeddings in front of any embedding model
+
+    Retries, edited resubmits and multi-query fan-out reuse vectors instead
+    of re-running the model. Document embedding passes straight through.
+    """
+
+    def __init__(self, base, max_size=512):
+        self.base = base
+        self.max_size = max_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, text):
+        with self._lock:
+            vector = self._cache.get(text)
+            if vector is not None:
+                self._cache.move_to_end(text)
+                self.hits += 1
+            return vector
+
+    def _put(self, text, vector):
+        with self._lock:
+            self._cache[text] = vector
+            self._cache.move_to_end(text)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def embed_documents(self, texts):
+        return self.base.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts):
+        """Embed several queries - cache misses go through the model in one batch"""
+        vectors = [self._get(text) for text in texts]
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if missing:
+            with self._lock:
+                self.misses += len(missing)
+            if len(missing) == 1:
+                computed = [self.base.embed_query(missing[0])]
+            else:
+                computed = self.base.embed_documents(missing)
+            fresh = dict(zip(missing, computed))
+            for text, vector in fresh.items():
+                self._put(text, vector)
+            vectors = [vector if vector is not None else fresh[text] for text, vector in zip(texts, vectors)]
+        return vectors
+
+    def is_cached(self, text):
+        with self._lock:
+            return text in self._cache
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+def check_agreement(candidate, reference, texts=None):
+    """
+    Compare two embedding models on the same texts
+
+    Returns:
+        dict with min and mean cosine similarity between their vectors
+    """
+    texts = texts or _PROBE_TEXTS
+    a = np.asarray(candidate.embed_documents(texts), dtype=np.float32)
+    b = np.asarray(reference.embed_documents(texts), dtype=np.float32)
+    cosine = (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+    return {"min_cosine": float(cosine.min()), "mean_cosine": float(cosine.mean())}
+
+
+def _reference_embeddings(model_name):
+    """The current embedding setup: HuggingFaceEmbeddings on PyTorch, fixed batches of 32"""
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(
+        model_name=model_name,
+        model_kwargs={'device': 'cpu'},
+        encode_kwargs={'normalize_embeddings': True, 'batch_size': 32}
+    )
+
+
+def load_verified_backend(backend, model_name=MODEL_NAME, **kwargs):
+    """
+    Build a backend whose vectors were checked against the reference model
+
+    The agreement check runs once per backend (result cached next to the
+    exported graph). Returns None when the backend disagrees, fails to load
+    or can't be verified - an unreadable result file counts as not verified
+    and is removed, so the next start checks again.
+    """
+    try:
+        embeddings = BatchedEmbeddings(model_name=model_name, backend=backend, **kwargs)
+    except Exception as e:
+        print(f"[Embed] ⚠️ {backend} backend unavailable: {e}")
+        return None
+
+    report_path = os.path.join(_model_dir(model_name), "agreement.json")
+    reports = {}
+    if os.path.exists(report_path):
+        try:
+            with open(report_path, 'r', encoding='utf-8') as f:
+                reports = json.load(f)
+            if backend in reports:
+                reports[backend] = {key: float(reports[backend][key]) for key in ("min_cosine", "mean_cosine")}
+        except (OSError, ValueError, TypeError, KeyError) as e:
+            print(f"[Embed] ⚠️ Unreadable {report_path} ({e}) - {backend} not verified, not used")
+            try:
+                os.unlink(report_path)
+            except OSError:
+                pass
+            return None
+
+    if backend not in reports:
+        try:
+            reports[backend] = check_agreement(embeddings, _reference_embeddings(model_name))
+            os.makedirs(os.path.dirname(report_path), exist_ok=True)
+            write_json_atomic(report_path, reports)
+        except Exception as e:
+            print(f"[Embed] ⚠️ Could not verify the {backend} backend ({e}) - not used")
+            return None
+
+    report = reports[backend]
+    if report["min_cosine"] < AGREEMENT_MIN_COSINE:
+        print(f"[Embed] ⚠️ {backend} disagrees with the reference vectors "
+              f"(min cosine {report['min_cosine']:.4f}) - not used")
+        return None
+
+    print(f"[Embed] ✅ {backend} backend (agreement: min cosine {report['min_cosine']:.4f}, "
+          f"mean {report['mean_cosine']:.4f})")
+    return embeddings
+
+
+if __name__ == "__main__":
+    # Throughput + agreement for every backend:  python embeddings.py [model]
+    import sys
+    import random
+
+    model_name = sys.argv[1] if len(sys.argv) > 1 else MODEL_NAME
+    random.seed(0)
+    words = " ".join(_PROBE_TEXTS).split()
+    texts = [" ".join(random.choices(words, k=random.randint(5, 250))) for _ in range(512)]
+
+    reference = _reference_embeddings(model_name)
+    start_time = time.time()
+    reference.embed_documents(texts)
+    reference_rate = len(texts) / (time.time() - start_time)
+    print(f"[Bench] reference (HuggingFaceEmbeddings, batch 32): {reference_rate:.0f} chunks/s")
+
+    for backend in BACKENDS:
+        if backend != "torch" and not ONNXRUNTIME_AVAILABLE:
+            continue
+        embeddings = BatchedEmbeddings(model_name=model_name, backend=backend)
+        start_time = time.time()
+        embeddings.embed_documents(texts)
+        rate = len(texts) / (time.time() - start_time)
+        agreement = check_agreement(embeddings, reference, texts[:64])
+        print(f"[Bench] {backend}: {rate:.0f} chunks/s ({rate / reference_rate:.1f}x), "
+              f"min cosine {agreement['min_cosine']:.4f}, mean {agreement['mean_cosine']:.4f}")
@@ -0,0 +1,199 @@
+import time
+
+from langchain_core.documents import Document
+
+
+DEFAULT_SEPARATORS = ["\n\n\n", "\n\n", "\n", ". ", " ", ""]
+
+
+class FastTextSplitter:
+    """
+    Offset-based drop-in for RecursiveCharacterTextSplitter
+
+    Produces exactly the same chunks as langchain's splitter with its
+    defaults (literal separators, keep_separator=True, strip_whitespace=True)
+    but works on (start, end) offsets into the source string: pieces are
+    never copied, re-joined or re-measured, and each chunk is sliced once.
+    Chunks carry their character span in metadata.
+    """
+
+    def __init__(self, chunk_size=1500, chunk_overlap=400, separators=None, length_function=None):
+        """
+        Args:
+            chunk_size: Max chunk length (in length_function units)
+            chunk_overlap: Overlap carried between chunks
+            separators: Literal separators, strongest first (default: section → char)
+            length_function: Optional fn(str) → int, e.g. a token counter.
+                             Default is character length computed from offsets.
+        """
+        if chunk_overlap > chunk_size:
+            raise ValueError(f"chunk_overlap ({chunk_overlap}) is larger than chunk_size ({chunk_size})")
+        self._chunk_size = chunk_size
+        self._chunk_overlap = chunk_overlap
+        self._separators = list(separators or DEFAULT_SEPARATORS)
+        self._length_function = length_function
+
+    @classmethod
+    def from_huggingface_tokenizer(cls, tokenizer, **kwargs):
+        """Token-aware splitter - chunk_size/chunk_overlap are counted in the tokenizer's tokens"""
+        def _token_length(text):
+            return len(tokenizer.encode(text, add_special_tokens=False))
+        return cls(length_function=_token_length, **kwargs)
+
+    def _length(self, text, start, end):
+        if self._length_function is None:
+            return end - start
+        return self._length_function(text[start:end])
+
+    def _pieces(self, text, start, end, separator):
+        """
+        Offsets where each piece begins - a piece starts at a separator match
+        (the separator is kept at the start of the piece, like keep_separator=True)
+        """
+        if not separator:
+            return list(range(start, end))
+
+        starts = [start]
+        step = len(separator)
+        position = text.find(separator, start, end)
+        while position != -1:
+            if position != start:
+                starts.append(position)
+            position = text.find(separator, position + step, end)
+        return starts
+
+    def _merge(self, text, pieces, chunk_spans):
+        """Combine contiguous pieces into chunks, carrying up to chunk_overlap of the previous chunk"""
+        chunk_size = self._chunk_size
+        chunk_overlap = self._chunk_overlap
+        separator_len = 0 if self._length_function is None else self._length_function("")
+
+        current = []  # indexes into pieces
+        lengths = []
+        total = 0
+        for i, (piece_start, piece_end, piece_len) in enumerate(pieces):
+            if total + piece_len + (separator_len if current else 0) > chunk_size:
+                if current:
+                    self._emit(text, pieces[current[0]][0], pieces[current[-1]][1], chunk_spans)
+                    while total > chunk_overlap or (
+                        total + piece_len + (separator_len if current else 0) > chunk_size and total > 0
+                    ):
+                        total -= lengths[0] + (separator_len if len(current) > 1 else 0)
+                        current.pop(0)
+                        lengths.pop(0)
+            current.append(i)
+            lengths.append(piece_len)
+            total += piece_len + (separator_len if len(current) > 1 else 0)
+
+        if current:
+            self._emit(text, pieces[current[0]][0], pieces[current[-1]][1], chunk_spans)
+
+    @staticmethod
+    def _emit(text, start, end, chunk_spans):
+        """Record the stripped span of text[start:end] (empty chunks are dropped)"""
+        chunk = text[start:end]
+        stripped = chunk.lstrip()
+        start += len(chunk) - len(stripped)
+        stripped = stripped.rstrip()
+        if stripped:
+            chunk_spans.append((start, start + len(stripped)))
+
+    def _split(self, text, start, end, separators, chunk_spans):
+        separator = separators[-1]
+        remaining = []
+        for i, candidate in enumerate(separators):
+            if not candidate:
+                separator = candidate
+                break
+            if text.find(candidate, start, end) != -1:
+                separator = candidate
+                remaining = separators[i + 1:]
+                break
+
+        starts = self._pieces(text, start, end, separator)
+        good = []
+        for i, piece_start in enumerate(starts):
+            piece_end = starts[i + 1] if i + 1 < len(starts) else end
+            piece_len = self._length(text, piece_start, piece_end)
+            if piece_len < self._chunk_size:
+                good.append((piece_start, piece_end, piece_len))
+                continue
+
+            if good:
+                self._merge(text, good, chunk_spans)
+                good = []
+            if not remaining:
+                # Oversized piece with no separator left - kept verbatim, as langchain does
+                chunk_spans.append((piece_start, piece_end))
+            else:
+                self._split(text, piece_start, piece_end, remaining, chunk_spans)
+
+        if good:
+            self._merge(text, good, chunk_spans)
+
+    def split_spans(self, text):
+        """Chunk (start, end) offsets into text"""
+        chunk_spans = []
+        if text:
+            self._split(text, 0, len(text), self._separators, chunk_spans)
+        return chunk_spans
+
+    def split_text(self, text):
+        return [text[start:end] for start, end in self.split_spans(text)]
+
+    def split_documents(self, documents):
+        """Split Documents; each chunk gets start_index/end_index into its source document"""
+        chunks = []
+        for document in documents:
+            text = document.page_content
+            for start, end in self.split_spans(text):
+                metadata = dict(document.metadata)
+                metadata["start_index"] = start
+                metadata["end_index"] = end
+                chunks.append(Document(page_content=text[start:end], metadata=metadata))
+        return chunks
+
+
+if __name__ == "__main__":
+    # Benchmark + equivalence check against langchain's splitter:
+    #   python fast_splitter.py [file ...]
+    import sys
+    import random
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    if len(sys.argv) > 1:
+        texts = []
+        for path in sys.argv[1:]:
+            with open(path, encoding='utf-8', errors='replace') as f:
+                texts.append(f.read())
+    else:
+        random.seed(0)
+        vocabulary = ["rule", "section", "the", "player", "must", "a", "of", "turn", "card", "score",
+                      "x" * 40, "y" * 1700]
+        def _paragraph():
+            sentences = [" ".join(random.choices(vocabulary[:-1], k=random.randint(3, 40)))
+                         for _ in range(random.randint(1, 12))]
+            return ". ".join(sentences) + random.choice([".", "", "\n" + random.choice(vocabulary)])
+        texts = ["\n\n".join(_paragraph() for _ in range(400)) + "\n\n\n" + vocabulary[-1] for _ in range(20)]
+
+    reference = RecursiveCharacterTextSplitter(
+        chunk_size=1500, chunk_overlap=400, separators=DEFAULT_SEPARATORS, length_function=len
+    )
+    fast = FastTextSplitter(chunk_size=1500, chunk_overlap=400)
+
+    start_time = time.perf_counter()
+    expected = [reference.split_text(text) for text in texts]
+    reference_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    actual = [fast.split_text(text) for text in texts]
+    fast_time = time.perf_counter() - start_time
+
+    total_chars = sum(len(text) for text in texts)
+    total_chunks = sum(len(chunks) for chunks in expected)
+    print(f"[Splitter] {len(texts)} text(s), {total_chars / 1e6:.1f}M chars, {total_chunks} chunks")
+    print(f"[Splitter] langchain: {reference_time:.3f}s ({total_chars / reference_time / 1e6:.1f}M chars/s)")
+    print(f"[Splitter] fast:      {fast_time:.3f}s ({total_chars / fast_time / 1e6:.1f}M chars/s, "
+          f"{reference_time / fast_time:.1f}x)")
+    print(f"[Splitter] Identical output: {'✅' if actual == expected else '❌'}")
+    sys.exit(0 if actual == expected else 1)
@@ -0,0 +1,290 @@
+import io
+import json
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from ingest_cache import ContentCache, hash_bytes
+from ocr_engine import TESSERACT_AVAILABLE, get_ocr_pool
+
+try:
+    from PIL import Image, ImageSequence
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+
+# Triage thresholds - an image is "text-heavy" (index straight from OCR) when
+# tesseract finds enough confident words covering enough of the image
+TRIAGE_MIN_WORDS = 40
+TRIAGE_MIN_CONFIDENCE = 70.0
+TRIAGE_MIN_COVERAGE = 0.08
+TRIAGE_WORD_CONFIDENCE = 60.0
+
+# Vision preprocessing - llama3.2-vision works on 560px tiles (max 2x2), llava
+# on 336/672px; anything larger is resized by Ollama anyway
+VISION_MAX_SIDE = 1120
+VISION_JPEG_QUALITY = 85
+VISION_MAX_FRAMES = 8
+
+
+def parse_tesseract_tsv(tsv):
+    """
+    Parse tesseract TSV output
+
+    Returns:
+        (text, stats) where text keeps tesseract's line/paragraph layout and
+        stats holds word count, mean confidence and text-area coverage
+    """
+    lines = tsv.splitlines()
+    if not lines:
+        return "", {"words": 0, "mean_confidence": 0.0, "coverage": 0.0}
+
+    page_area = 0
+    word_area = 0
+    confidences = []
+    layout = []  # [(block, par, line), word]
+
+    for row in lines[1:]:
+        cols = row.split('\t')
+        if len(cols) < 12:
+            continue
+        try:
+            level = int(cols[0])
+            width, height = int(cols[8]), int(cols[9])
+            conf = float(cols[10])
+        except ValueError:
+            continue
+
+        if level == 1:
+            page_area = max(page_area, width * height)
+            continue
+
+        word = cols[11].strip()
+        if level != 5 or not word:
+            continue
+
+        layout.append(((int(cols[2]), int(cols[3]), int(cols[4])), word))
+        if conf >= TRIAGE_WORD_CONFIDENCE:
+            confidences.append(conf)
+            word_area += width * height
+
+    # Rebuild text: words → lines → paragraphs
+    text_parts = []
+    prev_key = None
+    for key, word in layout:
+        if prev_key is None:
+            text_parts.append(word)
+        elif key == prev_key:
+            text_parts.append(" " + word)
+        elif key[:2] == prev_key[:2]:
+            text_parts.append("\n" + word)
+        else:
+            text_parts.append("\n\n" + word)
+        prev_key = key
+
+    stats = {
+        "words": len(confidences),
+        "mean_confidence": sum(confidences) / len(confidences) if confidences else 0.0,
+        "coverage": (word_area / page_area) if page_area else 0.0
+    }
+    return "".join(text_parts), stats
+
+
+def is_text_heavy(stats):
+    """Decide whether OCR output alone is a good enough representation of the image"""
+    return (
+        stats["words"] >= TRIAGE_MIN_WORDS
+        and stats["mean_confidence"] >= TRIAGE_MIN_CONFIDENCE
+        and stats["coverage"] >= TRIAGE_MIN_COVERAGE
+    )
+
+
+def triage_image(image_bytes):
+    """
+    OCR-first triage
+
+    Returns:
+        dict with route ('ocr' or 'vision'), OCR text and density stats.
+        Without tesseract everything routes to the vision model.
+    """
+    if not TESSERACT_AVAILABLE:
+        return {"route": "vision", "text": "", "stats": None}
+
+    try:
+        tsv = get_ocr_pool().submit_image_tsv(image_bytes).result()
+    except Exception as e:
+        print(f"[Triage] ⚠️ OCR failed, falling back to vision: {e}")
+        return {"route": "vision", "text": "", "stats": None}
+
+    text, stats = parse_tesseract_tsv(tsv)
+    route = "ocr" if is_text_heavy(stats) else "vision"
+    print(f"[Triage] {stats['words']} words, conf {stats['mean_confidence']:.0f}, "
+          f"coverage {stats['coverage']:.0%} → {route.upper()}")
+    return {"route": route, "text": text, "stats": stats}
+
+
+def _to_rgb(frame):
+    """Flatten alpha onto white and convert palette/CMYK/16-bit modes to RGB"""
+    if frame.mode in ("RGBA", "LA") or (frame.mode == "P" and "transparency" in frame.info):
+        frame = frame.convert("RGBA")
+        background = Image.new("RGB", frame.size, (255, 255, 255))
+        background.paste(frame, mask=frame.split()[-1])
+        return background
+    if frame.mode != "RGB":
+        return frame.convert("RGB")
+    return frame
+
+
+def prepare_image_for_vision(image_bytes, max_side=VISION_MAX_SIDE, max_frames=VISION_MAX_FRAMES,
+                             quality=VISION_JPEG_QUALITY):
+    """
+    Decode, downsample and re-encode an image for the vision model
+
+    Multi-frame GIF/TIFF files are split into frames (evenly sampled, at most
+    max_frames). Each frame is resized to fit max_side and encoded as JPEG.
+
+    Returns:
+        dict with frames (list of JPEG bytes), frame_indices, frame_count
+        (frames in the source), bytes_before, bytes_after and pixel sizes
+    """
+    passthrough = {
+        "frames": [image_bytes],
+        "frame_indices": [0],
+        "frame_count": 1,
+        "bytes_before": len(image_bytes),
+        "bytes_after": len(image_bytes),
+        "size_before": None,
+        "size_after": None,
+        "mime_type": None
+    }
+    if not PIL_AVAILABLE:
+        return passthrough
+
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        size_before = image.size
+        source_format = image.format
+        frame_count = getattr(image, "n_frames", 1)
+
+        if frame_count > max_frames:
+            step = frame_count / max_frames
+            wanted = {int(i * step) for i in range(max_frames)}
+        else:
+            wanted = set(range(frame_count))
+
+        frames = []
+        size_after = None
+        for index, frame in enumerate(ImageSequence.Iterator(image)):
+            if index not in wanted:
+                continue
+            frame = _to_rgb(frame.copy())
+            frame.thumbnail((max_side, max_side), Image.LANCZOS)
+            size_after = frame.size
+
+            buffer = io.BytesIO()
+            frame.save(buffer, format="JPEG", quality=quality, optimize=True)
+            frames.append(buffer.getvalue())
+
+        # A small JPEG that already fits is sent as-is - re-encoding would only lose quality
+        if (frame_count == 1 and source_format == "JPEG" and size_after == size_before
+                and len(frames[0]) >= len(image_bytes)):
+            passthrough.update(size_before=size_before, size_after=size_before, mime_type="image/jpeg")
+            return passthrough
+
+        return {
+            "frames": frames,
+            "frame_indices": sorted(wanted),
+            "frame_count": frame_count,
+            "bytes_before": len(image_bytes),
+            "bytes_after": sum(len(f) for f in frames),
+            "size_before": size_before,
+            "size_after": size_after,
+            "mime_type": "image/jpeg"
+        }
+
+    except Exception as e:
+        print(f"[Vision] ⚠️ Preprocessing failed, sending original bytes: {e}")
+        return passthrough
+
+
+class ImageAnalysisCache:
+    """Finished image analyses keyed by image hash + analyser, so an image is never analysed twice"""
+
+    def __init__(self):
+        self.cache = ContentCache("image_analysis")
+
+    @staticmethod
+    def key(image_bytes, analyser):
+        safe = "".join(c if c.isalnum() or c in "-_." else "_" for c in analyser)
+        return f"{hash_bytes(image_bytes)}-{safe}"
+
+    def get(self, key):
+        """Cached analysis as {'descriptions': [...one per frame], 'method': ...} or None"""
+        data = self.cache.get_text(key)
+        if data is None:
+            return None
+        try:
+            entry = json.loads(data)
+        except ValueError:
+            return None
+        if "descriptions" not in entry:
+            # Written before multi-frame images were split: one description
+            if "description" not in entry:
+                return None
+            entry["descriptions"] = [entry.pop("description")]
+        return entry
+
+    def put(self, key, descriptions, method):
+        if isinstance(descriptions, str):
+            descriptions = [descriptions]
+        self.cache.put_text(key, json.dumps({"descriptions": descriptions, "method": method}))
+
+
+def is_transient_error(error):
+    """Connection drops, timeouts and 'server busy' answers from Ollama are worth retrying"""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    name = type(error).__name__
+    if name in ("ConnectError", "ConnectTimeout", "ReadTimeout", "ReadError",
+                "RemoteProtocolError", "PoolTimeout", "WriteTimeout"):
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in
+               ("timed out", "timeout", "connection", "503", "429", "too many requests", "server busy"))
+
+
+class VisionBatchProcessor:
+    """
+    Concurrent vision analysis for multi-image uploads
+    - At most max_concurrency analyses in flight (match OLLAMA_NUM_PARALLEL)
+    - Futures are returned in submission order, so results keep upload order
+    - Transient failures are retried with exponential backoff + jitter
+    """
+
+    def __init__(self, max_concurrency=2, max_retries=3, base_delay=2.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="vision")
+
+    def run_with_retry(self, fn, *args, label="vision call"):
+        """Call fn(*args), retrying transient errors; non-transient errors raise immediately"""
+        attempt = 0
+        while True:
+            try:
+                return fn(*args)
+            except Exception as e:
+                attempt += 1
+                if attempt > self.max_retries or not is_transient_error(e):
+                    raise
+                delay = self.base_delay * (2 ** (attempt - 1)) * (1 + random.random() * 0.25)
+                print(f"[Vision] ⚠️ {label} failed ({e}), retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+
+    def submit(self, fn, *args):
+        return self._executor.submit(fn, *args)
+
+    def map_ordered(self, fn, items):
+        """Submit fn(item) for every item; returns futures in the same order as items"""
+        return [self._executor.submit(fn, item) for item in items]
@@ -0,0 +1,462 @@
+import os
+import re
+import json
+import time
+import threading
+
+import numpy as np
+from langchain_core.documents import Document
+
+
+MANIFEST_NAME = "manifest.json"
+FORMAT_VERSION = 1
+MERGE_MIN_SEGMENTS = 8      # merge once this many segments exist
+MERGE_MIN_DELETED = 0.2     # ... or this share of stored chunks is deleted
+
+_SEGMENT_FILE = re.compile(r"^seg-\d{6}\.(npy|jsonl)$")
+
+
+def _fsync_dir(directory):
+    """Make a rename durable (no-op where directories can't be opened, e.g. Windows)"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def write_json_atomic(path, data):
+    """Write JSON to a temp file, fsync, then rename over path - readers never see a partial file"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_dir(os.path.dirname(path) or ".")
+
+
+class SegmentStore:
+    """
+    Crash-safe, append-only persistence for the chunk index
+
+    Every save writes one new segment - seg-NNNNNN.npy (vectors of the new
+    chunks) and seg-NNNNNN.jsonl (their text/metadata, metadata updates of
+    older chunks, new parent sections) - then atomically swaps in a small
+    manifest listing the live segments and deleted ids. A crash leaves the
+    previous manifest in place; unreferenced segment files are removed on
+    the next load. Segments are merged in the background as they pile up.
+    """
+
+    def __init__(self, directory, read_only=False):
+        """
+        Args:
+            directory: Collection (or bundle) directory
+            read_only: Mounted bundle - loads only, never writes, merges or cleans up
+        """
+        self.directory = directory
+        self.read_only = read_only
+        self._lock = threading.Lock()  # one manifest writer at a time
+        self._merging = False
+        self._resets = 0  # a merge that started before a reset must not write its result back
+        self.manifest = self._read_manifest()
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, MANIFEST_NAME)
+
+    def _empty_manifest(self):
+        return {"format": FORMAT_VERSION, "dim": None, "next_segment": 1, "generation": 0, "segments": [],
+                "deleted": [], "embedding_model": None}
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path, encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return self._empty_manifest()
+        if manifest.get("format") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported index format {manifest.get('format')} in {self.manifest_path}")
+        return manifest
+
+    def _path(self, name, extension):
+        return os.path.join(self.directory, f"{name}.{extension}")
+
+    def _write_segment(self, name, vectors, records):
+        """Segment files are complete and fsynced before any manifest points at them"""
+        with open(self._path(name, "npy"), 'wb') as f:
+            np.save(f, np.asarray(vectors, dtype=np.float32))
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self._path(name, "jsonl"), 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def commit(self, chunks=(), vectors=None, updates=(), parents=(), deleted=(), embedding_model=None,
+               checkpoint=None):
+        """
+        Append one segment and swap the manifest
+
+        Args:
+            chunks: New chunk Documents (metadata['chunk_id'] is their id)
+            vectors: Their vectors, same order (n × dim)
+            updates: Already stored chunks whose metadata changed
+            parents: New parent section Documents as (parent_id, Document)
+            deleted: Ids (chunks or parents) deleted since the last commit
+            embedding_model: Recorded so a different model can't silently mix vectors in
+            checkpoint: Optional (name, state) stored in the same manifest swap - the
+                        progress of a batch ingestion becomes durable with its data
+
+        Returns:
+            Segment name, or None when there was nothing to write
+        """
+        chunks = list(chunks)
+        if self.read_only:
+            raise ValueError(f"{self.directory} is read-only")
+        if not (chunks or updates or parents or deleted):
+            if checkpoint is not None:
+                self.set_checkpoint(*checkpoint)
+            return None
+
+        records = [{"op": "add", "id": c.metadata["chunk_id"], "text": c.page_content, "metadata": c.metadata}
+                   for c in chunks]
+        records += [{"op": "update", "id": c.metadata["chunk_id"], "metadata": c.metadata} for c in updates]
+        records += [{"op": "parent", "id": parent_id, "text": p.page_content, "metadata": p.metadata}
+                    for parent_id, p in parents]
+        if vectors is None or not len(chunks):
+            vectors = np.zeros((0, self.manifest["dim"] or 0), dtype=np.float32)
+
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            manifest = dict(self.manifest)
+            if len(chunks):
+                manifest["dim"] = manifest["dim"] or int(np.asarray(vectors).shape[1])
+            name = f"seg-{manifest['next_segment']:06d}"
+            self._write_segment(name, vectors, records)
+
+            manifest["next_segment"] += 1
+            manifest["generation"] = manifest.get("generation", 0) + 1
+            manifest["segments"] = manifest["segments"] + [{"name": name, "chunks": len(chunks)}]
+            manifest["deleted"] = manifest["deleted"] + list(deleted)
+            manifest["embedding_model"] = manifest["embedding_model"] or embedding_model
+            if checkpoint is not None:
+                manifest["checkpoints"] = self._with_checkpoint(manifest, *checkpoint)
+            write_json_atomic(self.manifest_path, manifest)
+            self.manifest = manifest
+        return name
+
+    def _with_checkpoint(self, manifest, name, state):
+        checkpoints = dict(manifest.get("checkpoints", {}))
+        if state is None:
+            checkpoints.pop(name, None)
+        else:
+            checkpoints[name] = state
+        return checkpoints
+
+    def get_checkpoint(self, name):
+        return self.manifest.get("checkpoints", {}).get(name)
+
+    def set_checkpoint(self, name, state):
+        """Record a checkpoint (state None removes it) without writing a segment"""
+        if self.read_only:
+            raise ValueError(f"{self.directory} is read-only")
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            manifest = dict(self.manifest)
+            manifest["checkpoints"] = self._with_checkpoint(manifest, name, state)
+            write_json_atomic(self.manifest_path, manifest)
+            self.manifest = manifest
+
+    def _scan_segments(self, segments, deleted):
+        """
+        First pass over segments: live chunk ids in index order with their
+        vector rows, and the latest metadata of updated chunks - text is
+        not kept
+
+        Returns:
+            (ids, {id: (vector block, row)}, {id: metadata}, parent ids)
+        """
+        order = []
+        blocks = {}
+        updates = {}
+        parent_ids = []
+        for segment in segments:
+            vectors = np.load(self._path(segment["name"], "npy"), mmap_mode="r")
+            row = 0
+            for record in self._records(segment):
+                chunk_id = record["id"]
+                if record["op"] == "add":
+                    order.append(chunk_id)
+                    blocks[chunk_id] = (vectors, row)
+                    row += 1
+                elif record["op"] == "update":
+                    if chunk_id in blocks:
+                        updates[chunk_id] = record["metadata"]
+                elif record["op"] == "parent":
+                    parent_ids.append(chunk_id)
+
+        ids = [chunk_id for chunk_id in order if chunk_id not in deleted]
+        parent_ids = [parent_id for parent_id in dict.fromkeys(parent_ids) if parent_id not in deleted]
+        return ids, blocks, updates, parent_ids
+
+    def _records(self, segment):
+        with open(self._path(segment["name"], "jsonl"), encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def _stacked_vectors(self, ids, blocks, dim):
+        vectors = np.empty((len(ids), dim or 0), dtype=np.float32)
+        for position, chunk_id in enumerate(ids):
+            block, row = blocks[chunk_id]
+            vectors[position] = block[row]
+        return vectors
+
+    def _replay(self, segments, deleted, updates, docstore, parent_store, batch_size=1000):
+        """Second pass: stream chunk and parent text into the docstores in batches"""
+        docstore.clear()
+        parent_store.clear()
+        chunks = {}
+        parents = {}
+        for segment in segments:
+            for record in self._records(segment):
+                chunk_id = record["id"]
+                if chunk_id in deleted:
+                    continue
+                if record["op"] == "add":
+                    chunks[chunk_id] = Document(page_content=record["text"],
+                                                metadata=updates.get(chunk_id, record["metadata"]))
+                elif record["op"] == "parent":
+                    parents[chunk_id] = Document(page_content=record["text"], metadata=record["metadata"])
+                if len(chunks) >= batch_size:
+                    docstore.update(chunks)
+                    chunks = {}
+                if len(parents) >= batch_size:
+                    parent_store.update(parents)
+                    parents = {}
+        docstore.update(chunks)
+        parent_store.update(parents)
+
+    def load(self, docstore, parent_store, embedding_model=None):
+        """
+        Replay the manifest's segments
+
+        Chunk and parent text go straight into the (disk-backed) docstores;
+        only ids and vectors are held in memory. When the docstores already
+        hold this manifest's generation the text isn't rewritten at all;
+        a read-only store (mounted bundle) is never replayed.
+
+        Args:
+            docstore: Chunk docstore (SQLiteDocstore)
+            parent_store: Parent section docstore (SQLiteDocstore)
+            embedding_model: Expected model - ValueError if the index was built with another
+
+        Returns:
+            dict with ids (index order), vectors (n × dim float32),
+            embedding_model and rebuilt - or None when nothing is stored
+        """
+        with self._lock:
+            self.manifest = self._read_manifest()
+            manifest = self.manifest
+            if not self.read_only:
+                self._remove_orphans()
+        if not manifest["segments"]:
+            return None
+        if embedding_model and manifest["embedding_model"] and manifest["embedding_model"] != embedding_model:
+            raise ValueError(f"Saved index was built with {manifest['embedding_model']}, not {embedding_model}")
+        if self.read_only:
+            return self._load_mounted(manifest, docstore)
+
+        deleted = set(manifest["deleted"])
+        ids, blocks, updates, parent_ids = self._scan_segments(manifest["segments"], deleted)
+        current = (docstore.get_meta("generation") == str(manifest.get("generation", 0))
+                   and not docstore.missing(ids) and not parent_store.missing(parent_ids))
+        if current:
+            # Rows of a session that crashed before saving
+            docstore.retain(ids)
+            parent_store.retain(parent_ids)
+        else:
+            self._replay(manifest["segments"], deleted, updates, docstore, parent_store)
+            self.mark_current(docstore)
+        return {
+            "ids": ids,
+            "vectors": self._stacked_vectors(ids, blocks, manifest["dim"]),
+            "embedding_model": manifest["embedding_model"],
+            "rebuilt": not current
+        }
+
+    def _load_mounted(self, manifest, docstore):
+        """
+        Bundle: one segment whose rows are in the sealed docstore's row
+        order - ids come from the docstore and the vectors stay memory-mapped,
+        so no segment record is parsed
+        """
+        if (len(manifest["segments"]) != 1 or manifest["deleted"]
+                or docstore.get_meta("generation") != str(manifest.get("generation", 0))):
+            raise ValueError(f"Docstore in {self.directory} doesn't match its manifest")
+        ids = docstore.ids()
+        vectors = np.load(self._path(manifest["segments"][0]["name"], "npy"), mmap_mode="r")
+        if len(vectors) != len(ids):
+            raise ValueError(f"{self.directory}: {len(vectors)} vectors for {len(ids)} chunks")
+        return {"ids": ids, "vectors": vectors, "embedding_model": manifest["embedding_model"], "rebuilt": False}
+
+    def mark_current(self, docstore):
+        """Record that the docstore file matches the current manifest (lets the next load skip the replay)"""
+        docstore.set_meta("generation", self.manifest.get("generation", 0))
+
+    def _remove_segment(self, name):
+        for extension in ("jsonl", "npy"):
+            path = self._path(name, extension)
+            if os.path.exists(path):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+    def _remove_orphans(self):
+        """Segment files no manifest refers to (a crash between write and swap, or a finished merge)"""
+        if not os.path.isdir(self.directory):
+            return
+        live = {segment["name"] for segment in self.manifest["segments"]}
+        for file_name in os.listdir(self.directory):
+            if _SEGMENT_FILE.match(file_name) and file_name.rsplit(".", 1)[0] not in live:
+                try:
+                    os.unlink(os.path.join(self.directory, file_name))
+                except OSError:
+                    pass
+
+    def needs_merge(self):
+        if self.read_only:
+            return False
+        manifest = self.manifest
+        stored = sum(segment["chunks"] for segment in manifest["segments"])
+        return (len(manifest["segments"]) >= MERGE_MIN_SEGMENTS
+                or (stored and len(manifest["deleted"]) >= stored * MERGE_MIN_DELETED))
+
+    def merge(self):
+        """
+        Rewrite the current segments as one, dropping deleted chunks
+
+        Commits made while the merge runs are kept: only the merged segments
+        and the deletions applied to them are replaced in the new manifest.
+
+        Returns:
+            Number of segments merged
+        """
+        with self._lock:
+            if self._merging or len(self.manifest["segments"]) < 2:
+                return 0
+            self._merging = True
+            resets = self._resets
+            snapshot = self.manifest
+            name = f"seg-{snapshot['next_segment']:06d}"
+            # Reserve the name so concurrent commits don't reuse it
+            self.manifest = dict(snapshot, next_segment=snapshot["next_segment"] + 1)
+
+        try:
+            start_time = time.time()
+            deleted = set(snapshot["deleted"])
+            try:
+                ids, blocks, updates, _ = self._scan_segments(snapshot["segments"], deleted)
+                self._write_segment(name, self._stacked_vectors(ids, blocks, snapshot["dim"]),
+                                    self._merged_records(snapshot["segments"], deleted, updates))
+            except OSError:
+                if resets == self._resets:
+                    raise
+                # A reset removed the segments being read
+                self._remove_segment(name)
+                return 0
+
+            with self._lock:
+                if resets != self._resets:
+                    # Cleared meanwhile - the merged chunks are gone too
+                    self._remove_segment(name)
+                    print(f"[IndexStore] Dropped merge into {name}: the store was reset meanwhile")
+                    return 0
+                merged = {segment["name"] for segment in snapshot["segments"]}
+                manifest = dict(self.manifest)
+                manifest["segments"] = [{"name": name, "chunks": len(ids)}] + [
+                    segment for segment in manifest["segments"] if segment["name"] not in merged]
+                # Deletions already applied are dropped; later ones may still refer to newer segments
+                manifest["deleted"] = [chunk_id for chunk_id in manifest["deleted"] if chunk_id not in deleted]
+                write_json_atomic(self.manifest_path, manifest)
+                self.manifest = manifest
+                self._remove_orphans()
+
+            print(f"[IndexStore] 🗜️ Merged {len(merged)} segments into {name} ({len(ids)} chunks) "
+                  f"in {time.time() - start_time:.2f}s")
+            return len(merged)
+        finally:
+            self._merging = False
+
+    def export(self, directory, docstore, parent_store):
+        """
+        Write the live chunks as one segment with its own manifest into
+        another directory (a bundle), and fill that directory's docstores
+        with their text - the result loads without a replay
+
+        Merges wait until the export is done, so no segment it reads is removed.
+
+        Args:
+            directory: Empty target directory
+            docstore: Chunk docstore in the target directory
+            parent_store: Parent docstore in the target directory
+
+        Returns:
+            The exported manifest
+        """
+        while True:
+            with self._lock:
+                if not self._merging:
+                    self._merging = True
+                    snapshot = self.manifest
+                    break
+            time.sleep(0.1)
+
+        try:
+            deleted = set(snapshot["deleted"])
+            ids, blocks, updates, _ = self._scan_segments(snapshot["segments"], deleted)
+            target = SegmentStore(directory)
+            name = f"seg-{1:06d}"
+            os.makedirs(directory, exist_ok=True)
+            target._write_segment(name, self._stacked_vectors(ids, blocks, snapshot["dim"]),
+                                  self._merged_records(snapshot["segments"], deleted, updates))
+            manifest = dict(target._empty_manifest(), dim=snapshot["dim"], next_segment=2, generation=1,
+                            segments=[{"name": name, "chunks": len(ids)}],
+                            embedding_model=snapshot["embedding_model"])
+            write_json_atomic(target.manifest_path, manifest)
+            target.manifest = manifest
+            target._replay(manifest["segments"], set(), {}, docstore, parent_store)
+            target.mark_current(docstore)
+            return manifest
+        finally:
+            self._merging = False
+
+    def _merged_records(self, segments, deleted, updates):
+        """Live add records (with their latest metadata), then live parents - streamed, in index order"""
+        for segment in segments:
+            for record in self._records(segment):
+                if record["op"] == "add" and record["id"] not in deleted:
+                    yield dict(record, metadata=updates.get(record["id"], record["metadata"]))
+        seen = set()
+        for segment in segments:
+            for record in self._records(segment):
+                if record["op"] == "parent" and record["id"] not in deleted and record["id"] not in seen:
+                    seen.add(record["id"])
+                    yield record
+
+    def reset(self):
+        """Forget everything stored (a fresh index replaces it on the next commit)"""
+        with self._lock:
+            self._resets += 1
+            # Numbering continues, so a merge still writing can't collide with a new segment
+            self.manifest = dict(self._empty_manifest(), next_segment=self.manifest["next_segment"])
+            if os.path.exists(self.manifest_path):
+                os.unlink(self.manifest_path)
+            self._remove_orphans()
@@ -0,0 +1,75 @@
+import os
+import hashlib
+import tempfile
+
+
+CACHE_ROOT = os.path.join("vectors", "cache")
+
+
+def hash_bytes(data):
+    """SHA-256 of a bytes-like object"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(file_path, block_size=1 << 20):
+    """SHA-256 of a file, read in blocks so large files are never fully in memory"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ContentCache:
+    """
+    Content-addressed on-disk cache for ingestion results
+
+    Entries live under vectors/cache/<namespace>/<key[:2]>/<key> and are
+    written to a temp file first, then renamed into place, so a crash never
+    leaves a half-written entry behind.
+    """
+
+    def __init__(self, namespace, root=CACHE_ROOT):
+        self.namespace = namespace
+        self.cache_dir = os.path.join(root, namespace)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def has(self, key):
+        return os.path.exists(self._path(key))
+
+    def get_bytes(self, key):
+        """Return cached bytes or None"""
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except (FileNotFoundError, OSError):
+            return None
+
+    def put_bytes(self, key, data):
+        """Store bytes atomically (temp file + rename)"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"[Cache] ⚠️ Could not write {self.namespace}/{key}: {e}")
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+    def get_text(self, key):
+        data = self.get_bytes(key)
+        return data.decode('utf-8') if data is not None else None
+
+    def put_text(self, key, text):
+        self.put_bytes(key, text.encode('utf-8'))
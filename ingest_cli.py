@@ -0,0 +1,285 @@
+import io
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from collection_manager import DEFAULT_COLLECTION
+
+
+# Everything the upload widget in app.py accepts
+SUPPORTED_TYPES = {"pdf", "docx", "doc", "txt", "rtf", "md", "csv", "xlsx", "xls", "ods", "json", "xml",
+                   "yaml", "yml", "png", "jpg", "jpeg", "bmp", "tiff", "gif", "webp"}
+CHECKPOINT_EVERY = 25   # files between checkpoints
+STAGES = ("read", "parse", "embed", "stream", "save")
+
+
+def list_files(root):
+    """Supported files under root as sorted '/'-separated relative paths (hidden entries skipped)"""
+    paths = []
+    for directory, dirs, files in os.walk(root):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for file_name in files:
+            if file_name.startswith('.'):
+                continue
+            if os.path.splitext(file_name)[1].lower().lstrip('.') in SUPPORTED_TYPES:
+                paths.append(os.path.relpath(os.path.join(directory, file_name), root).replace(os.sep, "/"))
+    return sorted(paths)
+
+
+class StageStats:
+    """Files, chunks, bytes and busy time per pipeline stage"""
+
+    def __init__(self):
+        self.stages = {stage: {"files": 0, "chunks": 0, "bytes": 0, "seconds": 0.0} for stage in STAGES}
+        self._lock = threading.Lock()  # read/parse are recorded from the worker threads
+
+    def add(self, stage, seconds, files=0, chunks=0, size=0):
+        with self._lock:
+            stats = self.stages[stage]
+            stats["files"] += files
+            stats["chunks"] += chunks
+            stats["bytes"] += size
+            stats["seconds"] += seconds
+
+    def report(self, wall_seconds, files, chunks, size):
+        """
+        One line per stage that ran, then the whole run
+
+        Parse time is summed over the worker threads, so its rates are per
+        worker; the total line is wall-clock throughput.
+        """
+        lines = []
+        for stage, stats in self.stages.items():
+            if stats["files"] or stats["seconds"]:
+                lines.append(_rate_line(stage, stats["seconds"], stats["files"], stats["chunks"], stats["bytes"]))
+        lines.append(_rate_line("total", wall_seconds, files, chunks, size))
+        return "\n".join(lines)
+
+
+def _rate_line(label, seconds, files, chunks, size):
+    per_second = 1 / seconds if seconds else 0.0
+    megabytes = size / (1 << 20)
+    return (f"  {label:<6} {seconds:8.1f}s  {files:6d} files ({files * per_second:7.1f}/s)  "
+            f"{chunks:8d} chunks ({chunks * per_second:8.1f}/s)  {megabytes:9.1f} MB ({megabytes * per_second:7.1f} MB/s)")
+
+
+class BatchIngestor:
+    """
+    Ingest a directory tree into a collection without the UI
+
+    Files are read and parsed by a pool of workers (images by the engine's
+    vision pool) a bounded window ahead, and embedded in path order on the
+    calling thread. Every CHECKPOINT_EVERY files the new chunks are saved
+    together with a checkpoint - the last file done - in the same manifest
+    swap, so an interrupted or crashed run resumes after the last saved
+    file and never loses or duplicates one. Files already in the
+    collection are replaced once their new version has parsed; if it
+    can't be read, the indexed version is kept.
+    """
+
+    def __init__(self, engine, root, workers=4, checkpoint_every=CHECKPOINT_EVERY):
+        """
+        Args:
+            engine: RAGEngine with the target collection open
+            root: Directory to ingest - its relative paths become the source names
+            workers: Files read and parsed in parallel
+            checkpoint_every: Files between saves/checkpoints
+        """
+        self.engine = engine
+        self.root = os.path.abspath(root)
+        self.workers = max(1, workers)
+        self.checkpoint_every = max(1, checkpoint_every)
+        self.checkpoint_name = f"ingest:{self.root}"
+        self.stats = StageStats()
+
+    def _parse(self, relpath):
+        """Worker: read one file and chunk it"""
+        start_time = time.time()
+        with open(os.path.join(self.root, relpath), 'rb') as f:
+            buffer = io.BytesIO(f.read())
+        buffer.name = relpath
+        size = len(buffer.getbuffer())
+        self.stats.add("read", time.time() - start_time, files=1, size=size)
+
+        start_time = time.time()
+        chunks = self.engine.process_uploaded_file(buffer)
+        self.stats.add("parse", time.time() - start_time, files=1, chunks=len(chunks), size=size)
+        return chunks
+
+    def _submit(self, pool, relpath):
+        if self.engine._is_image_file(self.engine._detect_file_type(relpath)):
+            return self.engine.vision_batch.submit(self._parse, relpath)
+        return pool.submit(self._parse, relpath)
+
+    def _checkpoint(self, state, saved, finished=False):
+        """
+        Save everything embedded so far along with the progress (a finished
+        run removes its checkpoint instead) - returns the new saved state
+
+        Raises whatever the save raised - the run must not go on (or report
+        success) with progress that isn't durable
+        """
+        start_time = time.time()
+        self.engine._save_vectorstore(checkpoint=(self.checkpoint_name, None if finished else dict(state)),
+                                      raise_errors=True)
+        self.stats.add("save", time.time() - start_time, files=state["files"] - saved["files"],
+                       chunks=state["chunks"] - saved["chunks"], size=state["bytes"] - saved["bytes"])
+        return dict(state)
+
+    def run(self, restart=False):
+        """
+        Ingest every supported file under root (resuming a saved checkpoint)
+
+        Args:
+            restart: Ignore a saved checkpoint and start from the first file
+
+        Returns:
+            Progress dict - files, chunks and bytes ingested, last file done
+        """
+        engine = self.engine
+        engine._check_writable()
+        engine.load_index()
+
+        paths = list_files(self.root)
+        state = None if restart else engine.segment_store.get_checkpoint(self.checkpoint_name)
+        if state:
+            paths = [relpath for relpath in paths if relpath > state["last"]]
+            print(f"[Ingest] ⏩ Resuming after {state['last']} ({state['files']} files done, {len(paths)} to go)")
+        else:
+            state = {"root": self.root, "last": "", "files": 0, "chunks": 0, "bytes": 0,
+                     "started": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+            print(f"[Ingest] 📁 {len(paths)} file(s) under {self.root} → collection '{engine.collection.name}'")
+
+        indexed = set(engine.metadata_index.values("source")) | set(engine.processed_documents)
+        pending = deque()
+        todo = iter(paths)
+        done_since_save = []
+        start = saved = dict(state)
+        start_time = time.time()
+
+        def fill(pool):
+            while len(pending) < self.workers * 2:
+                relpath = next(todo, None)
+                if relpath is None:
+                    return
+                size = os.path.getsize(os.path.join(self.root, relpath))
+                if engine._should_stream(relpath, size):
+                    pending.append((relpath, size, None))  # streamed on this thread when its turn comes
+                else:
+                    pending.append((relpath, size, self._submit(pool, relpath)))
+
+        pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ingest")
+        try:
+            fill(pool)
+            while pending:
+                relpath, size, future = pending[0]
+                if future is None:
+                    engine._replace_indexed(relpath, indexed)
+                    stage_start = time.time()
+                    chunks = engine.ingest_text_stream(os.path.join(self.root, relpath), relpath)
+                    self.stats.add("stream", time.time() - stage_start, files=1, chunks=chunks, size=size)
+                else:
+                    try:
+                        parsed = future.result()
+                    except Exception as e:
+                        # One unreadable file shouldn't stop a nightly reload - an indexed version stays
+                        print(f"[Ingest] ⚠️ Skipping {relpath}{' (previous version kept)' if relpath in indexed else ''}: {e}")
+                        parsed = []
+                    else:
+                        engine._replace_indexed(relpath, indexed, parsed)
+                    stage_start = time.time()
+                    chunks = engine.add_to_vectorstore(parsed)
+                    self.stats.add("embed", time.time() - stage_start, files=1, chunks=chunks, size=size)
+                pending.popleft()
+
+                state.update(last=relpath, files=state["files"] + 1, chunks=state["chunks"] + chunks,
+                             bytes=state["bytes"] + size)
+                done_since_save.append(relpath)
+                if len(done_since_save) >= self.checkpoint_every:
+                    saved = self._checkpoint(state, saved)
+                    engine._schedule_document_index(done_since_save)
+                    print(f"[Ingest] 💾 Checkpoint: {state['files']} files, {state['chunks']} chunks "
+                          f"(last {relpath})")
+                    done_since_save = []
+                fill(pool)
+        except KeyboardInterrupt:
+            print(f"[Ingest] ⏸️ Interrupted - waiting for {len(pending)} file(s) in flight")
+            self._abandon(pending, indexed)
+            self._checkpoint(state, saved)
+            engine._schedule_document_index(done_since_save)
+            print(f"[Ingest] 💾 Checkpoint saved after {state['last'] or '(nothing)'} - run again to resume")
+            raise
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+        # Finished - the checkpoint goes with the last save
+        self._checkpoint(state, saved, finished=True)
+        engine._schedule_document_index(done_since_save)
+        self._print_report(time.time() - start_time, state, start)
+        return state
+
+    def _abandon(self, pending, indexed):
+        """Drop files parsed ahead of the last one embedded (indexed versions stay listed)"""
+        for relpath, _, future in pending:
+            if future is not None and not future.cancel():
+                try:
+                    future.result()
+                except Exception:
+                    pass
+            self.engine.processed_documents = [name for name in self.engine.processed_documents
+                                               if name != relpath]
+            if relpath in indexed:
+                self.engine.processed_documents.append(relpath)
+
+    def _print_report(self, wall_seconds, state, start):
+        files = state["files"] - start["files"]
+        chunks = state["chunks"] - start["chunks"]
+        size = state["bytes"] - start["bytes"]
+        resumed = f" ({state['files']} files / {state['chunks']} chunks with the resumed run)" if start["files"] else ""
+        print(f"[Ingest] ✅ {files} file(s), {chunks} chunks in {wall_seconds:.1f}s{resumed}")
+        print(self.stats.report(wall_seconds, files, chunks, size))
+
+
+if __name__ == "__main__":
+    # Nightly reload of a document share, outside the UI:
+    #   python ingest_cli.py /mnt/share/docs --collection docs [--workers 8]
+    # Interrupted runs resume from the last checkpoint when started again.
+    import sys
+    import argparse
+    from rag_engine_enhanced import RAGEngine
+
+    parser = argparse.ArgumentParser(description="Ingest a directory tree into a collection")
+    parser.add_argument("root", help="Directory to ingest (relative paths become source names)")
+    parser.add_argument("--collection", default=DEFAULT_COLLECTION)
+    parser.add_argument("--workers", type=int, default=4, help="Files read and parsed in parallel")
+    parser.add_argument("--checkpoint-every", type=int, default=CHECKPOINT_EVERY, help="Files between checkpoints")
+    parser.add_argument("--restart", action="store_true", help="Ignore a saved checkpoint")
+    parser.add_argument("--chunking", default="standard", choices=["standard", "parent_child"])
+    parser.add_argument("--model", default="qwen2.5:7b", help="Ollama model for document summaries")
+    parser.add_argument("--vision-model", default="llama3.2-vision:latest")
+    parser.add_argument("--vision-concurrency", type=int, default=2)
+    parser.add_argument("--embedding-backend", default="auto")
+    parser.add_argument("--num-shards", type=int, default=1)
+    parser.add_argument("--shard-by", default="hash")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.root):
+        parser.error(f"{args.root} is not a directory")
+
+    engine = RAGEngine(model=args.model, vision_model=args.vision_model, chunking_mode=args.chunking,
+                       vision_concurrency=args.vision_concurrency, embedding_backend=args.embedding_backend,
+                       collection=args.collection, num_shards=args.num_shards, shard_by=args.shard_by)
+    try:
+        BatchIngestor(engine, args.root, workers=args.workers, checkpoint_every=args.checkpoint_every).run(
+            restart=args.restart)
+    except KeyboardInterrupt:
+        sys.exit(130)
+    except Exception as e:
+        print(f"[Ingest] ❌ Ingestion stopped: {e}")
+        sys.exit(1)
+    finally:
+        # Document summaries and compaction were queued in the background
+        engine.summary_pool.shutdown(wait=True)
+        engine.maintenance_pool.shutdown(wait=True)
@@ -0,0 +1,91 @@
+import os
+import json
+import time
+
+from embeddings import MODEL_NAME
+from index_store import write_json_atomic
+from ingest_cache import hash_file
+
+
+BUNDLE_MANIFEST = "bundle.json"
+BUNDLE_FORMAT = 1
+BUNDLES_DIR = "bundles"  # under the vectors root - bundles dropped here are mounted as read-only collections
+
+
+def is_bundle(directory):
+    return os.path.isfile(os.path.join(directory, BUNDLE_MANIFEST))
+
+
+def write_bundle_manifest(directory, name, dim, chunks, documents, chunking, embedding_model=MODEL_NAME):
+    """
+    Describe a finished bundle directory - written last, so a bundle without
+    bundle.json is incomplete
+
+    Args:
+        name: Collection name the bundle mounts/imports as by default
+        dim: Vector dimension
+        chunks: Number of chunks
+        documents: Source files in the bundle
+        chunking: Chunking parameters the chunks were built with
+
+    Returns:
+        The manifest dict
+    """
+    files = {}
+    for file_name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, file_name)
+        if file_name != BUNDLE_MANIFEST and os.path.isfile(path):
+            files[file_name] = {"bytes": os.path.getsize(path), "sha256": hash_file(path)}
+    manifest = {
+        "format": BUNDLE_FORMAT,
+        "name": name,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "embedding_model": embedding_model,
+        "dim": dim,
+        "chunks": chunks,
+        "documents": list(documents),
+        "chunking": chunking,
+        "files": files
+    }
+    write_json_atomic(os.path.join(directory, BUNDLE_MANIFEST), manifest)
+    return manifest
+
+
+def read_bundle(directory, verify=False):
+    """
+    Read and check a bundle's manifest
+
+    Bundles built with another embedding model are refused - their vectors
+    can't be compared with this node's queries.
+
+    Args:
+        directory: Bundle directory
+        verify: Also compare every file's SHA-256 (reads the whole bundle);
+                otherwise only file sizes are checked
+
+    Raises:
+        ValueError: Not a bundle, unsupported format, wrong embedding model,
+                    or missing/changed files
+    """
+    path = os.path.join(directory, BUNDLE_MANIFEST)
+    try:
+        with open(path, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except OSError:
+        raise ValueError(f"{directory} is not a knowledge-base bundle (no {BUNDLE_MANIFEST})")
+    except ValueError as e:
+        raise ValueError(f"Unreadable bundle manifest {path}: {e}")
+
+    if manifest.get("format") != BUNDLE_FORMAT:
+        raise ValueError(f"Unsupported bundle format {manifest.get('format')} in {directory}")
+    if manifest.get("embedding_model") != MODEL_NAME:
+        raise ValueError(f"Bundle {directory} was built with {manifest.get('embedding_model')}, "
+                         f"this node embeds with {MODEL_NAME} - re-export it with {MODEL_NAME}")
+
+    for file_name, expected in manifest["files"].items():
+        file_path = os.path.join(directory, file_name)
+        if not os.path.isfile(file_path) or os.path.getsize(file_path) != expected["bytes"]:
+            raise ValueError(f"Bundle {directory}: {file_name} is missing or has the wrong size")
+        if verify and hash_file(file_path) != expected["sha256"]:
+            raise ValueError(f"Bundle {directory}: checksum mismatch in {file_name}")
+    return manifest
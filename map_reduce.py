@@ -0,0 +1,223 @@
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from image_pipeline import is_transient_error
+
+
+# Questions that need the whole document rather than the top-k chunks
+_EXHAUSTIVE_PATTERNS = [
+    r'\blist (all|every|each)\b',
+    r'\b(all|every) (the )?(rules|items|steps|requirements|names|dates|entries|sections|points)\b',
+    r'\bcomplete list\b',
+    # Counting across the documents - not "how many days of leave do I get?"
+    r'\bhow many (different |distinct |separate )?\w+( \w+)? (are|were) (there|listed|mentioned|defined|named)\b',
+    r'\b(summari[sz]e|summary of|overview of) (the )?(whole|entire|full|complete)\b',
+    # Asking for everything - not "is everything in section 2 mandatory?"
+    r'\b(list|give me|show me|tell me|find) everything\b',
+    r'\beverything (that is |that\'s )?(mentioned|listed|said|written) (about|on|regarding)\b',
+]
+
+NONE_MARKER = "NONE"
+
+MAP_PROMPT = """You are reading one excerpt of a larger document set.
+
+Excerpt ({position}):
+{context}
+
+Question: {question}
+
+Extract EVERYTHING in this excerpt that helps answer the question - every matching item, number, name and rule, in the order they appear.
+Quote list items completely. Do not add anything that is not in the excerpt.
+If the excerpt contains nothing relevant, answer exactly: {none}
+
+Relevant content:"""
+
+REDUCE_PROMPT = """Below are partial answers to the same question, each extracted from a different part of the documents, in document order.
+
+{partials}
+
+Question: {question}
+
+Combine them into ONE complete answer:
+- Keep EVERY distinct item from every partial answer, in document order
+- Merge duplicates (the same item mentioned in several partials) into one
+- Do not add information that is not in the partial answers
+
+Combined answer:"""
+
+
+def is_exhaustive_question(question):
+    """Heuristic: does the question ask for everything rather than the best matches?"""
+    question = question.lower()
+    return any(re.search(pattern, question) for pattern in _EXHAUSTIVE_PATTERNS)
+
+
+def group_chunks(chunks, max_chars):
+    """Consecutive chunks packed into groups of at most max_chars (a single large chunk forms its own group)"""
+    groups = []
+    current = []
+    size = 0
+    for chunk in chunks:
+        length = len(chunk.page_content)
+        if current and size + length > max_chars:
+            groups.append(current)
+            current = []
+            size = 0
+        current.append(chunk)
+        size += length
+    if current:
+        groups.append(current)
+    return groups
+
+
+def _describe_group(group):
+    sources = []
+    for chunk in group:
+        label = chunk.metadata.get("source", "Unknown")
+        if isinstance(chunk.metadata.get("page"), int):
+            label += f" p.{chunk.metadata['page'] + 1}"
+        if label not in sources:
+            sources.append(label)
+    if len(sources) > 2:
+        return f"{sources[0]} … {sources[-1]}"
+    return ", ".join(sources)
+
+
+class MapReduceAnswerer:
+    """
+    Map-reduce answering over many chunk groups
+
+    - Map: the question is asked of every group, at most max_concurrency
+      Ollama calls in flight (match OLLAMA_NUM_PARALLEL)
+    - Reduce: partial answers are merged in batches that fit the context,
+      level by level, until one answer is left
+    - Compute cap: at most max_map_calls map calls and time_budget seconds;
+      whatever was skipped is reported with the answer
+    """
+
+    def __init__(self, llm, max_concurrency=2, max_map_calls=48, time_budget=600,
+                 reduce_max_chars=12000, max_retries=2):
+        self.llm = llm
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_map_calls = max_map_calls
+        self.time_budget = time_budget
+        self.reduce_max_chars = reduce_max_chars
+        self.max_retries = max_retries
+
+    def _invoke(self, prompt):
+        attempt = 0
+        while True:
+            try:
+                return self.llm.invoke(prompt).content.strip()
+            except Exception as e:
+                attempt += 1
+                if attempt > self.max_retries or not is_transient_error(e):
+                    raise
+                time.sleep(2 ** attempt)
+
+    def _map(self, question, group, position):
+        context = "\n\n---\n\n".join(chunk.page_content for chunk in group)
+        answer = self._invoke(MAP_PROMPT.format(
+            position=position, context=context, question=question, none=NONE_MARKER))
+        if not answer or answer.strip(" .").upper() == NONE_MARKER:
+            return None
+        return answer
+
+    def _map_before_deadline(self, question, group, position, deadline):
+        if time.time() > deadline:
+            raise TimeoutError("map-reduce time budget exhausted")
+        return self._map(question, group, position)
+
+    def _reduce(self, question, partials):
+        numbered = "\n\n".join(f"[Part {i}]\n{partial}" for i, partial in enumerate(partials, 1))
+        return self._invoke(REDUCE_PROMPT.format(partials=numbered, question=question))
+
+    def _reduce_batches(self, partials):
+        """Split partial answers into batches under reduce_max_chars (at least two per batch)"""
+        batches = []
+        current = []
+        size = 0
+        for partial in partials:
+            if len(current) >= 2 and size + len(partial) > self.reduce_max_chars:
+                batches.append(current)
+                current = []
+                size = 0
+            current.append(partial)
+            size += len(partial)
+        if current:
+            batches.append(current)
+        return batches
+
+    def run(self, question, groups, progress_callback=None):
+        """
+        Args:
+            question: User question
+            groups: Chunk groups in priority order (only the first max_map_calls run)
+            progress_callback: Optional fn(stage, done, total) - 'map' / 'reduce'
+
+        Returns:
+            dict with answer, mapped, relevant, skipped and elapsed
+        """
+        start_time = time.time()
+        deadline = start_time + self.time_budget
+        selected = groups[:self.max_map_calls]
+        skipped = len(groups) - len(selected)
+
+        def _report(stage, done, total):
+            print(f"[MapReduce] {stage}: {done}/{total}")
+            if progress_callback:
+                progress_callback(stage, done, total)
+
+        # Map - results are put back in document order before reducing
+        partials = [None] * len(selected)
+        mapped = 0
+        finished = 0
+        with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="map") as executor:
+            futures = {}
+            for index, group in enumerate(selected):
+                position = f"part {index + 1} of {len(selected)}: {_describe_group(group)}"
+                futures[executor.submit(self._map_before_deadline, question, group, position, deadline)] = index
+
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    partials[index] = future.result()
+                    mapped += 1
+                except TimeoutError:
+                    skipped += 1
+                except Exception as e:
+                    print(f"[MapReduce] ⚠️ Map call {index + 1} failed: {e}")
+                    skipped += 1
+                finished += 1
+                _report("map", finished, len(selected))
+
+        partials = [partial for partial in partials if partial]
+        relevant = len(partials)
+        print(f"[MapReduce] {relevant} of {mapped} groups had relevant content")
+
+        if not partials:
+            answer = "I could not find anything in the documents that answers this question."
+        else:
+            # Reduce - level by level, batches of one level run concurrently
+            level = 0
+            while len(partials) > 1:
+                level += 1
+                batches = self._reduce_batches(partials)
+                with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="reduce") as executor:
+                    results = list(executor.map(
+                        lambda batch: batch[0] if len(batch) == 1 else self._reduce(question, batch), batches))
+                _report(f"reduce level {level}", len(batches), len(batches))
+                if len(results) >= len(partials):
+                    # Nothing could be merged (every partial is too large) - stop here
+                    break
+                partials = results
+            answer = "\n\n".join(partials)
+
+        return {
+            "answer": answer,
+            "mapped": mapped,
+            "relevant": relevant,
+            "skipped": skipped,
+            "elapsed": time.time() - start_time
+        }
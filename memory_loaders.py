@@ -0,0 +1,137 @@
+import io
+import csv
+import json
+import os
+
+from langchain_core.documents import Document
+
+from pdf_loader import ParallelPDFLoader
+
+try:
+    import docx2txt
+    DOCX2TXT_AVAILABLE = True
+except ImportError:
+    DOCX2TXT_AVAILABLE = False
+
+
+# Formats that can be parsed straight from the upload buffer - everything
+# else (RTF, XML, legacy .doc) still goes through a temp file
+IN_MEMORY_TYPES = {'pdf', 'docx', 'csv', 'json', 'txt', 'md', 'markdown', 'yaml', 'yml'}
+
+
+class MemoryViewReader(io.RawIOBase):
+    """
+    Read-only, seekable file object over a bytes buffer / memoryview
+    Lets pypdf, zipfile, openpyxl and pandas parse an upload without copying it
+    """
+
+    def __init__(self, buffer):
+        self._view = memoryview(buffer).cast('B')
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = len(self._view) + offset
+        self._pos = max(0, self._pos)
+        return self._pos
+
+    def readinto(self, target):
+        end = min(self._pos + len(target), len(self._view))
+        count = max(0, end - self._pos)
+        target[:count] = self._view[self._pos:end]
+        self._pos = end
+        return count
+
+    def readall(self):
+        data = bytes(self._view[self._pos:])
+        self._pos = len(self._view)
+        return data
+
+    def close(self):
+        self._view.release()
+        super().close()
+
+
+def get_upload_buffer(uploaded_file):
+    """Zero-copy view of an upload (Streamlit's UploadedFile is a BytesIO)"""
+    if hasattr(uploaded_file, "getbuffer"):
+        return uploaded_file.getbuffer()
+    return memoryview(uploaded_file.getvalue())
+
+
+def _load_csv(buffer, file_name):
+    """Same output as CSVLoader: one Document per row, 'column: value' lines"""
+    documents = []
+    text = io.TextIOWrapper(io.BufferedReader(MemoryViewReader(buffer)), encoding='utf-8', newline='')
+    try:
+        for i, row in enumerate(csv.DictReader(text)):
+            content = "\n".join(
+                f"{k.strip() if k is not None else k}: "
+                f"{v.strip() if isinstance(v, str) else ','.join(map(str.strip, v)) if isinstance(v, list) else v}"
+                for k, v in row.items()
+            )
+            documents.append(Document(page_content=content, metadata={"source": file_name, "row": i}))
+    finally:
+        text.detach()
+    return documents
+
+
+def _load_json(buffer, file_name):
+    """Same output as JSONLoader(jq_schema='.', text_content=False)"""
+    data = json.loads(str(buffer, 'utf-8'))
+    if isinstance(data, str):
+        content = data
+    elif isinstance(data, (dict, list)):
+        content = json.dumps(data) if data else ""
+    else:
+        content = str(data) if data is not None else ""
+    return [Document(page_content=content, metadata={"source": file_name, "seq_num": 1})]
+
+
+def load_from_buffer(buffer, file_name, file_type=None):
+    """
+    Load a document straight from memory
+
+    Args:
+        buffer: bytes, bytearray or memoryview with the file content
+        file_name: Original file name (used for metadata)
+        file_type: Extension without dot (derived from file_name if omitted)
+
+    Returns:
+        List (or lazy iterator, for PDFs) of Documents, or None when the
+        format needs a real path on disk
+    """
+    file_type = file_type or os.path.splitext(file_name)[1].lower().lstrip('.')
+    if file_type not in IN_MEMORY_TYPES:
+        return None
+
+    if file_type == 'pdf':
+        return ParallelPDFLoader(data=buffer, source_name=file_name).lazy_load()
+
+    if file_type == 'docx':
+        if not DOCX2TXT_AVAILABLE:
+            return None
+        with MemoryViewReader(buffer) as reader:
+            return [Document(page_content=docx2txt.process(reader), metadata={"source": file_name})]
+
+    if file_type == 'csv':
+        return _load_csv(buffer, file_name)
+
+    if file_type == 'json':
+        return _load_json(buffer, file_name)
+
+    # Plain text formats (txt, md, yaml)
+    return [Document(page_content=str(buffer, 'utf-8'), metadata={"source": file_name})]
@@ -0,0 +1,145 @@
+import os
+import re
+
+
+INDEXED_FIELDS = ("source", "file_type", "page", "sheet", "type")
+
+# Words in a question that scope it to a kind of file
+FILE_TYPE_WORDS = {
+    "pdf": ("pdf",),
+    "spreadsheet": ("xlsx", "xls", "csv"),
+    "excel": ("xlsx", "xls"),
+    "csv": ("csv",),
+    "word": ("docx", "doc"),
+    "docx": ("docx",),
+    "presentation": ("pptx", "ppt"),
+    "powerpoint": ("pptx", "ppt"),
+    "slide": ("pptx", "ppt"),
+    "markdown": ("md", "markdown"),
+    "image": ("png", "jpg", "jpeg", "gif", "bmp", "webp", "tiff", "tif"),
+    "screenshot": ("png", "jpg", "jpeg", "webp"),
+    "photo": ("jpg", "jpeg", "png", "heic"),
+}
+
+_FILE_TYPE_PATTERN = re.compile(
+    r"\b(?:in|from|across|within) (?:the|my|these|those|all|our)? ?(\w+?)s?(?: files?| documents?| sheets?)?\b"
+    r"|\b(\w+?)s? (?:files?|documents?)\b", re.IGNORECASE)
+_PAGE_PATTERN = re.compile(r"\b(?:pages?|p\.)\s*(\d+)(?:\s*(?:-|–|to|through)\s*(\d+))?", re.IGNORECASE)
+
+
+def file_type_of(source):
+    return os.path.splitext(source or "")[1].lstrip(".").lower()
+
+
+class MetadataIndex:
+    """
+    Inverted index over chunk metadata: field → value → FAISS positions
+
+    Lets retrieval cut the candidate set down to the chunks of some files,
+    pages, sheets or file types before any vector is scanned.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._postings = {field: {} for field in INDEXED_FIELDS}
+
+    def add(self, position, metadata):
+        values = dict(metadata, file_type=file_type_of(metadata.get("source")))
+        for field in INDEXED_FIELDS:
+            value = values.get(field)
+            if value is not None and value != "":
+                self._postings[field].setdefault(value, set()).add(position)
+
+    def remove(self, positions):
+        positions = set(positions)
+        for postings in self._postings.values():
+            for value in list(postings):
+                postings[value] -= positions
+                if not postings[value]:
+                    del postings[value]
+
+    def remap(self, mapping):
+        """Apply a position mapping after compaction (mapping[old] = new, -1 = dropped)"""
+        for field, postings in self._postings.items():
+            self._postings[field] = {
+                value: {int(mapping[p]) for p in positions if mapping[p] >= 0}
+                for value, positions in postings.items()
+            }
+
+    def values(self, field):
+        return list(self._postings[field])
+
+    def select(self, **filters):
+        """
+        Positions matching every filter
+
+        Each filter is a single value or a list/set/range of accepted values,
+        e.g. select(source="budget.xlsx"), select(file_type=["pdf", "docx"], page=range(0, 10)).
+
+        Returns:
+            Set of FAISS positions (empty when nothing matches)
+        """
+        selected = None
+        for field, accepted in filters.items():
+            if field not in self._postings:
+                raise ValueError(f"Unknown metadata field '{field}' (indexed: {', '.join(INDEXED_FIELDS)})")
+            if isinstance(accepted, (str, int)):
+                accepted = [accepted]
+            postings = self._postings[field]
+            matches = set()
+            for value in accepted:
+                matches |= postings.get(value, set())
+            selected = matches if selected is None else selected & matches
+            if not selected:
+                return set()
+        return selected if selected is not None else set()
+
+    def detect_filters(self, question):
+        """
+        Metadata filters implied by the question
+
+        - Files named in it ('budget.xlsx', or 'budget' when unambiguous)
+        - Sheets named next to 'sheet'/'tab'
+        - 'page 12' / 'pages 3-5' (metadata pages are 0-based)
+        - File kinds ('in the PDFs', 'spreadsheet files') when no file is named
+        """
+        lowered = question.lower()
+        filters = {}
+
+        sources = [source for source in self._postings["source"] if source.lower() in lowered]
+        if not sources:
+            stems = {}
+            for source in self._postings["source"]:
+                stem = os.path.splitext(source)[0].lower()
+                if len(stem) >= 4 and re.search(rf"\b{re.escape(stem)}\b", lowered):
+                    stems.setdefault(stem, []).append(source)
+            sources = [source for matches in stems.values() for source in matches]
+        if sources:
+            filters["source"] = sources
+
+        sheets = [sheet for sheet in self._postings["sheet"]
+                  if re.search(rf"\b(?:sheet|tab)\s+['\"]?{re.escape(str(sheet).lower())}\b"
+                               rf"|\b{re.escape(str(sheet).lower())}['\"]?\s+(?:sheet|tab)\b", lowered)]
+        if sheets:
+            filters["sheet"] = sheets
+
+        if self._postings["page"]:
+            match = _PAGE_PATTERN.search(question)
+            if match:
+                first = int(match.group(1))
+                last = int(match.group(2) or first)
+                if 1 <= first <= last:
+                    filters["page"] = range(first - 1, last)
+
+        if "source" not in filters:
+            present = set(self._postings["file_type"])
+            kinds = set()
+            for match in _FILE_TYPE_PATTERN.finditer(lowered):
+                word = match.group(1) or match.group(2)
+                kinds.update(t for t in FILE_TYPE_WORDS.get(word, ()) if t in present)
+            if kinds and kinds != present:
+                filters["file_type"] = sorted(kinds)
+
+        return filters
@@ -0,0 +1,82 @@
+import re
+
+
+RRF_K = 60  # standard reciprocal rank fusion constant
+
+_STOPWORDS = {
+    "a", "an", "the", "and", "or", "is", "are", "was", "were", "be", "been", "do", "does", "did", "of", "in", "on",
+    "at", "to", "for", "from", "by", "with", "about", "into", "what", "which", "who", "whom", "whose",
+    "when", "where", "why", "how", "can", "could", "should", "would", "will", "shall", "may", "might",
+    "must", "i", "me", "my", "we", "our", "you", "your", "it", "its", "this", "that", "these", "those",
+    "there", "please", "tell", "explain", "describe", "give", "list", "show", "all", "any", "some",
+    "document", "documents", "file", "files", "us"
+}
+
+_SPLIT_PATTERN = re.compile(r"\s*(?:;|,|\?|\band also\b|\band\b|\bor\b|\bversus\b|\bvs\.?)\s*", re.IGNORECASE)
+
+EXPANSION_PROMPT = """Write {count} different search queries that would find passages answering the question below.
+Use different wording and synonyms. One query per line, no numbering, no explanations.
+
+Question: {question}"""
+
+
+def heuristic_variants(question, max_variants=4):
+    """
+    Cheap query variants without an LLM call
+
+    - The original question
+    - Its keywords only (question words and filler removed)
+    - Each part of a compound question ('X and Y', 'A, B, C')
+    """
+    variants = [question.strip()]
+
+    words = re.findall(r"[\w'-]+", question.lower())
+    keywords = [w for w in words if w not in _STOPWORDS]
+    if keywords and len(keywords) < len(words):
+        variants.append(" ".join(keywords))
+
+    parts = [p.strip() for p in _SPLIT_PATTERN.split(question) if p and len(p.split()) >= 2]
+    if len(parts) > 1:
+        variants.extend(parts)
+
+    unique = []
+    seen = set()
+    for variant in variants:
+        key = variant.lower()
+        if variant and key not in seen:
+            seen.add(key)
+            unique.append(variant)
+    return unique[:max_variants]
+
+
+def parse_llm_variants(text, limit):
+    """Query lines from an expansion model's answer (numbering/bullets stripped)"""
+    variants = []
+    for line in text.splitlines():
+        line = re.sub(r"^\s*(?:[-*•]|\d+[.)])\s*", "", line).strip().strip('"')
+        if len(line.split()) >= 2:
+            variants.append(line)
+    return variants[:limit]
+
+
+def _document_key(document):
+    return document.metadata.get("chunk_id") or document.page_content
+
+
+def reciprocal_rank_fusion(result_lists, limit):
+    """
+    Fuse ranked Document lists: score = sum(1 / (RRF_K + rank)) across lists
+
+    Returns:
+        Top `limit` Documents, best fused score first
+    """
+    scores = {}
+    documents = {}
+    for results in result_lists:
+        for rank, document in enumerate(results):
+            key = _document_key(document)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (RRF_K + rank + 1)
+            documents.setdefault(key, document)
+
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [documents[key] for key in ranked[:limit]]
@@ -0,0 +1,144 @@
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ingest_cache import ContentCache, hash_bytes
+
+
+TESSERACT_PATH = shutil.which("tesseract")
+PDFTOPPM_PATH = shutil.which("pdftoppm")
+TESSERACT_AVAILABLE = TESSERACT_PATH is not None
+PDFTOPPM_AVAILABLE = PDFTOPPM_PATH is not None
+
+# Each tesseract process is pinned to one thread, so the pool size is the
+# real bound on OCR CPU usage
+_TESSERACT_ENV = dict(os.environ, OMP_THREAD_LIMIT="1")
+
+
+def rasterize_pdf_page(file_path, page_number, dpi=200, timeout=120):
+    """Render one PDF page (0-based) to PNG bytes with poppler's pdftoppm"""
+    if not PDFTOPPM_AVAILABLE:
+        raise RuntimeError("pdftoppm not found (install poppler-utils)")
+
+    result = subprocess.run(
+        [PDFTOPPM_PATH, "-f", str(page_number + 1), "-l", str(page_number + 1),
+         "-r", str(dpi), "-png", "-singlefile", file_path],
+        capture_output=True,
+        timeout=timeout
+    )
+    if result.returncode != 0 or not result.stdout:
+        raise RuntimeError(f"pdftoppm failed on page {page_number + 1}: "
+                           f"{result.stderr.decode('utf-8', 'ignore').strip()}")
+    return result.stdout
+
+
+def run_tesseract(image_bytes, lang="eng", psm=3, timeout=180, output="txt"):
+    """
+    OCR image bytes with the tesseract CLI (stdin → stdout, no temp files)
+
+    Args:
+        output: 'txt' for plain text, 'tsv' for word boxes and confidences
+    """
+    if not TESSERACT_AVAILABLE:
+        raise RuntimeError("tesseract not found (install tesseract-ocr)")
+
+    cmd = [TESSERACT_PATH, "stdin", "stdout", "-l", lang, "--psm", str(psm)]
+    if output == "tsv":
+        cmd.append("tsv")
+
+    result = subprocess.run(
+        cmd,
+        input=image_bytes,
+        capture_output=True,
+        timeout=timeout,
+        env=_TESSERACT_ENV
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"tesseract failed: {result.stderr.decode('utf-8', 'ignore').strip()}")
+    return result.stdout.decode('utf-8', 'ignore')
+
+
+class OCRPool:
+    """
+    Bounded pool of concurrent tesseract processes
+    - At most max_workers OCR jobs (and tesseract processes) run at once
+    - Results are cached by image hash, so an identical page or image is
+      never OCR'd twice, even across different files
+    """
+
+    def __init__(self, max_workers=None, lang="eng", dpi=200, cache=None):
+        self.max_workers = max_workers or max(1, min(4, (os.cpu_count() or 2) // 2))
+        self.lang = lang
+        self.dpi = dpi
+        self.cache = cache if cache is not None else ContentCache("ocr")
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ocr")
+
+    def _cache_key(self, image_hash):
+        return f"{image_hash}-{self.lang}"
+
+    def ocr_image(self, image_bytes):
+        """OCR image bytes (blocking), using the hash cache"""
+        key = self._cache_key(hash_bytes(image_bytes))
+        cached = self.cache.get_text(key)
+        if cached is not None:
+            return cached
+
+        text = run_tesseract(image_bytes, lang=self.lang)
+        self.cache.put_text(key, text)
+        return text
+
+    def ocr_pdf_page(self, file_path, page_number, file_key=None):
+        """
+        Rasterize and OCR one PDF page (blocking)
+
+        Args:
+            file_key: Optional (file hash, page) cache key - skips rasterizing
+                      entirely when this exact page was OCR'd before
+        """
+        if file_key:
+            cached = self.cache.get_text(file_key)
+            if cached is not None:
+                return cached
+
+        image_bytes = rasterize_pdf_page(file_path, page_number, dpi=self.dpi)
+        text = self.ocr_image(image_bytes)
+
+        if file_key:
+            self.cache.put_text(file_key, text)
+        return text
+
+    def ocr_image_tsv(self, image_bytes):
+        """OCR image bytes to tesseract TSV (word boxes + confidences), cached by hash"""
+        key = f"{self._cache_key(hash_bytes(image_bytes))}-tsv"
+        cached = self.cache.get_text(key)
+        if cached is not None:
+            return cached
+
+        tsv = run_tesseract(image_bytes, lang=self.lang, psm=3, output="tsv")
+        self.cache.put_text(key, tsv)
+        return tsv
+
+    def submit_image(self, image_bytes):
+        return self._executor.submit(self.ocr_image, image_bytes)
+
+    def submit_image_tsv(self, image_bytes):
+        return self._executor.submit(self.ocr_image_tsv, image_bytes)
+
+    def submit_pdf_page(self, file_path, page_number, file_key=None):
+        return self._executor.submit(self.ocr_pdf_page, file_path, page_number, file_key)
+
+
+_OCR_POOL = None
+_OCR_POOL_LOCK = threading.Lock()
+
+
+def get_ocr_pool():
+    """Process-wide OCR pool, shared by every engine/session so the tesseract bound is global"""
+    global _OCR_POOL
+    with _OCR_POOL_LOCK:
+        if _OCR_POOL is None:
+            _OCR_POOL = OCRPool()
+            print(f"[OCR] Pool ready: {_OCR_POOL.max_workers} concurrent tesseract process(es)")
+        return _OCR_POOL
@@ -0,0 +1,344 @@
+import os
+import sys
+import json
+import atexit
+import queue
+import shutil
+import socket
+import pathlib
+import tempfile
+import threading
+import subprocess
+import time
+
+from ingest_cache import ContentCache, hash_bytes
+
+
+SOFFICE_PATH = shutil.which("soffice") or shutil.which("libreoffice")
+LIBREOFFICE_AVAILABLE = SOFFICE_PATH is not None
+
+# Legacy format → modern format our loaders can read
+CONVERSION_TARGETS = {
+    'doc': 'docx',
+    'rtf': 'docx',
+    'odt': 'docx',
+    'xls': 'xlsx',
+}
+
+# Export filter for each target format (UNO storeToURL)
+EXPORT_FILTERS = {
+    'docx': 'MS Word 2007 XML',
+    'xlsx': 'Calc MS Excel 2007 XML',
+}
+
+STARTUP_TIMEOUT = 60  # seconds for a new soffice to accept UNO connections
+
+# Runs the UNO side of a conversion under the interpreter pyuno was built for
+BRIDGE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "uno_bridge.py")
+
+
+def _find_uno_python():
+    """
+    Interpreter that can import LibreOffice's Python bridge, or None
+
+    pyuno only works in the interpreter it was built for - this one, the
+    system python3 (Debian's python3-uno) or the python LibreOffice bundles
+    (official builds, Windows).
+    """
+    program_dir = os.path.dirname(os.path.realpath(SOFFICE_PATH))
+    candidates = [sys.executable, "/usr/bin/python3",
+                  os.path.join(program_dir, "python"), os.path.join(program_dir, "python.exe")]
+    for candidate in dict.fromkeys(candidates):
+        if not candidate or not os.path.isfile(candidate):
+            continue
+        try:
+            result = subprocess.run([candidate, "-c", "import uno"], capture_output=True, timeout=30)
+        except (OSError, subprocess.SubprocessError):
+            continue
+        if result.returncode == 0:
+            return candidate
+    return None
+
+
+UNO_PYTHON = _find_uno_python() if LIBREOFFICE_AVAILABLE else None
+UNO_AVAILABLE = UNO_PYTHON is not None
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_until_complete(path, timeout=5, interval=0.1):
+    """Wait until the file exists and its size stopped changing"""
+    deadline = time.time() + timeout
+    size = -1
+    while time.time() < deadline:
+        if os.path.exists(path):
+            current = os.path.getsize(path)
+            if current == size and current > 0:
+                return True
+            size = current
+        time.sleep(interval)
+    return os.path.exists(path) and os.path.getsize(path) == size and size > 0
+
+
+class _LibreOfficeWorker:
+    """
+    One warm headless LibreOffice instance with its own user profile
+
+    The resident soffice listens on a local UNO socket (as unoserver
+    does) and a uno_bridge.py process, running under UNO_PYTHON, stays
+    connected to it. Conversions load and store the document through that
+    connection, so they run in the already started office, and the reply
+    comes only once the output is completely written. Without the UNO
+    bridge each conversion runs its own soffice --convert-to against the
+    worker's initialised profile.
+    """
+
+    def __init__(self, index, base_dir):
+        self.index = index
+        self.profile_dir = os.path.join(base_dir, f"profile-{index}")
+        self.work_dir = os.path.join(base_dir, f"work-{index}")
+        self.profile_url = pathlib.Path(self.profile_dir).resolve().as_uri()
+        self.process = None
+        self.bridge = None
+        self._replies = None
+        os.makedirs(self.work_dir, exist_ok=True)
+
+    def _base_args(self):
+        return [SOFFICE_PATH, f"-env:UserInstallation={self.profile_url}",
+                "--headless", "--invisible", "--nologo", "--norestore", "--nolockcheck"]
+
+    def alive(self):
+        return all(process is not None and process.poll() is None for process in (self.process, self.bridge))
+
+    def start(self):
+        """Start the office and its bridge, and wait until the bridge is connected"""
+        if not UNO_AVAILABLE:
+            # Nothing to keep resident - initialising the profile is the slow part of a cold start
+            if not os.path.isdir(self.profile_dir):
+                subprocess.run(self._base_args() + ["--terminate_after_init"],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=STARTUP_TIMEOUT)
+            return
+        if self.alive():
+            return
+        self.stop()
+        port = _free_port()
+        self.process = subprocess.Popen(
+            self._base_args() + ["--nodefault",
+                                 f"--accept=socket,host=127.0.0.1,port={port};urp;StarOffice.ComponentContext"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        self.bridge = subprocess.Popen([UNO_PYTHON, BRIDGE_SCRIPT, str(port)],
+                                       stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1)
+        # Replies are read in a thread, so waiting for one can time out
+        self._replies = queue.Queue()
+        threading.Thread(target=self._read_replies, args=(self.bridge, self._replies),
+                         name=f"office-{self.index}", daemon=True).start()
+        try:
+            self._reply(STARTUP_TIMEOUT)
+        except Exception as e:
+            self.stop()
+            raise RuntimeError(f"LibreOffice worker {self.index} did not start: {e}")
+
+    @staticmethod
+    def _read_replies(bridge, replies):
+        for line in bridge.stdout:
+            try:
+                replies.put(json.loads(line))
+            except ValueError:
+                print(f"[Office] {line.rstrip()}")  # something else wrote to the bridge's stdout
+        replies.put(None)  # bridge exited
+
+    def _reply(self, timeout):
+        try:
+            reply = self._replies.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"no reply from the UNO bridge after {timeout}s")
+        if reply is None:
+            raise RuntimeError(f"UNO bridge exited (code {self.bridge.wait()})")
+        if "error" in reply:
+            raise RuntimeError(reply["error"])
+        return reply
+
+    def stop(self):
+        for process in (self.bridge, self.process):
+            if process is None:
+                continue
+            try:
+                process.terminate()
+                process.wait(timeout=10)
+            except Exception:
+                process.kill()
+        self.bridge = None
+        self.process = None
+
+    def restart(self):
+        print(f"[Office] Restarting worker {self.index}")
+        self.stop()
+        self.start()
+
+    def convert(self, input_path, target_ext, timeout):
+        """
+        Convert input_path → target_ext in this worker's work dir; returns the output path
+
+        Raises:
+            TimeoutError: The conversion took longer than timeout (restart the worker)
+        """
+        self.start()
+        stem = os.path.splitext(os.path.basename(input_path))[0]
+        output_path = os.path.join(self.work_dir, f"{stem}.{target_ext}")
+
+        if UNO_AVAILABLE:
+            request = {"input": os.path.abspath(input_path), "output": os.path.abspath(output_path),
+                       "filter": EXPORT_FILTERS[target_ext]}
+            try:
+                self.bridge.stdin.write(json.dumps(request) + "\n")
+                self.bridge.stdin.flush()
+            except OSError as e:
+                raise RuntimeError(f"LibreOffice conversion failed: UNO bridge is gone ({e})")
+            try:
+                self._reply(timeout)
+            except TimeoutError:
+                raise TimeoutError(f"LibreOffice conversion timed out after {timeout}s")
+            except RuntimeError as e:
+                raise RuntimeError(f"LibreOffice conversion failed: {e}")
+            return output_path
+
+        try:
+            result = subprocess.run(
+                self._base_args() + ["--convert-to", target_ext, "--outdir", self.work_dir, input_path],
+                capture_output=True,
+                timeout=timeout
+            )
+        except subprocess.TimeoutExpired:
+            raise TimeoutError(f"LibreOffice conversion timed out after {timeout}s")
+        # soffice has exited - still make sure nothing is writing the file any more
+        if not _wait_until_complete(output_path):
+            raise RuntimeError(f"LibreOffice produced no output (exit {result.returncode}): "
+                               f"{result.stderr.decode('utf-8', 'ignore').strip()}")
+        return output_path
+
+
+class LibreOfficePool:
+    """
+    Small pool of warm headless LibreOffice workers for legacy formats
+    - Conversions queue for a free worker (bounded wait)
+    - Each conversion has a timeout; a hung worker is killed and restarted
+    - Outputs are cached by input file hash
+    """
+
+    def __init__(self, size=2, timeout=120, queue_timeout=300, base_dir=None):
+        if not LIBREOFFICE_AVAILABLE:
+            raise RuntimeError("LibreOffice (soffice) not found")
+
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.base_dir = base_dir or os.path.join(tempfile.gettempdir(), "ttz_libreoffice")
+        self.cache = ContentCache("office_convert")
+
+        self._workers = [_LibreOfficeWorker(i, self.base_dir) for i in range(self.size)]
+        self._idle = queue.Queue()
+        for worker in self._workers:
+            self._idle.put(worker)
+
+    def warm_up(self):
+        """Start every worker in the background so the first conversion doesn't pay the cold start"""
+        def _start_all():
+            if not UNO_AVAILABLE:
+                print(f"[Office] ⚠️ No warm LibreOffice workers: pyuno can't be imported by {sys.executable}, "
+                      f"/usr/bin/python3 or LibreOffice's own python (install python3-uno) - "
+                      f"every conversion starts a cold soffice")
+            started = 0
+            for worker in self._workers:
+                try:
+                    worker.start()
+                    started += 1
+                except Exception as e:
+                    print(f"[Office] ⚠️ Worker {worker.index} failed to start: {e}")
+            if UNO_AVAILABLE and started:
+                print(f"[Office] ✅ {started} of {self.size} warm LibreOffice worker(s) (UNO via {UNO_PYTHON})")
+
+        threading.Thread(target=_start_all, daemon=True).start()
+
+    def convert(self, data, file_name, target_ext=None):
+        """
+        Convert a legacy document held in memory
+
+        Args:
+            data: File content (bytes/memoryview)
+            file_name: Original name - the extension selects the target format
+            target_ext: Override the target extension
+
+        Returns:
+            (converted bytes, new extension)
+        """
+        source_ext = os.path.splitext(file_name)[1].lower().lstrip('.')
+        target_ext = target_ext or CONVERSION_TARGETS.get(source_ext)
+        if target_ext not in EXPORT_FILTERS:
+            raise ValueError(f"No conversion target for .{source_ext}")
+
+        cache_key = f"{hash_bytes(data)}.{target_ext}"
+        cached = self.cache.get_bytes(cache_key)
+        if cached is not None:
+            print(f"[Office] ♻️ Cached conversion for {file_name}")
+            return cached, target_ext
+
+        try:
+            worker = self._idle.get(timeout=self.queue_timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No LibreOffice worker free after {self.queue_timeout}s")
+
+        start_time = time.time()
+        input_path = os.path.join(worker.work_dir, f"input.{source_ext}")
+        output_path = None
+        try:
+            with open(input_path, 'wb') as f:
+                f.write(data)
+            output_path = worker.convert(input_path, target_ext, self.timeout)
+            with open(output_path, 'rb') as f:
+                converted = f.read()
+
+            self.cache.put_bytes(cache_key, converted)
+            print(f"[Office] ✅ {file_name} → .{target_ext} in {time.time() - start_time:.2f}s "
+                  f"(worker {worker.index})")
+            return converted, target_ext
+
+        except TimeoutError:
+            print(f"[Office] ⚠️ Conversion of {file_name} timed out after {self.timeout}s")
+            worker.restart()
+            raise
+
+        finally:
+            for path in (input_path, output_path):
+                if path and os.path.exists(path):
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
+            self._idle.put(worker)
+
+    def shutdown(self):
+        for worker in self._workers:
+            worker.stop()
+
+
+_OFFICE_POOL = None
+_OFFICE_POOL_LOCK = threading.Lock()
+
+
+def get_office_pool():
+    """Process-wide LibreOffice pool (None when LibreOffice isn't installed)"""
+    global _OFFICE_POOL
+    if not LIBREOFFICE_AVAILABLE:
+        return None
+    with _OFFICE_POOL_LOCK:
+        if _OFFICE_POOL is None:
+            _OFFICE_POOL = LibreOfficePool()
+            _OFFICE_POOL.warm_up()
+            atexit.register(_OFFICE_POOL.shutdown)
+        return _OFFICE_POOL
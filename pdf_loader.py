@@ -0,0 +1,328 @@
+import io
+import os
+import time
+import tempfile
+import threading
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from langchain_core.documents import Document
+
+from ingest_cache import ContentCache, hash_file, hash_bytes
+from ocr_engine import TESSERACT_AVAILABLE, PDFTOPPM_AVAILABLE, get_ocr_pool
+
+try:
+    from pypdf import PdfReader
+    PYPDF_AVAILABLE = True
+except ImportError:
+    PYPDF_AVAILABLE = False
+
+
+# Shared process pool - kept warm across files so we only pay the spawn cost once.
+# Sized once for the machine; each loader bounds how many of its shards are in flight.
+POOL_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def _get_pool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ProcessPoolExecutor(max_workers=POOL_WORKERS)
+        return _POOL
+
+
+def _reset_pool(pool):
+    """Drop a broken pool (e.g. a worker was killed) so the next file gets a fresh one"""
+    global _POOL
+    with _POOL_LOCK:
+        # Another session may already have replaced it
+        if _POOL is pool:
+            _POOL = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _extract_pages(reader, page_numbers):
+    """(page_number, text) per page - text is None where extraction failed (never cached)"""
+    pages = []
+    for page_number in page_numbers:
+        try:
+            text = reader.pages[page_number].extract_text() or ""
+        except Exception as e:
+            print(f"[PDF] ⚠️ Page {page_number + 1} extraction failed: {e}")
+            text = None
+        pages.append((page_number, text))
+    return pages
+
+
+def _extract_page_range(file_path, page_numbers):
+    """
+    Worker: extract text for a shard of pages
+    Runs in a child process - must stay a module-level function (Windows spawn)
+    """
+    return _extract_pages(PdfReader(file_path), page_numbers)
+
+
+def _extract_page_range_shared(shm_name, size, page_numbers):
+    """Worker: same as _extract_page_range, for a PDF held in shared memory (in-memory uploads)"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        data = bytes(shm.buf[:size])
+    finally:
+        shm.close()
+    return _extract_pages(PdfReader(io.BytesIO(data)), page_numbers)
+
+
+def _contiguous_shards(page_numbers, pages_per_shard):
+    """Split sorted page numbers into shards of at most pages_per_shard pages"""
+    return [page_numbers[i:i + pages_per_shard] for i in range(0, len(page_numbers), pages_per_shard)]
+
+
+class ParallelPDFLoader:
+    """
+    Page-level PDF loader
+    - Shards page ranges across a process pool
+    - Streams pages (in page order) as soon as their shard finishes
+    - Caches extracted text by (file hash, page number), so re-processing a
+      file or recovering from a failed run never redoes finished pages
+    - Pages without a text layer (scans) are rasterized and OCR'd with
+      tesseract in the shared, bounded OCR pool
+    """
+
+    def __init__(self, file_path=None, max_workers=None, pages_per_shard=16,
+                 min_parallel_pages=24, cache=None, ocr=True, min_text_chars=20,
+                 data=None, source_name=None):
+        """
+        Args:
+            file_path: Path to the PDF (or pass data instead)
+            max_workers: Shards extracted in parallel (default: CPU count - 1, the shared pool's size)
+            pages_per_shard: Pages handed to a worker per task
+            min_parallel_pages: Below this page count, extract in-process
+            cache: ContentCache for page text (default: vectors/cache/pdf_pages)
+            ocr: OCR text-less pages when tesseract + pdftoppm are installed
+            min_text_chars: Pages with less extracted text than this get OCR'd
+            data: PDF content as bytes/memoryview - parsed without a temp file
+                  (worker processes read it from shared memory)
+            source_name: Name for the 'source' metadata (default: file_path)
+        """
+        if not PYPDF_AVAILABLE:
+            raise ImportError("pypdf is required for PDF loading: pip install pypdf")
+        if file_path is None and data is None:
+            raise ValueError("ParallelPDFLoader needs file_path or data")
+
+        self.file_path = file_path
+        self.data = data
+        self.source_name = source_name or file_path
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) - 1)
+        self.pages_per_shard = max(1, pages_per_shard)
+        self.min_parallel_pages = min_parallel_pages
+        self.cache = cache if cache is not None else ContentCache("pdf_pages")
+        self.ocr = ocr and TESSERACT_AVAILABLE and PDFTOPPM_AVAILABLE
+        self.min_text_chars = min_text_chars
+        self.ocr_pages = 0
+        self.file_hash = None
+        self.total_pages = 0
+        self._seen = set()
+        self._shm = None
+        self._ocr_tmp_path = None
+
+    def _cache_key(self, page_number):
+        return f"{self.file_hash}-p{page_number:05d}"
+
+    def _make_document(self, page_number, text, ocr=False):
+        metadata = {
+            "source": self.source_name,
+            "page": page_number,
+            "total_pages": self.total_pages
+        }
+        if ocr:
+            metadata["ocr"] = True
+        return Document(page_content=text, metadata=metadata)
+
+    def _needs_ocr(self, text):
+        return self.ocr and len(text.strip()) < self.min_text_chars
+
+    def _open_reader(self):
+        if self.data is not None:
+            from memory_loaders import MemoryViewReader
+            return PdfReader(MemoryViewReader(self.data))
+        return PdfReader(self.file_path)
+
+    def _submit_shard(self, pool, shard):
+        if self.data is None:
+            return pool.submit(_extract_page_range, self.file_path, shard)
+        if self._shm is None:
+            # Copy the upload into shared memory once; every worker reads from there
+            self._shm = shared_memory.SharedMemory(create=True, size=max(1, len(self.data)))
+            self._shm.buf[:len(self.data)] = self.data
+        return pool.submit(_extract_page_range_shared, self._shm.name, len(self.data), shard)
+
+    def _ocr_source_path(self):
+        """pdftoppm needs a path - in-memory PDFs are written out only if a page needs OCR"""
+        if self.data is None:
+            return self.file_path
+        if self._ocr_tmp_path is None:
+            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
+                tmp_file.write(self.data)
+                self._ocr_tmp_path = tmp_file.name
+        return self._ocr_tmp_path
+
+    def _cleanup(self):
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+        if self._ocr_tmp_path and os.path.exists(self._ocr_tmp_path):
+            try:
+                os.unlink(self._ocr_tmp_path)
+            except OSError as e:
+                print(f"[PDF] ⚠️ Could not delete OCR temp file: {e}")
+        self._ocr_tmp_path = None
+
+    def _extract_missing(self, missing):
+        """
+        Yield (page_number, text) for uncached pages, in completion order -
+        text is None where extraction failed (pool failures are retried in-process first)
+        """
+        if len(missing) < self.min_parallel_pages or self.max_workers == 1:
+            reader = self._open_reader()
+            for shard in _contiguous_shards(missing, self.pages_per_shard):
+                yield from _extract_pages(reader, shard)
+            return
+
+        shards = _contiguous_shards(missing, self.pages_per_shard)
+        workers = min(self.max_workers, len(shards))
+        print(f"[PDF] Extracting {len(missing)} page(s) in {len(shards)} shard(s) on {workers} worker(s)")
+
+        failed_shards = []
+        failed_pages = []
+        pool = _get_pool()
+        try:
+            # At most `workers` shards of this file in flight - the pool is shared with other sessions
+            queued = list(shards)
+            futures = {}
+            while queued or futures:
+                while queued and len(futures) < workers:
+                    shard = queued.pop(0)
+                    futures[self._submit_shard(pool, shard)] = shard
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    shard = futures.pop(future)
+                    try:
+                        pages = future.result()
+                    except Exception as e:
+                        print(f"[PDF] ⚠️ Shard {shard[0] + 1}-{shard[-1] + 1} failed: {e}")
+                        failed_shards.append(shard)
+                        continue
+                    for page_number, text in pages:
+                        if text is None:
+                            failed_pages.append(page_number)
+                        else:
+                            yield page_number, text
+        except Exception as e:
+            # Pool itself is unusable (e.g. BrokenProcessPool) - finish in-process
+            print(f"[PDF] ⚠️ Process pool unavailable, continuing in-process: {e}")
+            _reset_pool(pool)
+            done = set(self._seen)
+            failed_shards = [[p for p in shard if p not in done] for shard in shards]
+            failed_shards = [shard for shard in failed_shards if shard]
+            failed_pages = []
+
+        # Retry failed shards and pages once in-process
+        retry = sorted({p for shard in failed_shards for p in shard} | set(failed_pages))
+        if retry:
+            reader = self._open_reader()
+            for shard in _contiguous_shards(retry, self.pages_per_shard):
+                yield from _extract_pages(reader, shard)
+
+    def lazy_load(self):
+        """Yield one Document per page, in page order, as pages become available"""
+        try:
+            yield from self._lazy_load()
+        finally:
+            self._cleanup()
+
+    def _lazy_load(self):
+        start_time = time.time()
+        self.file_hash = hash_bytes(self.data) if self.data is not None else hash_file(self.file_path)
+        self.total_pages = len(self._open_reader().pages)
+
+        ready = {}
+        missing = []
+        for page_number in range(self.total_pages):
+            cached = self.cache.get_text(self._cache_key(page_number))
+            if cached is None:
+                missing.append(page_number)
+            else:
+                ready[page_number] = cached
+
+        cached_count = self.total_pages - len(missing)
+        print(f"[PDF] {self.total_pages} page(s), {cached_count} cached, {len(missing)} to extract")
+
+        next_page = 0
+        self._seen = set(ready)
+        ocr_pool = get_ocr_pool() if self.ocr else None
+        ocr_futures = {}
+
+        def drain():
+            nonlocal next_page
+            while next_page in ready:
+                text, is_ocr = ready.pop(next_page)
+                yield self._make_document(next_page, text, ocr=is_ocr)
+                next_page += 1
+
+        def accept(page_number, text):
+            # Text-less page (scan) → OCR in the background, keep streaming the rest
+            if self._needs_ocr(text):
+                ocr_key = f"{self._cache_key(page_number)}-ocr"
+                future = ocr_pool.submit_pdf_page(self._ocr_source_path(), page_number, file_key=ocr_key)
+                ocr_futures[future] = (page_number, text)
+            else:
+                ready[page_number] = (text, False)
+
+        def collect_ocr(block):
+            if not ocr_futures:
+                return
+            done, _ = wait(list(ocr_futures), timeout=None if block else 0, return_when=FIRST_COMPLETED)
+            for future in done:
+                page_number, extracted = ocr_futures.pop(future)
+                try:
+                    text = future.result()
+                    self.ocr_pages += 1
+                    ready[page_number] = (text, True)
+                except Exception as e:
+                    print(f"[OCR] ⚠️ Page {page_number + 1} OCR failed: {e}")
+                    ready[page_number] = (extracted, False)
+
+        for page_number in sorted(ready):
+            text = ready.pop(page_number)
+            accept(page_number, text)
+        yield from drain()
+
+        for page_number, text in self._extract_missing(missing):
+            if page_number in self._seen:
+                continue
+            self._seen.add(page_number)
+            if text is None:
+                # Extraction failed - not cached, so the next run tries the page again
+                text = ""
+            else:
+                self.cache.put_text(self._cache_key(page_number), text)
+            accept(page_number, text)
+            collect_ocr(block=False)
+            yield from drain()
+
+        while ocr_futures:
+            collect_ocr(block=True)
+            yield from drain()
+
+        yield from drain()
+
+        if self.ocr_pages:
+            print(f"[OCR] ✅ {self.ocr_pages} scanned page(s) OCR'd")
+        elapsed = time.time() - start_time
+        print(f"[PDF] ✅ {self.total_pages} page(s) in {elapsed:.2f}s")
+
+    def load(self):
+        return list(self.lazy_load())
@@ -5,7 +5,6 @@ import re
 import base64
 from langchain_ollama import ChatOllama
 from langchain_huggingface import HuggingFaceEmbeddings
-from langchain.text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
 from langchain.chains import ConversationalRetrievalChain
 from langchain.memory import ConversationBufferMemory
@@ -13,7 +12,6 @@ from langchain.prompts import PromptTemplate
 from langchain.schema import Document
 
 from langchain_community.document_loaders import (
-    PyPDFLoader,
     Docx2txtLoader,
     TextLoader,
     CSVLoader,
@@ -22,6 +20,12 @@ from langchain_community.document_loaders import (
     UnstructuredRTFLoader
 )
 
+from pdf_loader import ParallelPDFLoader
+from fast_splitter import FastTextSplitter
+from memory_loaders import load_from_buffer, get_upload_buffer, MemoryViewReader
+from ocr_engine import TESSERACT_AVAILABLE, PDFTOPPM_AVAILABLE
+from image_pipeline import triage_image, prepare_image_for_vision, ImageAnalysisCache
+
 # Try multiple Excel loading methods
 try:
     from langchain_community.document_loaders import UnstructuredExcelLoader
@@ -88,6 +92,7 @@ class RAGEngine:
         print(f"  - UnstructuredExcelLoader: {'✅' if UNSTRUCTURED_EXCEL else '❌'}")
         print(f"  - Pandas: {'✅' if PANDAS_AVAILABLE else '❌'}")
         print(f"  - OpenPyXL: {'✅' if OPENPYXL_AVAILABLE else '❌'}")
+        print(f"[RAG] Scanned PDF OCR: {'✅' if TESSERACT_AVAILABLE and PDFTOPPM_AVAILABLE else '❌ (install tesseract-ocr + poppler-utils)'}")
         
         print("[RAG] Loading embeddings...")
         import torch
@@ -110,6 +115,7 @@ class RAGEngine:
             timeout=300,
             keep_alive="10m"
         )
+        self.image_cache = ImageAnalysisCache()
         
         print("[RAG] ✅ Ready with ROBUST file support!")
     
@@ -132,62 +138,57 @@ class RAGEngine:
         else:
             return (256, 2048, 180)
     
-    def _load_excel_with_pandas(self, file_path):
+    def _load_excel_with_pandas(self, file_path, file_name=None):
         """
         Load Excel using Pandas - MORE RELIABLE!
         Works with complex Excel files that UnstructuredExcelLoader fails on
         WINDOWS COMPATIBLE: Properly closes file handles
+        Accepts a path or a file-like object (uploads are read from memory)
         """
         print(f"[Excel] Using Pandas loader (more reliable)")
+        file_name = file_name or os.path.basename(file_path)
         
         try:
-            # Read all sheets - use context manager for proper cleanup
             documents = []
             
-            # Get sheet names first
-            excel_file = pd.ExcelFile(file_path)
-            sheet_names = excel_file.sheet_names
-            excel_file.close()  # IMPORTANT: Close immediately
-            
-            # Now process each sheet
-            for sheet_name in sheet_names:
-                print(f"[Excel] Reading sheet: {sheet_name}")
-                
-                # Read with context manager for proper cleanup
-                df = pd.read_excel(file_path, sheet_name=sheet_name)
-                
-                # Convert DataFrame to readable text
-                content = f"=== Sheet: {sheet_name} ===\n\n"
-                
-                # Add column headers
-                content += "Columns: " + ", ".join(df.columns.tolist()) + "\n\n"
-                
-                # Add row count
-                content += f"Total rows: {len(df)}\n\n"
-                
-                # Add data (first 1000 rows to avoid huge files)
-                content += "Data:\n"
-                for idx, row in df.head(1000).iterrows():
-                    row_text = " | ".join([f"{col}: {val}" for col, val in row.items()])
-                    content += f"Row {idx + 1}: {row_text}\n"
-                
-                if len(df) > 1000:
-                    content += f"\n... (showing first 1000 of {len(df)} rows)\n"
-                
-                # Create document
-                doc = Document(
-                    page_content=content,
-                    metadata={
-                        "source": os.path.basename(file_path),
-                        "sheet": sheet_name,
-                        "rows": len(df),
-                        "columns": len(df.columns)
-                    }
-                )
-                documents.append(doc)
-                
-                # Explicitly delete DataFrame to free memory
-                del df
+            # Context manager closes the file handle (if pandas opened one) when done
+            with pd.ExcelFile(file_path) as excel_file:
+                for sheet_name in excel_file.sheet_names:
+                    print(f"[Excel] Reading sheet: {sheet_name}")
+                    df = excel_file.parse(sheet_name)
+                    
+                    # Convert DataFrame to readable text
+                    content = f"=== Sheet: {sheet_name} ===\n\n"
+                    
+                    # Add column headers
+                    content += "Columns: " + ", ".join(df.columns.tolist()) + "\n\n"
+                    
+                    # Add row count
+                    content += f"Total rows: {len(df)}\n\n"
+                    
+                    # Add data (first 1000 rows to avoid huge files)
+                    content += "Data:\n"
+                    for idx, row in df.head(1000).iterrows():
+                        row_text = " | ".join([f"{col}: {val}" for col, val in row.items()])
+                        content += f"Row {idx + 1}: {row_text}\n"
+                    
+                    if len(df) > 1000:
+                        content += f"\n... (showing first 1000 of {len(df)} rows)\n"
+                    
+                    # Create document
+                    doc = Document(
+                        page_content=content,
+                        metadata={
+                            "source": file_name,
+                            "sheet": sheet_name,
+                            "rows": len(df),
+                            "columns": len(df.columns)
+                        }
+                    )
+                    documents.append(doc)
+                    
+                    # Explicitly delete DataFrame to free memory
+                    del df
             
             print(f"[Excel] ✅ Successfully loaded {len(documents)} sheet(s)")
             return documents
@@ -252,15 +253,41 @@ class RAGEngine:
             print(f"[Excel] OpenPyXL failed: {e}")
             raise
     
+    def _image_document(self, file_name, description, method):
+        return Document(
+            page_content=f"[IMAGE: {file_name}]\n\n{description}",
+            metadata={
+                "source": file_name,
+                "type": "image",
+                "processed_with": method
+            }
+        )
+    
     def _process_image_with_vision(self, image_bytes, file_name):
-        """Process image using vision model"""
-        print(f"[Vision] Analyzing image: {file_name}")
+        """Process image - OCR triage first, vision model only when needed"""
+        cache_key = self.image_cache.key(image_bytes, self.vision_model)
+        cached = self.image_cache.get(cache_key)
+        if cached:
+            print(f"[Vision] ♻️ Cached analysis for {file_name} ({cached['method']})")
+            return self._image_document(file_name, "\n\n".join(cached["descriptions"]), cached["method"])
+        
+        # Text-heavy images (screenshots, scans) don't need the vision model
+        triage = triage_image(image_bytes)
+        if triage["route"] == "ocr":
+            description = f"Text extracted with OCR:\n\n{triage['text']}"
+            self.image_cache.put(cache_key, description, "ocr")
+            print(f"[Vision] ✅ Indexed from OCR, skipped {self.vision_model}")
+            return self._image_document(file_name, description, "ocr")
+        
+        # Downscale/re-encode before upload; multi-frame GIF/TIFF → frames
+        prepared = prepare_image_for_vision(image_bytes)
+        print(f"[Vision] Analyzing image: {file_name} ({len(prepared['frames'])} frame(s), "
+              f"{prepared['bytes_before'] / 1024:.0f} KB → {prepared['bytes_after'] / 1024:.0f} KB)")
         start_time = time.time()
         
         try:
-            base64_image = base64.b64encode(image_bytes).decode('utf-8')
             file_type = self._detect_file_type(file_name)
-            mime_type = f"image/{file_type if file_type != 'jpg' else 'jpeg'}"
+            mime_type = prepared["mime_type"] or f"image/{file_type if file_type != 'jpg' else 'jpeg'}"
             
             prompt = f"""Analyze this image in detail. Provide:
 
@@ -275,30 +302,34 @@ Image: {file_name}"""
 
             from langchain_core.messages import HumanMessage
             
-            message = HumanMessage(
-                content=[
-                    {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": f"data:{mime_type};base64,{base64_image}"}
-                ]
-            )
-            
-            response = self.vision_llm.invoke([message])
-            description = response.content
+            descriptions = []
+            for frame_idx, frame in enumerate(prepared["frames"]):
+                base64_image = base64.b64encode(frame).decode('utf-8')
+                message = HumanMessage(
+                    content=[
+                        {"type": "text", "text": prompt},
+                        {"type": "image_url", "image_url": f"data:{mime_type};base64,{base64_image}"}
+                    ]
+                )
+                
+                response = self.vision_llm.invoke([message])
+                if len(prepared["frames"]) > 1:
+                    descriptions.append(f"--- Frame {frame_idx + 1} ---\n{response.content}")
+                else:
+                    descriptions.append(response.content)
+            description = "\n\n".join(descriptions)
             
             elapsed = time.time() - start_time
             print(f"[Vision] ✅ Analyzed in {elapsed:.2f}s")
             
-            return Document(
-                page_content=f"[IMAGE: {file_name}]\n\n{description}",
-                metadata={
-                    "source": file_name,
-                    "type": "image",
-                    "processed_with": f"vision_model_{self.vision_model}"
-                }
-            )
+            method = f"vision_model_{self.vision_model}"
+            self.image_cache.put(cache_key, description, method)
+            return self._image_document(file_name, description, method)
             
         except Exception as e:
             print(f"[Vision] ⚠️ Error: {str(e)}")
+            if triage["text"].strip():
+                return self._image_document(file_name, f"Text extracted with OCR:\n\n{triage['text']}", "ocr")
             return Document(
                 page_content=f"[IMAGE: {file_name}]\n\nVision model error: {str(e)}",
                 metadata={"source": file_name, "type": "image", "error": str(e)}
@@ -363,7 +394,8 @@ Image: {file_name}"""
             
             # ============ PDF FILES ============
             elif file_type == 'pdf':
-                return PyPDFLoader(file_path).load()
+                # Parallel page extraction with per-page cache
+                return ParallelPDFLoader(file_path).load()
             
             # ============ WORD FILES ============
             elif file_type in ['docx', 'doc']:
@@ -448,40 +480,61 @@ Image: {file_name}"""
         tmp_path = None
         
         try:
-            # Create temp file
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_type}") as tmp_file:
-                tmp_file.write(uploaded_file.getvalue())
-                tmp_path = tmp_file.name
+            # Zero-copy view of the upload - images, PDF, DOCX, JSON and text
+            # are parsed from memory; no temp file, no extra copies
+            buffer = get_upload_buffer(uploaded_file)
+            documents = None
             
-            # Load document with appropriate method
             if self._is_image_file(file_type):
-                documents = self._load_document_by_type(tmp_path, uploaded_file.getvalue())
-            else:
-                documents = self._load_document_by_type(tmp_path)
-            
-            # Force garbage collection to release file handles (Windows compatibility)
-            import gc
-            gc.collect()
-            
-            # Clean up - WINDOWS FIX: Add delay and retry
-            if tmp_path and os.path.exists(tmp_path):
-                import time as time_module
-                max_attempts = 5
-                for attempt in range(max_attempts):
+                documents = [self._process_image_with_vision(buffer, file_name)]
+            elif file_type in ['xlsx', 'xls', 'xlsm', 'ods']:
+                if PANDAS_AVAILABLE:
                     try:
-                        os.unlink(tmp_path)
-                        print(f"[Cleanup] ✅ Temp file deleted")
-                        break
-                    except PermissionError as e:
-                        if attempt < max_attempts - 1:
-                            print(f"[Cleanup] File locked, retrying... (attempt {attempt + 1}/{max_attempts})")
-                            time_module.sleep(0.5)  # Wait 500ms
-                        else:
-                            print(f"[Cleanup] ⚠️ Could not delete temp file (Windows lock): {tmp_path}")
-                            print(f"[Cleanup] File will be cleaned up by system eventually")
+                        documents = self._load_excel_with_pandas(MemoryViewReader(buffer), file_name)
                     except Exception as e:
-                        print(f"[Cleanup] ⚠️ Cleanup error: {e}")
-                        break
+                        # The path-based chain below also tries OpenPyXL and Unstructured
+                        print(f"[Loader] ⚠️ In-memory Excel load failed, retrying from disk: {e}")
+                        documents = None
+            else:
+                try:
+                    documents = load_from_buffer(buffer, file_name, file_type)
+                    if documents is not None:
+                        documents = list(documents)
+                except Exception as e:
+                    print(f"[Loader] ⚠️ In-memory load failed, retrying from disk: {e}")
+                    documents = None
+            
+            if documents is None:
+                # Loader needs a real path - write a temp file
+                with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_type}") as tmp_file:
+                    tmp_file.write(buffer)
+                    tmp_path = tmp_file.name
+                
+                documents = self._load_document_by_type(tmp_path)
+                
+                # Force garbage collection to release file handles (Windows compatibility)
+                import gc
+                gc.collect()
+                
+                # Clean up - WINDOWS FIX: Add delay and retry
+                if tmp_path and os.path.exists(tmp_path):
+                    import time as time_module
+                    max_attempts = 5
+                    for attempt in range(max_attempts):
+                        try:
+                            os.unlink(tmp_path)
+                            print(f"[Cleanup] ✅ Temp file deleted")
+                            break
+                        except PermissionError as e:
+                            if attempt < max_attempts - 1:
+                                print(f"[Cleanup] File locked, retrying... (attempt {attempt + 1}/{max_attempts})")
+                                time_module.sleep(0.5)  # Wait 500ms
+                            else:
+                                print(f"[Cleanup] ⚠️ Could not delete temp file (Windows lock): {tmp_path}")
+                                print(f"[Cleanup] File will be cleaned up by system eventually")
+                        except Exception as e:
+                            print(f"[Cleanup] ⚠️ Cleanup error: {e}")
+                            break
             
             if not documents:
                 print(f"[Processing] ⚠️ No content extracted")
@@ -495,11 +548,10 @@ Image: {file_name}"""
             else:
                 chunk_size, chunk_overlap = 1200, 300
             
-            text_splitter = RecursiveCharacterTextSplitter(
+            text_splitter = FastTextSplitter(
                 chunk_size=chunk_size,
                 chunk_overlap=chunk_overlap,
-                separators=["\n\n\n", "\n\n", "\n", ". ", " ", ""],
-                length_function=len
+                separators=["\n\n\n", "\n\n", "\n", ". ", " ", ""]
             )
             
             chunks = text_splitter.split_documents(documents)
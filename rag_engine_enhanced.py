@@ -3,17 +3,21 @@ import time
 import tempfile
 import re
 import base64
+import json
+import uuid
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from langchain_ollama import ChatOllama
 from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
 from langchain_classic.chains import ConversationalRetrievalChain
 from langchain_classic.memory import ConversationBufferMemory
 from langchain_core.prompts import PromptTemplate
 from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
 
 from langchain_community.document_loaders import (
-    PyPDFLoader,
     Docx2txtLoader,
     TextLoader,
     CSVLoader,
@@ -22,6 +26,24 @@ from langchain_community.document_loaders import (
     UnstructuredRTFLoader
 )
 
+from pdf_loader import ParallelPDFLoader
+from memory_loaders import load_from_buffer, get_upload_buffer, MemoryViewReader
+from fast_splitter import FastTextSplitter
+from multi_query import heuristic_variants, parse_llm_variants, reciprocal_rank_fusion, EXPANSION_PROMPT
+from map_reduce import MapReduceAnswerer, group_chunks, is_exhaustive_question
+from index_store import write_json_atomic
+from metadata_index import INDEXED_FIELDS
+from collection_manager import get_collection_manager, validate_collection_name, DEFAULT_COLLECTION, DOCSTORE_NAME
+from kb_bundle import read_bundle, write_bundle_manifest
+from sqlite_docstore import SQLiteDocstore
+from sharded_index import ShardedIndex, SHARD_STRATEGIES, clone_index
+from doc_index import DocumentIndex, SUMMARY_PROMPT, is_summary_question
+from embeddings import MODEL_NAME, ONNXRUNTIME_AVAILABLE, load_verified_backend, CachedQueryEmbeddings
+from streaming_loader import StreamingTextLoader, STREAMING_THRESHOLD, STREAMING_TYPES, iter_batches
+from office_converter import LIBREOFFICE_AVAILABLE, CONVERSION_TARGETS, get_office_pool
+from ocr_engine import TESSERACT_AVAILABLE, PDFTOPPM_AVAILABLE
+from image_pipeline import triage_image, prepare_image_for_vision, ImageAnalysisCache, VisionBatchProcessor
+
 # Excel loading
 try:
     from langchain_community.document_loaders import UnstructuredExcelLoader
@@ -42,6 +64,76 @@ except ImportError:
     OPENPYXL_AVAILABLE = False
 
 
+# Standard chunking
+CHUNK_SIZE = 1500
+CHUNK_OVERLAP = 400
+
+# Parent-child chunking - small non-overlapping children are embedded (they fit
+# MiniLM's 256-token window), whole parent sections are what the LLM sees
+PARENT_CHUNK_SIZE = 1500
+CHILD_CHUNK_SIZE = 600
+CHILDREN_PER_PARENT = 3  # children fetched per parent slot, before de-duplication
+
+# Two-stage retrieval - below this many documents a flat search is just as good
+ROUTE_MIN_DOCUMENTS = 3
+SUMMARY_CONTEXT_CHARS = 6000
+
+# Deleted chunks are tombstoned (skipped by search) and physically removed
+# in the background once there are this many, or this share of the index
+COMPACT_MIN_TOMBSTONES = 512
+COMPACT_MIN_RATIO = 0.1
+
+# A streamed file is saved whenever this many chunks are unsaved, so its
+# pending vectors (and the save reading their text back) stay bounded
+STREAM_SAVE_CHUNKS = 20000
+
+
+def _collection_attribute(name):
+    """Engine attribute that lives on the open collection (shared by every engine using it)"""
+    return property(lambda self: getattr(self.collection, name),
+                    lambda self, value: setattr(self.collection, name, value))
+
+
+def _accepted(value):
+    """Filter value as a collection of accepted values"""
+    return [value] if isinstance(value, (str, int)) else value
+
+
+def _narrow_filters(chosen, detected):
+    """
+    Filters chosen by the user/caller, narrowed by those detected in the question
+
+    A detected value only counts inside the chosen ones - a file named in
+    the question can narrow "Search only in" but never widen or replace it.
+    """
+    filters = dict(chosen)
+    for field, value in detected.items():
+        if field not in chosen:
+            filters[field] = value
+            continue
+        narrowed = [v for v in _accepted(value) if v in _accepted(chosen[field])]
+        if narrowed:
+            filters[field] = narrowed
+    return filters
+
+
+def _describe_filters(filters):
+    return ", ".join(f"{field}={value}" for field, value in filters.items())
+
+
+class _StalePositions(Exception):
+    """Candidate positions were computed before a compaction renumbered the index"""
+
+
+class EngineRetriever(BaseRetriever):
+    """Retriever adapter - lets the chain use the engine's own retrieval pipeline"""
+    
+    engine: object
+    
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return self.engine._retrieve(query)
+
+
 class RAGEngine:
     """
     🚀 ENHANCED Multi-Format RAG Engine - MAXIMUM CAPACITY
@@ -54,70 +146,154 @@ class RAGEngine:
     - Configurable retrieval strategies
     """
     
+    # Casual message patterns
+    casual_patterns = [
+        r'^(hi|hey|hello|sup|what\'s up|wassup|yo)\b',
+        r'^(thanks|thank you|thx|ty|appreciate it)\b',
+        r'^(bye|goodbye|see you|cya|later)\b',
+        r'^(how are you|how\'s it going|how are ya|how do you do)\b',
+        r'^(ok|okay|cool|nice|great|awesome|perfect)\b',
+        r'^(yes|no|yeah|yep|nope|sure)\b',
+        r'(what are you|what\'re you|whatcha|wyd)',
+        r'(tell me about yourself|who are you|introduce yourself)',
+        r'(good morning|good afternoon|good evening|good night)',
+        r'(nice to meet you|pleased to meet you)',
+    ]
+    
+    casual_keywords = [
+        'doing now', 'doing today', 'your name', 'about you', 
+        'feeling', 'your day', 'up to', 'busy'
+    ]
+    
+    # Per-collection state, forwarded to self.collection
+    vector_dir = _collection_attribute("directory")
+    vectorstore = _collection_attribute("vectorstore")
+    processed_documents = _collection_attribute("processed_documents")
+    deduplicator = _collection_attribute("deduplicator")
+    docstore = _collection_attribute("docstore")
+    parent_store = _collection_attribute("parent_store")
+    segment_store = _collection_attribute("segment_store")
+    metadata_index = _collection_attribute("metadata_index")
+    doc_index = _collection_attribute("doc_index")
+    pending_documents = _collection_attribute("pending_documents")
+    tombstones = _collection_attribute("tombstones")
+    _index_epoch = _collection_attribute("index_epoch")
+    index_lock = _collection_attribute("index_lock")
+    search_lock = _collection_attribute("search_lock")
+    summary_pool = _collection_attribute("summary_pool")
+    maintenance_pool = _collection_attribute("maintenance_pool")
+    _unsaved_chunks = _collection_attribute("unsaved_chunks")
+    _dirty_chunks = _collection_attribute("dirty_chunks")
+    _unsaved_parents = _collection_attribute("unsaved_parents")
+    _unsaved_deletes = _collection_attribute("unsaved_deletes")
+    _looked_up = _collection_attribute("looked_up")
+    _docstore_changes = _collection_attribute("docstore_changes")
+    _docstore_current = _collection_attribute("docstore_current")
+    
     def __init__(self, model="qwen2.5:7b", vision_model="llama3.2-vision:latest", 
-                 retrieval_mode="mmr", num_chunks=12):
+                 retrieval_mode="mmr", num_chunks=12, vision_concurrency=2, chunking_mode="standard",
+                 dedup_threshold=0.85, embedding_backend="auto", query_expansion_model=None,
+                 answer_mode="auto", map_concurrency=2, max_map_calls=48, document_routing=True,
+                 compress_docstore=True, collection=DEFAULT_COLLECTION, num_shards=1, shard_by="hash"):
         """
         Initialize Enhanced RAG Engine
         
         Args:
             model: Text model name
             vision_model: Vision model for images
-            retrieval_mode: 'similarity', 'mmr', or 'hybrid' (default: 'mmr')
+            retrieval_mode: 'similarity', 'mmr', 'hybrid' or 'multi_query' (default: 'mmr')
             num_chunks: Number of chunks to retrieve (default: 12, max: 20)
+            vision_concurrency: Max parallel vision calls (match OLLAMA_NUM_PARALLEL)
+            chunking_mode: 'standard' (1500/400 chunks) or 'parent_child'
+                           (embed 600-char children, answer from their parent sections)
+            dedup_threshold: Similarity above which chunks count as near-duplicates
+                             and are embedded once (None disables dedup)
+            embedding_backend: 'auto', 'huggingface', 'torch', 'onnx' or 'onnx-int8'
+                               ('auto' = int8 ONNX on CPU when it agrees with the
+                               reference vectors, HuggingFaceEmbeddings on GPU)
+            query_expansion_model: Optional small Ollama model that writes extra
+                                   query variants in 'multi_query' mode
+            answer_mode: 'standard', 'map_reduce' or 'auto' (map-reduce for
+                         "list all" / whole-document questions)
+            map_concurrency: Max parallel Ollama calls in map-reduce answering
+            max_map_calls: Compute cap - most excerpt groups mapped per question
+            document_routing: Route queries to the best-matching documents and
+                              sections first once ROUTE_MIN_DOCUMENTS are indexed
+            compress_docstore: zstd-compress chunk text in the on-disk docstore
+                               (needs the zstandard package)
+            collection: Named collection to open - its own index, docstore and
+                        manifest under vectors/ (see open_collection)
+            num_shards: Split the vector index into this many shards searched in
+                        parallel (1 = one flat index); applies when a collection's
+                        index is built or loaded
+            shard_by: 'hash' (rows spread evenly) or 'source' (a file's chunks stay
+                      in one shard; shards are rebalanced as they grow)
         """
+        if shard_by not in SHARD_STRATEGIES:
+            raise ValueError(f"Unknown shard_by '{shard_by}' (use {', '.join(SHARD_STRATEGIES)})")
         print(f"[RAG] 🚀 Initializing ENHANCED CAPACITY version")
         print(f"[RAG] Text Model: {model}")
         print(f"[RAG] Vision Model: {vision_model}")
         print(f"[RAG] Retrieval Mode: {retrieval_mode.upper()}")
         print(f"[RAG] Chunks to Retrieve: {num_chunks}")
+        print(f"[RAG] Chunking: {chunking_mode.upper()}")
         
         self.model = model
         self.vision_model = vision_model
         self.retrieval_mode = retrieval_mode
         self.num_chunks = min(num_chunks, 20)  # Cap at 20 for performance
-        self.vectorstore = None
+        self.chunking_mode = chunking_mode
+        self.dedup_threshold = dedup_threshold
         self.chain = None
         self.llm = None
         self.memory = None
-        self.processed_documents = []
-        
-        # Casual message patterns
-        self.casual_patterns = [
-            r'^(hi|hey|hello|sup|what\'s up|wassup|yo)\b',
-            r'^(thanks|thank you|thx|ty|appreciate it)\b',
-            r'^(bye|goodbye|see you|cya|later)\b',
-            r'^(how are you|how\'s it going|how are ya|how do you do)\b',
-            r'^(ok|okay|cool|nice|great|awesome|perfect)\b',
-            r'^(yes|no|yeah|yep|nope|sure)\b',
-            r'(what are you|what\'re you|whatcha|wyd)',
-            r'(tell me about yourself|who are you|introduce yourself)',
-            r'(good morning|good afternoon|good evening|good night)',
-            r'(nice to meet you|pleased to meet you)',
-        ]
-        
-        self.casual_keywords = [
-            'doing now', 'doing today', 'your name', 'about you', 
-            'feeling', 'your day', 'up to', 'busy'
-        ]
         
         # Check available Excel loaders
         print(f"[RAG] Excel support:")
         print(f"  - UnstructuredExcelLoader: {'✅' if UNSTRUCTURED_EXCEL else '❌'}")
         print(f"  - Pandas: {'✅' if PANDAS_AVAILABLE else '❌'}")
         print(f"  - OpenPyXL: {'✅' if OPENPYXL_AVAILABLE else '❌'}")
+        print(f"[RAG] Scanned PDF OCR: {'✅' if TESSERACT_AVAILABLE and PDFTOPPM_AVAILABLE else '❌ (install tesseract-ocr + poppler-utils)'}")
+        print(f"[RAG] Legacy .doc/.xls/.rtf conversion: {'✅ LibreOffice' if LIBREOFFICE_AVAILABLE else '❌ (install libreoffice)'}")
+        
+        # Start warm LibreOffice workers in the background
+        self.office_pool = get_office_pool()
         
         print("[RAG] Loading embeddings...")
         import torch
         device = 'cuda' if torch.cuda.is_available() else 'cpu'
         print(f"[RAG] Device: {device.upper()}")
         
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2",
-            model_kwargs={'device': device},
-            encode_kwargs={'normalize_embeddings': True, 'batch_size': 32}
-        )
+        # Query vectors are cached - retries and resubmits skip the model
+        self.embeddings = CachedQueryEmbeddings(self._load_embeddings(embedding_backend, device))
+        self.last_retrieval_timing = None
+        
+        # Multi-query fan-out: sub-queries are searched in parallel
+        self.query_expansion_model = query_expansion_model
+        self.query_expansion_llm = None
+        self.search_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="search")
+        
+        self.answer_mode = answer_mode
+        self.map_concurrency = map_concurrency
+        self.max_map_calls = max_map_calls
         
-        self.vector_dir = os.path.join("vectors", "faiss_index")
+        # Document-level routing - entries are built in the background after ingestion
+        self.document_routing = document_routing
+        self.summary_llm = None
+        
+        # Metadata prefilter chosen in this session (see set_search_filters)
+        self.search_filters = {}
+        
+        # Index state (vectorstore, SQLite docstore, segments, metadata/document indexes)
+        # lives on a named collection, shared through a process-wide LRU of open ones
+        self.compress_docstore = compress_docstore
+        self.num_shards = max(1, num_shards)
+        self.shard_by = shard_by
+        self.collection_manager = get_collection_manager()
+        self.collection = None
+        self.open_collection(collection, load=False)
+        print(f"[RAG] Collection: {collection} (SQLite docstore, "
+              f"{'zstd' if self.docstore.compress else 'uncompressed'})")
         
         # Initialize vision LLM
         print("[RAG] Loading vision model...")
@@ -127,10 +303,34 @@ class RAGEngine:
             timeout=300,
             keep_alive="10m"
         )
+        self.image_cache = ImageAnalysisCache()
+        self.vision_batch = VisionBatchProcessor(max_concurrency=vision_concurrency)
         
         print("[RAG] ✅ Ready with ENHANCED CAPACITY!")
         print(f"[RAG] 📊 Expected retrieval: ~{num_chunks * 1.5:.0f} chunks = ~{num_chunks * 0.8:.0f}-{num_chunks:.0f} pages per query")
     
+    def _load_embeddings(self, backend, device):
+        """Pick the embedding backend - CPU deployments get the length-batched ONNX model"""
+        if backend == "auto":
+            candidates = ["onnx-int8", "onnx"] if device == 'cpu' and ONNXRUNTIME_AVAILABLE else []
+        elif backend == "huggingface":
+            candidates = []
+        else:
+            candidates = [backend]
+        
+        for candidate in candidates:
+            embeddings = load_verified_backend(candidate)
+            if embeddings is not None:
+                print(f"[RAG] Embeddings: {candidate.upper()} (length-sorted, token-budget batches)")
+                return embeddings
+        
+        print(f"[RAG] Embeddings: HuggingFace ({device.upper()})")
+        return HuggingFaceEmbeddings(
+            model_name=MODEL_NAME,
+            model_kwargs={'device': device},
+            encode_kwargs={'normalize_embeddings': True, 'batch_size': 32}
+        )
+    
     def _detect_file_type(self, file_name):
         """Detect file type from extension"""
         return os.path.splitext(file_name)[1].lower().lstrip('.')
@@ -157,43 +357,41 @@ class RAGEngine:
             # Small models: 4096 context (was 2048)
             return (256, 4096, 180)
     
-    def _load_excel_with_pandas(self, file_path):
-        """Load Excel using Pandas - MORE RELIABLE!"""
+    def _load_excel_with_pandas(self, file_path, file_name=None):
+        """Load Excel using Pandas - MORE RELIABLE! (path or file-like object)"""
         print(f"[Excel] Using Pandas loader (more reliable)")
+        file_name = file_name or os.path.basename(file_path)
         
         try:
             documents = []
-            excel_file = pd.ExcelFile(file_path)
-            sheet_names = excel_file.sheet_names
-            excel_file.close()
-            
-            for sheet_name in sheet_names:
-                print(f"[Excel] Reading sheet: {sheet_name}")
-                df = pd.read_excel(file_path, sheet_name=sheet_name)
-                
-                content = f"=== Sheet: {sheet_name} ===\n\n"
-                content += "Columns: " + ", ".join(df.columns.tolist()) + "\n\n"
-                content += f"Total rows: {len(df)}\n\n"
-                content += "Data:\n"
-                
-                for idx, row in df.head(1000).iterrows():
-                    row_text = " | ".join([f"{col}: {val}" for col, val in row.items()])
-                    content += f"Row {idx + 1}: {row_text}\n"
-                
-                if len(df) > 1000:
-                    content += f"\n... (showing first 1000 of {len(df)} rows)\n"
-                
-                doc = Document(
-                    page_content=content,
-                    metadata={
-                        "source": os.path.basename(file_path),
-                        "sheet": sheet_name,
-                        "rows": len(df),
-                        "columns": len(df.columns)
-                    }
-                )
-                documents.append(doc)
-                del df
+            with pd.ExcelFile(file_path) as excel_file:
+                for sheet_name in excel_file.sheet_names:
+                    print(f"[Excel] Reading sheet: {sheet_name}")
+                    df = excel_file.parse(sheet_name)
+                    
+                    content = f"=== Sheet: {sheet_name} ===\n\n"
+                    content += "Columns: " + ", ".join(df.columns.tolist()) + "\n\n"
+                    content += f"Total rows: {len(df)}\n\n"
+                    content += "Data:\n"
+                    
+                    for idx, row in df.head(1000).iterrows():
+                        row_text = " | ".join([f"{col}: {val}" for col, val in row.items()])
+                        content += f"Row {idx + 1}: {row_text}\n"
+                    
+                    if len(df) > 1000:
+                        content += f"\n... (showing first 1000 of {len(df)} rows)\n"
+                    
+                    doc = Document(
+                        page_content=content,
+                        metadata={
+                            "source": file_name,
+                            "sheet": sheet_name,
+                            "rows": len(df),
+                            "columns": len(df.columns)
+                        }
+                    )
+                    documents.append(doc)
+                    del df
             
             print(f"[Excel] ✅ Successfully loaded {len(documents)} sheet(s)")
             return documents
@@ -202,9 +400,10 @@ class RAGEngine:
             print(f"[Excel] Pandas failed: {e}")
             raise
     
-    def _load_excel_with_openpyxl(self, file_path):
-        """Load Excel using OpenPyXL - FALLBACK METHOD"""
+    def _load_excel_with_openpyxl(self, file_path, file_name=None):
+        """Load Excel using OpenPyXL - FALLBACK METHOD (path or file-like object)"""
         print(f"[Excel] Using OpenPyXL loader (fallback)")
+        file_name = file_name or os.path.basename(file_path)
         
         try:
             from openpyxl import load_workbook
@@ -233,7 +432,7 @@ class RAGEngine:
                     doc = Document(
                         page_content=content,
                         metadata={
-                            "source": os.path.basename(file_path),
+                            "source": file_name,
                             "sheet": sheet_name,
                             "rows": sheet.max_row
                         }
@@ -250,17 +449,16 @@ class RAGEngine:
             print(f"[Excel] OpenPyXL failed: {e}")
             raise
     
-    def _process_image_with_vision(self, file_path, file_name):
-        """Process image using vision model"""
-        print(f"[Vision] Processing {file_name} with {self.vision_model}")
-        
-        try:
-            with open(file_path, 'rb') as f:
-                image_data = f.read()
-            
-            image_b64 = base64.b64encode(image_data).decode('utf-8')
-            
-            prompt = """Analyze this image thoroughly and provide:
+    def _image_document(self, file_name, description, method, frame=None, frame_count=1):
+        title = f"{file_name} (frame {frame + 1}/{frame_count})" if frame_count > 1 else file_name
+        metadata = {"source": file_name, "type": "image", "processed_with": method}
+        if frame_count > 1:
+            metadata["frame"] = frame
+        return Document(page_content=f"=== IMAGE: {title} ===\n\n{description}", metadata=metadata)
+    
+    def _invoke_vision(self, image_b64):
+        """Single vision model call on one base64-encoded image"""
+        prompt = """Analyze this image thoroughly and provide:
 1. What type of document/image is this?
 2. Extract ALL visible text (OCR)
 3. Describe any charts, diagrams, or visual elements
@@ -268,30 +466,132 @@ class RAGEngine:
 5. Note any important details
 
 Be comprehensive and extract everything visible."""
+        
+        message = {
+            "role": "user",
+            "content": prompt,
+            "images": [image_b64]
+        }
+        
+        response = self.vision_llm.invoke([message])
+        return response.content
+    
+    def _process_image_with_vision(self, image_data, file_name):
+        """
+        Process image - OCR triage first, vision model only when needed
+        - Text-heavy images (screenshots, scans) are indexed straight from OCR
+        - Others are downscaled/re-encoded (multi-frame GIF/TIFF split into
+          frames) before going to the vision model
+        - Finished analyses are cached by image hash
+        
+        Args:
+            image_data: Image bytes (or memoryview of the upload)
+        """
+        cache_key = self.image_cache.key(image_data, self.vision_model)
+        cached = self.image_cache.get(cache_key)
+        if cached:
+            print(f"[Vision] ♻️ Cached analysis for {file_name} ({cached['method']})")
+            descriptions = cached["descriptions"]
+            return [
+                self._image_document(file_name, description, cached["method"], i, len(descriptions))
+                for i, description in enumerate(descriptions)
+            ]
+        
+        triage = triage_image(image_data)
+        if triage["route"] == "ocr":
+            description = f"Text extracted with OCR:\n\n{triage['text']}"
+            self.image_cache.put(cache_key, description, "ocr")
+            print(f"[Vision] ✅ Indexed from OCR, skipped {self.vision_model}")
+            return [self._image_document(file_name, description, "ocr")]
+        
+        prepared = prepare_image_for_vision(image_data)
+        frames = prepared["frames"]
+        print(f"[Vision] Processing {file_name} with {self.vision_model}: "
+              f"{len(frames)} frame(s), {prepared['bytes_before'] / 1024:.0f} KB → "
+              f"{prepared['bytes_after'] / 1024:.0f} KB")
+        
+        try:
+            start_time = time.time()
+            descriptions = [
+                self.vision_batch.run_with_retry(
+                    self._invoke_vision, base64.b64encode(frame).decode('utf-8'), label=file_name
+                )
+                for frame in frames
+            ]
+            elapsed = time.time() - start_time
             
-            message = {
-                "role": "user",
-                "content": prompt,
-                "images": [image_b64]
-            }
-            
-            response = self.vision_llm.invoke([message])
-            description = response.content
+            print(f"[Vision] ✅ Extracted {sum(len(d) for d in descriptions)} characters in {elapsed:.2f}s")
+            self.image_cache.put(cache_key, descriptions, "vision")
             
-            print(f"[Vision] ✅ Extracted {len(description)} characters")
+            documents = []
+            for i, description in enumerate(descriptions):
+                doc = self._image_document(file_name, description, "vision", i, len(descriptions))
+                doc.metadata["bytes_original"] = prepared["bytes_before"]
+                doc.metadata["bytes_sent"] = prepared["bytes_after"]
+                documents.append(doc)
+            return documents
             
+        except Exception as e:
+            print(f"[Vision] Failed: {e}")
+            # Whatever OCR found is still better than nothing
+            if triage["text"].strip():
+                return [self._image_document(file_name, f"Text extracted with OCR:\n\n{triage['text']}", "ocr")]
             return [Document(
-                page_content=f"=== IMAGE: {file_name} ===\n\n{description}",
+                page_content=f"[Image: {file_name} - Vision processing unavailable]",
                 metadata={"source": file_name, "type": "image"}
             )]
+    
+    def _load_document_from_buffer(self, buffer, file_name):
+        """
+        Load document straight from the upload buffer - no temp file
+        
+        Returns:
+            Documents (list or lazy iterator), or None if the format needs a path
+        """
+        file_type = self._detect_file_type(file_name)
+        
+        try:
+            if self._is_image_file(file_type):
+                return self._process_image_with_vision(buffer, file_name)
+            
+            # Legacy Word/RTF → DOCX through the warm LibreOffice pool
+            elif file_type in ['doc', 'rtf', 'odt'] and self.office_pool:
+                return self._load_converted(buffer, file_name)
             
+            elif file_type in ['xlsx', 'xls', 'ods']:
+                if PANDAS_AVAILABLE:
+                    try:
+                        return self._load_excel_with_pandas(MemoryViewReader(buffer), file_name)
+                    except Exception as e:
+                        # e.g. .xls without xlrd - let LibreOffice turn it into .xlsx
+                        if file_type in CONVERSION_TARGETS and self.office_pool:
+                            print(f"[Excel] Pandas failed ({e}), converting with LibreOffice")
+                            return self._load_converted(buffer, file_name)
+                        raise
+                elif OPENPYXL_AVAILABLE and file_type == 'xlsx':
+                    return self._load_excel_with_openpyxl(MemoryViewReader(buffer), file_name)
+                return None
+            
+            return load_from_buffer(buffer, file_name, file_type)
+        
         except Exception as e:
-            print(f"[Vision] Failed: {e}")
+            print(f"[ERROR] Loading {file_name}: {e}")
             return [Document(
-                page_content=f"[Image: {file_name} - Vision processing unavailable]",
-                metadata={"source": file_name, "type": "image"}
+                page_content=f"[Error: {file_name}]",
+                metadata={"source": file_name, "error": str(e)}
             )]
     
+    def _load_converted(self, buffer, file_name):
+        """Convert a legacy format with LibreOffice, then load the modern file from memory"""
+        try:
+            converted, new_type = self.office_pool.convert(buffer, file_name)
+        except Exception as e:
+            print(f"[Office] ⚠️ Conversion failed, using fallback loader: {e}")
+            return None
+        
+        stem = os.path.splitext(file_name)[0]
+        return self._load_document_from_buffer(memoryview(converted), f"{stem}.{new_type}")
+    
     def _load_document_by_type(self, file_path):
         """Load document using appropriate loader"""
         file_type = self._detect_file_type(file_path)
@@ -300,11 +600,12 @@ Be comprehensive and extract everything visible."""
         try:
             # Images - use vision model
             if self._is_image_file(file_type):
-                return self._process_image_with_vision(file_path, file_name)
+                with open(file_path, 'rb') as f:
+                    return self._process_image_with_vision(f.read(), file_name)
             
-            # PDF
+            # PDF - parallel page extraction, streamed page by page
             elif file_type == 'pdf':
-                return PyPDFLoader(file_path).load()
+                return ParallelPDFLoader(file_path).lazy_load()
             
             # Word
             elif file_type in ['docx', 'doc']:
@@ -358,6 +659,96 @@ Be comprehensive and extract everything visible."""
                 metadata={"source": file_name, "error": str(e)}
             )]
     
+    def _make_text_splitter(self, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+        """
+        🚀 ENHANCED CHUNKING: Larger chunks with better overlap
+        Offset-based splitter - same chunks as RecursiveCharacterTextSplitter,
+        plus start_index/end_index spans in metadata
+        
+        In parent_child mode this returns the parent splitter (no overlap)
+        """
+        if self.chunking_mode == "parent_child":
+            chunk_size, chunk_overlap = PARENT_CHUNK_SIZE, 0
+        return FastTextSplitter(
+            chunk_size=chunk_size,        # INCREASED from 1200 (25% larger)
+            chunk_overlap=chunk_overlap,  # INCREASED from 300 (keeps more context)
+            separators=[
+                "\n\n\n",           # Major section breaks
+                "\n\n",             # Paragraph breaks
+                "\n",               # Line breaks
+                ". ",               # Sentence breaks
+                " ",                # Word breaks
+                ""
+            ]
+        )
+    
+    def _to_child_chunks(self, parents):
+        """
+        Parent-child mode: store parent sections and return their small,
+        non-overlapping children (the only thing that gets embedded)
+        """
+        if self.chunking_mode != "parent_child":
+            return parents
+        
+        child_splitter = FastTextSplitter(chunk_size=CHILD_CHUNK_SIZE, chunk_overlap=0)
+        children = []
+        stored = {}
+        for parent in parents:
+            parent_id = uuid.uuid4().hex
+            parent.metadata["parent_id"] = parent_id
+            stored[parent_id] = parent
+            
+            offset = parent.metadata.get("start_index", 0)
+            for child in child_splitter.split_documents([parent]):
+                child.metadata["start_index"] += offset
+                child.metadata["end_index"] += offset
+                children.append(child)
+        
+        with self.index_lock:
+            self._touch_docstore()
+            self.parent_store.update(stored)
+            self._unsaved_parents.extend(stored)
+        return children
+    
+    def _should_stream(self, file_name, size):
+        """Very large plain-text files are chunked and embedded incrementally"""
+        return self._detect_file_type(file_name) in STREAMING_TYPES and size > STREAMING_THRESHOLD
+    
+    def ingest_text_stream(self, source, file_name, batch_size=512):
+        """
+        Stream a very large text/Markdown/YAML file into the vectorstore
+        
+        The file is memory-mapped (or the upload buffer is read in place),
+        decoded and split one window at a time, and embedded in batches -
+        the full text and full chunk list are never held in memory. A
+        segment is committed every STREAM_SAVE_CHUNKS unsaved chunks.
+        
+        Args:
+            source: File path or bytes/memoryview buffer
+            file_name: Name for 'source' metadata
+            batch_size: Chunks per embedding batch
+        
+        Returns:
+            Number of chunks added (the last ones are not saved yet)
+        """
+        self._check_writable()
+        print(f"[Streaming] 📄 {file_name}: streaming in {batch_size}-chunk batches")
+        start_time = time.time()
+        
+        loader = StreamingTextLoader(source, file_name)
+        total = 0
+        for batch in iter_batches(loader.lazy_chunks(self._make_text_splitter()), batch_size):
+            total += self.add_to_vectorstore(self._to_child_chunks(batch))
+            if len(self._unsaved_chunks) >= STREAM_SAVE_CHUNKS:
+                self._save_vectorstore()
+        
+        if total:
+            self.processed_documents.append(file_name)
+        elapsed = time.time() - start_time
+        print(f"[Streaming] ✅ {file_name}: {total} chunks in {elapsed:.2f}s "
+              f"({total / elapsed if elapsed else 0:.0f} chunks/s)")
+        return total
+    
     def process_uploaded_file(self, uploaded_file):
         """
         🚀 ENHANCED: Process uploaded file with BETTER CHUNKING
@@ -375,43 +766,37 @@ Be comprehensive and extract everything visible."""
         
         tmp_path = None
         try:
-            # Create temp file
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_type}") as tmp_file:
-                tmp_file.write(uploaded_file.getvalue())
-                tmp_path = tmp_file.name
+            # Parse straight from the upload buffer when the format allows it
+            buffer = get_upload_buffer(uploaded_file)
+            documents = self._load_document_from_buffer(buffer, file_name)
             
-            # Load document
-            documents = self._load_document_by_type(tmp_path)
+            if documents is None:
+                # Loader needs a real path (RTF, XML, legacy formats)
+                with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_type}") as tmp_file:
+                    tmp_file.write(buffer)
+                    tmp_path = tmp_file.name
+                documents = self._load_document_by_type(tmp_path)
             
-            # Clean up temp file
-            if tmp_path and os.path.exists(tmp_path):
-                os.unlink(tmp_path)
+            text_splitter = self._make_text_splitter()
             
-            if not documents:
+            # Split each document as soon as it is available, so PDF pages
+            # are chunked while later pages are still being extracted
+            chunks = []
+            loaded_any = False
+            for document in documents:
+                loaded_any = True
+                chunks.extend(text_splitter.split_documents([document]))
+            
+            if not loaded_any:
                 print(f"[Warning] No content from {file_name}")
                 return []
             
-            # 🚀 ENHANCED CHUNKING: Larger chunks with better overlap
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1500,        # INCREASED from 1200 (25% larger)
-                chunk_overlap=400,      # INCREASED from 300 (keeps more context)
-                separators=[
-                    "\n\n\n",           # Major section breaks
-                    "\n\n",             # Paragraph breaks
-                    "\n",               # Line breaks
-                    ". ",               # Sentence breaks
-                    " ",                # Word breaks
-                    ""
-                ],
-                length_function=len
-            )
-            
-            chunks = text_splitter.split_documents(documents)
-            
             # Update metadata
             for chunk in chunks:
                 chunk.metadata['source'] = file_name
             
+            chunks = self._to_child_chunks(chunks)
+            
             self.processed_documents.append(file_name)
             print(f"[Processing] ✅ {file_name}: {len(chunks)} chunks (ENHANCED chunking)")
             print(f"[Processing] 📊 Estimated coverage: ~{len(chunks) * 1.5:.0f} chunks = ~{len(chunks) * 0.3:.0f} pages")
@@ -419,32 +804,730 @@ Be comprehensive and extract everything visible."""
             return chunks
             
         except Exception as e:
-            if tmp_path and os.path.exists(tmp_path):
-                os.unlink(tmp_path)
             print(f"[ERROR] Processing {file_name}: {e}")
             raise
+        
+        finally:
+            # Clean up temp file (only after lazy loaders are fully consumed)
+            if tmp_path and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+    
+    def process_uploaded_files(self, uploaded_files, progress_callback=None):
+        """
+        Process and embed a batch of uploads
+        
+        Images are analysed concurrently in the vision pool while text
+        documents from the same batch are loaded, chunked and embedded.
+        Text documents are added in upload order as they are chunked, then
+        the images in upload order - so a mixed batch is indexed text first
+        (no text file waits for an image that came before it).
+        
+        Args:
+            uploaded_files: Streamlit UploadedFile objects (or anything with .name/.getvalue())
+            progress_callback: Optional fn(file_name, done, total), called from this thread
+        
+        Files that are already indexed are replaced once their new version
+        has parsed - a file that fails keeps its indexed version.
+        
+        Returns:
+            Number of chunks added
+        """
+        self._check_writable()
+        indexed = set(self.metadata_index.values("source")) | set(self.processed_documents)
+        
+        total = len(uploaded_files)
+        image_futures = {}
+        for index, uploaded_file in enumerate(uploaded_files):
+            if self._is_image_file(self._detect_file_type(uploaded_file.name)):
+                image_futures[index] = self.vision_batch.submit(self.process_uploaded_file, uploaded_file)
+        
+        if image_futures:
+            print(f"[Batch] {len(image_futures)} image(s) queued for vision "
+                  f"({self.vision_batch.max_concurrency} concurrent)")
+        
+        results = {}
+        done = 0
+        
+        # Text documents don't wait for images - embed them as they're chunked
+        for index, uploaded_file in enumerate(uploaded_files):
+            if index in image_futures:
+                continue
+            buffer = get_upload_buffer(uploaded_file)
+            if self._should_stream(uploaded_file.name, len(buffer)):
+                # Streamed files are never parsed ahead - the old version goes first
+                self._replace_indexed(uploaded_file.name, indexed)
+                results[index] = self.ingest_text_stream(buffer, uploaded_file.name)
+            else:
+                chunks = self.process_uploaded_file(uploaded_file)
+                self._replace_indexed(uploaded_file.name, indexed, chunks)
+                results[index] = self.add_to_vectorstore(chunks)
+            done += 1
+            if progress_callback:
+                progress_callback(uploaded_file.name, done, total)
+        
+        for index, future in image_futures.items():
+            chunks = future.result()
+            self._replace_indexed(uploaded_files[index].name, indexed, chunks)
+            results[index] = self.add_to_vectorstore(chunks)
+            done += 1
+            if progress_callback:
+                progress_callback(uploaded_files[index].name, done, total)
+        
+        self._save_vectorstore()
+        self._schedule_document_index([uploaded_file.name for uploaded_file in uploaded_files])
+        return sum(results.values())
+    
+    def _replace_indexed(self, file_name, indexed, parsed=()):
+        """
+        Remove the indexed version of a file whose new version is about to be
+        added - only once that version parsed, so a failed read keeps the old one
+        
+        Args:
+            file_name: Source name
+            indexed: Sources that were indexed before the batch started
+            parsed: The new version's chunks (their parent sections are already stored)
+        """
+        if file_name not in indexed:
+            return
+        print(f"[Batch] ♻️ Replacing {file_name}")
+        self.delete_document(file_name, save=False,
+                             keep_parents=[chunk.metadata["parent_id"] for chunk in parsed
+                                           if "parent_id" in chunk.metadata])
+        if parsed:
+            self.processed_documents.append(file_name)
+    
+    def _lookup_chunk(self, chunk_id):
+        """Stored chunk Document by id, or None"""
+        if self.vectorstore is None:
+            return None
+        # Looked up to record a duplicate on it - its metadata changes and is written back after dedup
+        if chunk_id in self._looked_up:
+            return self._looked_up[chunk_id]
+        document = self.docstore.search(chunk_id)
+        if not isinstance(document, Document):
+            return None
+        self._looked_up[chunk_id] = document
+        return document
+    
+    def _touch_docstore(self):
+        """
+        Called (under index_lock) before the docstore changes: until the next
+        save it no longer matches the saved manifest, and the next load must
+        replay the segments instead of trusting it
+        """
+        self._docstore_changes += 1
+        if self._docstore_current:
+            self.docstore.set_meta("generation", "")
+            self._docstore_current = False
+    
+    def _check_writable(self):
+        if self.collection.read_only:
+            raise ValueError(f"Collection '{self.collection.name}' is a read-only bundle - "
+                             f"import it (import_bundle) to change it")
+    
+    def _new_vectorstore(self, dim):
+        """Empty FAISS index over the SQLite docstore - whatever it held before is dropped"""
+        self.segment_store.reset()
+        self.docstore.clear()
+        # Parents of the batch being added are already stored
+        parents = self._unsaved_parents
+        self.parent_store.retain(parents)
+        self._reset_unsaved()
+        self._unsaved_parents = parents
+        self._looked_up = {}
+        return FAISS(embedding_function=self.embeddings, index=self._make_index(dim),
+                     docstore=self.docstore, index_to_docstore_id={})
+    
+    def _make_index(self, dim):
+        """One flat L2 index, or shards searched in parallel for large collections"""
+        import faiss
+        
+        if self.num_shards > 1:
+            return ShardedIndex(dim, self.num_shards, self.shard_by)
+        return faiss.IndexFlatL2(dim)
+    
+    def add_to_vectorstore(self, chunks):
+        """
+        Embed chunks into the existing vectorstore (creating it if needed) - does not save
+        
+        Near-duplicates of already indexed chunks are dropped first and
+        recorded on the stored chunk instead.
+        
+        Returns:
+            Number of chunks actually embedded
+        """
+        self._check_writable()
+        if not self.collection.loaded:
+            # Never start a fresh index over one saved on disk
+            self.load_index()
+        if self.deduplicator and chunks:
+            chunks = self.deduplicator.deduplicate(chunks, lookup=self._lookup_chunk)
+            with self.index_lock:
+                if self._looked_up:
+                    self._touch_docstore()
+                    self.docstore.update_metadata(
+                        {chunk_id: document.metadata for chunk_id, document in self._looked_up.items()})
+                    self._dirty_chunks.update(self._looked_up)
+                    self._looked_up = {}
+        if not chunks:
+            return 0
+        
+        start_time = time.time()
+        ids = [chunk.metadata.setdefault("chunk_id", uuid.uuid4().hex) for chunk in chunks]
+        # float32 rows - unsaved vectors are held until the next save
+        vectors = np.asarray(self.embeddings.embed_documents([chunk.page_content for chunk in chunks]),
+                             dtype=np.float32)
+        with self.index_lock:
+            if self.vectorstore is None:
+                self.vectorstore = self._new_vectorstore(len(vectors[0]))
+            self._touch_docstore()
+            first_position = self.vectorstore.index.ntotal
+            if isinstance(self.vectorstore.index, ShardedIndex):
+                self.vectorstore.index.set_next_sources([chunk.metadata.get("source") for chunk in chunks])
+            # FAISS.add fills the index before its id mapping - no search may run in between
+            with self.search_lock.writing():
+                self.vectorstore.add_embeddings(
+                    zip([chunk.page_content for chunk in chunks], vectors),
+                    metadatas=[chunk.metadata for chunk in chunks], ids=ids)
+            for offset, chunk in enumerate(chunks):
+                self.metadata_index.add(first_position + offset, chunk.metadata)
+            self._unsaved_chunks.extend(zip(ids, vectors))
+        
+        elapsed = time.time() - start_time
+        print(f"[Vectorstore] ➕ {len(chunks)} chunks embedded in {elapsed:.2f}s "
+              f"(total: {self.vectorstore.index.ntotal})")
+        return len(chunks)
+    
+    def _reset_unsaved(self):
+        self.collection.reset_unsaved()
+    
+    def _save_vectorstore(self, checkpoint=None, raise_errors=False):
+        """
+        Persist the changes since the last save as one new segment
+        
+        Cost is proportional to the new chunks, not the index size; the
+        manifest swap makes the save atomic.
+        
+        Args:
+            checkpoint: Optional (name, state) saved in the same manifest swap (see ingest_cli.py)
+            raise_errors: Re-raise a failed save (after keeping the changes for the
+                          next one) instead of only logging it
+        """
+        if self.collection.read_only:
+            return
+        if self.vectorstore is None:
+            if checkpoint is not None:
+                self.segment_store.set_checkpoint(*checkpoint)
+            return
+        start_time = time.time()
+        
+        with self.index_lock:
+            unsaved = (self._unsaved_chunks, self._dirty_chunks, self._unsaved_parents, self._unsaved_deletes)
+            changes = self._docstore_changes
+            self._reset_unsaved()
+            
+            # Read back from the docstore - fresh copies, so ingestion can't change them mid-write
+            new_ids = set()
+            chunks = []
+            vectors = []
+            for (chunk_id, vector), chunk in zip(unsaved[0], self.docstore.get_many(c for c, _ in unsaved[0])):
+                if chunk is not None:
+                    new_ids.add(chunk_id)
+                    chunks.append(chunk)
+                    vectors.append(vector)
+            updates = [chunk for chunk in self.docstore.get_many(c for c in unsaved[1] if c not in new_ids)
+                       if chunk is not None]
+            parents = [(parent_id, parent) for parent_id, parent in zip(unsaved[2], self.parent_store.get_many(unsaved[2]))
+                       if parent is not None]
+            deleted = list(unsaved[3])
+        
+        try:
+            name = self.segment_store.commit(chunks, np.asarray(vectors, dtype=np.float32) if vectors else None,
+                                             updates, parents, deleted, embedding_model=MODEL_NAME,
+                                             checkpoint=checkpoint)
+        except Exception as e:
+            print(f"[Vectorstore] Could not save: {e}")
+            # Keep the changes for the next save
+            with self.index_lock:
+                self._unsaved_chunks[:0] = unsaved[0]
+                self._dirty_chunks |= unsaved[1]
+                self._unsaved_parents[:0] = unsaved[2]
+                self._unsaved_deletes[:0] = unsaved[3]
+            if raise_errors:
+                raise
+            return
+        
+        with self.index_lock:
+            if name and changes == self._docstore_changes:
+                self.segment_store.mark_current(self.docstore)
+                self._docstore_current = True
+        if name:
+            print(f"[Vectorstore] 💾 Saved {name}: {len(chunks)} new, {len(updates)} updated, "
+                  f"{len(deleted)} deleted in {time.time() - start_time:.2f}s "
+                  f"({len(self.segment_store.manifest['segments'])} segments)")
+            self._remove_legacy_files()
+        if self.segment_store.needs_merge():
+            self.maintenance_pool.submit(self.segment_store.merge)
+        index = self.vectorstore.index if self.vectorstore is not None else None
+        if isinstance(index, ShardedIndex) and index.needs_rebalance():
+            self.maintenance_pool.submit(self._rebalance_shards, self.collection)
+    
+    def _rebalance_shards(self, collection):
+        """Background job: spread sources evenly again once one shard has grown too large"""
+        store = collection.vectorstore
+        if store is None or not isinstance(store.index, ShardedIndex) or not store.index.needs_rebalance():
+            return
+        start_time = time.time()
+        with collection.index_lock:
+            old = store.index
+            index = old.rebalanced()
+            # Positions don't change - the new shards can simply replace the old ones
+            store.index = index
+        sizes = [stats["rows"] for stats in index.shard_stats()]
+        print(f"[Shards] ⚖️ Rebalanced {old.ntotal} vectors over {index.num_shards} shards "
+              f"{sizes} in {time.time() - start_time:.2f}s")
+    
+    def _remove_legacy_files(self):
+        """Whole-index save_local files are superseded once the first segment exists"""
+        for file_name in ("index.faiss", "index.pkl", "parents.json", "tombstones.json"):
+            path = os.path.join(self.vector_dir, file_name)
+            if os.path.exists(path):
+                os.unlink(path)
+    
+    def load_index(self):
+        """
+        Restore the collection's saved index - segments, or a legacy
+        save_local folder (migrated to segments on the way)
+        
+        A collection is loaded once; engines opening it later share it.
+        
+        Returns:
+            Number of chunks loaded
+        """
+        with self.index_lock:
+            if self.collection.loaded:
+                return self.vectorstore.index.ntotal - len(self.tombstones) if self.vectorstore is not None else 0
+            self.collection.loaded = True
+            return self._load_index()
+    
+    def _load_index(self):
+        start_time = time.time()
+        try:
+            data = self.segment_store.load(self.docstore, self.parent_store, embedding_model=MODEL_NAME)
+        except Exception as e:
+            print(f"[Vectorstore] ❌ Could not load saved index: {e}")
+            return 0
+        if data is None:
+            return self._load_legacy_index()
+        self._docstore_current = True
+        if not data["ids"]:
+            return 0
+        
+        self._restore(data["ids"], data["vectors"])
+        print(f"[Vectorstore] 📂 Loaded {len(data['ids'])} chunks from "
+              f"{len(self.segment_store.manifest['segments'])} segment(s) in {time.time() - start_time:.2f}s"
+              f"{' (docstore rebuilt)' if data['rebuilt'] else ''}")
+        return len(data["ids"])
+    
+    def _load_legacy_index(self):
+        if not os.path.exists(os.path.join(self.vector_dir, "index.faiss")):
+            return 0
+        try:
+            legacy = FAISS.load_local(self.vector_dir, self.embeddings, allow_dangerous_deserialization=True)
+        except Exception as e:
+            print(f"[Vectorstore] ❌ Could not load saved index: {e}")
+            return 0
+        
+        stored = legacy.docstore._dict
+        positions = [p for p, chunk_id in sorted(legacy.index_to_docstore_id.items()) if chunk_id in stored]
+        ids = [legacy.index_to_docstore_id[p] for p in positions]
+        vectors = legacy.index.reconstruct_batch(np.asarray(positions, dtype=np.int64))
+        parents = {}
+        parents_path = os.path.join(self.vector_dir, "parents.json")
+        if os.path.exists(parents_path):
+            with open(parents_path, encoding='utf-8') as f:
+                parents = {parent_id: Document(**parent) for parent_id, parent in json.load(f).items()}
+        
+        with self.index_lock:
+            self._touch_docstore()
+            self.docstore.clear()
+            self.parent_store.clear()
+            for chunk_id, chunk in stored.items():
+                chunk.metadata.setdefault("chunk_id", chunk_id)
+            self.docstore.add({chunk_id: stored[chunk_id] for chunk_id in ids})
+            self.parent_store.update(parents)
+        self._restore(ids, vectors)
+        # Everything goes into the first segment
+        self._unsaved_chunks = list(zip(ids, vectors))
+        self._unsaved_parents = list(parents)
+        print(f"[Vectorstore] 📂 Migrating legacy index ({len(ids)} chunks) to segments")
+        self._save_vectorstore()
+        return len(ids)
+    
+    def _restore(self, ids, vectors):
+        """
+        Rebuild the in-memory vectorstore and every side index once the
+        docstores hold the stored chunks (only their metadata is read here)
+        """
+        position_of = {chunk_id: position for position, chunk_id in enumerate(ids)}
+        
+        with self.index_lock:
+            self.tombstones = set()
+            self._index_epoch += 1
+            self.doc_index = DocumentIndex()
+            self.metadata_index.clear()
+            self._looked_up = {}
+            # Files indexed only as duplicates of other files' chunks count too
+            sources = {}
+            row_sources = [None] * len(ids)
+            for chunk_id, metadata in self.docstore.iter_metadata():
+                position = position_of[chunk_id]
+                self.metadata_index.add(position, metadata)
+                row_sources[position] = metadata.get("source")
+                sources[metadata.get("source")] = None
+                for ref in metadata.get("duplicate_sources", []):
+                    sources[ref.get("source")] = None
+            
+            index = self._make_index(vectors.shape[1])
+            if isinstance(index, ShardedIndex):
+                index.set_next_sources(row_sources)
+            index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+            self.vectorstore = FAISS(embedding_function=self.embeddings, index=index, docstore=self.docstore,
+                                     index_to_docstore_id=dict(enumerate(ids)))
+            self._reset_unsaved()
+        self.processed_documents = list(sources)
+        
+        # Near-duplicate signatures and document centroids are rebuilt in the background;
+        # saved summaries are reused instead of asking the LLM again
+        if self.deduplicator and not self.collection.read_only:
+            self.deduplicator.reset()
+            self.maintenance_pool.submit(self._rebuild_dedup_signatures, self.collection, self.vectorstore)
+        summaries = {}
+        summaries_path = os.path.join(self.vector_dir, "documents.json")
+        if os.path.exists(summaries_path):
+            try:
+                with open(summaries_path, encoding='utf-8') as f:
+                    summaries = {source: entry.get("summary") for source, entry in json.load(f).items()}
+            except (OSError, ValueError) as e:
+                print(f"[DocIndex] Could not read saved summaries: {e}")
+        self._schedule_document_index(self.metadata_index.values("source"), summaries)
+    
+    def _rebuild_dedup_signatures(self, collection, store):
+        start_time = time.time()
+        count = 0
+        for chunk_id, chunk in store.docstore.iter_documents():
+            if store is not collection.vectorstore:
+                return
+            signature = collection.deduplicator.hasher.signature(chunk.page_content)
+            if signature is not None:
+                collection.deduplicator.add(signature, chunk_id)
+            count += 1
+        print(f"[Dedup] Signatures of {count} chunks restored in {time.time() - start_time:.2f}s")
+    
+    def delete_document(self, source, save=True, keep_parents=()):
+        """
+        Remove one file's chunks without rebuilding or re-embedding anything
+        
+        Chunks are dropped from the docstore, metadata/document indexes and
+        deduplicator at once; their vectors are tombstoned (skipped by every
+        search) and compacted away in the background. Chunks of other files
+        that were deduplicated into a deleted chunk are re-added under their
+        own source, reusing the stored vector.
+        
+        Args:
+            source: File name
+            save: Persist afterwards (in the background)
+            keep_parents: Parent sections of the file's new version, already stored
+                          (replacing a file after its new version was parsed)
+        
+        Returns:
+            Number of chunks removed
+        """
+        self._check_writable()
+        if self.vectorstore is None:
+            return 0
+        start_time = time.time()
+        
+        with self.index_lock:
+            store = self.vectorstore
+            self._touch_docstore()
+            # A file can be indexed only as duplicate references on other files' chunks
+            positions = sorted(self.metadata_index.select(source=source))
+            promoted = []
+            if positions:
+                chunk_ids = [store.index_to_docstore_id[position] for position in positions]
+                removed = store.docstore.get_many(chunk_ids)
+                vectors = store.index.reconstruct_batch(np.asarray(positions, dtype=np.int64))
+                
+                store.docstore.delete(chunk_ids)
+                self._unsaved_deletes.extend(chunk_ids)
+                self.tombstones.update(positions)
+                self.metadata_index.remove(positions)
+                if self.deduplicator:
+                    self.deduplicator.remove(chunk_ids)
+                promoted = self._promote_duplicates(removed, vectors, source)
+            
+            self.doc_index.remove(source)
+            keep_parents = set(keep_parents)
+            removed_parents = [parent_id for parent_id in self.parent_store.ids_for_source(source)
+                               if parent_id not in keep_parents]
+            self.parent_store.delete(removed_parents)
+            self._unsaved_deletes.extend(removed_parents)
+            
+            # Surviving chunks no longer "also appear" in the deleted file
+            changed = {}
+            for chunk_id, chunk in store.docstore.iter_documents(metadata_contains=json.dumps(source)):
+                duplicates = chunk.metadata.get("duplicate_sources")
+                if duplicates:
+                    kept = [ref for ref in duplicates if ref.get("source") != source]
+                    if len(kept) == len(duplicates):
+                        continue
+                    if kept:
+                        chunk.metadata["duplicate_sources"] = kept
+                    else:
+                        del chunk.metadata["duplicate_sources"]
+                    changed[chunk_id] = chunk.metadata
+            store.docstore.update_metadata(changed)
+            self._dirty_chunks.update(changed)
+        
+        self.processed_documents = [name for name in self.processed_documents if name != source]
+        if source in self.search_filters.get("source", []):
+            self.search_filters["source"] = [s for s in self.search_filters["source"] if s != source]
+            if not self.search_filters["source"]:
+                del self.search_filters["source"]
+        print(f"[Vectorstore] 🗑️ {source}: {len(positions)} chunks removed in {time.time() - start_time:.2f}s"
+              f"{f', {len(promoted)} duplicate(s) re-added for other files' if promoted else ''} "
+              f"({len(self.tombstones)} tombstones)")
+        
+        self._schedule_document_index({chunk.metadata["source"] for chunk in promoted})
+        self.maintenance_pool.submit(self._maintain, self.collection, save)
+        return len(positions)
+    
+    def _promote_duplicates(self, removed, vectors, source):
+        """Re-add other files' copies recorded on deleted representatives (caller holds index_lock)"""
+        texts = []
+        metadatas = []
+        promoted_vectors = []
+        for chunk, vector in zip(removed, vectors):
+            refs = [ref for ref in chunk.metadata.get("duplicate_sources", []) if ref.get("source") != source]
+            if not refs:
+                continue
+            metadata = dict(refs[0], chunk_id=uuid.uuid4().hex)
+            if refs[1:]:
+                metadata["duplicate_sources"] = refs[1:]
+            texts.append(chunk.page_content)
+            metadatas.append(metadata)
+            promoted_vectors.append(np.asarray(vector, dtype=np.float32))
+        if not texts:
+            return []
+        
+        first_position = self.vectorstore.index.ntotal
+        ids = [metadata["chunk_id"] for metadata in metadatas]
+        if isinstance(self.vectorstore.index, ShardedIndex):
+            self.vectorstore.index.set_next_sources([metadata.get("source") for metadata in metadatas])
+        with self.search_lock.writing():
+            self.vectorstore.add_embeddings(zip(texts, promoted_vectors), metadatas=metadatas, ids=ids)
+        self._unsaved_chunks.extend(zip(ids, promoted_vectors))
+        promoted = []
+        for offset, (text, metadata) in enumerate(zip(texts, metadatas)):
+            self.metadata_index.add(first_position + offset, metadata)
+            if self.deduplicator:
+                signature = self.deduplicator.hasher.signature(text)
+                if signature is not None:
+                    self.deduplicator.add(signature, metadata["chunk_id"])
+            promoted.append(self.vectorstore.docstore.search(metadata["chunk_id"]))
+        return promoted
+    
+    def replace_document(self, uploaded_file):
+        """Re-index a changed file in place of its previous version"""
+        return self.process_uploaded_files([uploaded_file])
+    
+    def _maintain(self, collection, save=True):
+        """Background job after deletions: compact when tombstones pile up, then persist"""
+        if collection is not self.collection:
+            # Switched away - open_collection saved it; compaction waits for its next deletion
+            return
+        try:
+            if self.vectorstore is not None and len(self.tombstones) >= max(
+                    COMPACT_MIN_TOMBSTONES, self.vectorstore.index.ntotal * COMPACT_MIN_RATIO):
+                self.compact()
+            if save:
+                self._save_vectorstore()
+        except Exception as e:
+            print(f"[Vectorstore] ⚠️ Maintenance failed: {e}")
+    
+    def compact(self):
+        """
+        Physically remove tombstoned vectors
+        
+        The index is cloned, shrunk and swapped in, so searches running on
+        the old one are unaffected; positions in the metadata and document
+        indexes are remapped.
+        
+        Returns:
+            Number of vectors removed
+        """
+        with self.index_lock:
+            if self.vectorstore is None or not self.tombstones:
+                return 0
+            start_time = time.time()
+            store = self.vectorstore
+            dead = np.asarray(sorted(self.tombstones), dtype=np.int64)
+            
+            keep = np.ones(store.index.ntotal, dtype=bool)
+            keep[dead] = False
+            mapping = np.full(store.index.ntotal, -1, dtype=np.int64)
+            mapping[keep] = np.arange(int(keep.sum()))
+            
+            index = clone_index(store.index)
+            index.remove_ids(dead)
+            index_to_docstore_id = {int(mapping[position]): chunk_id
+                                    for position, chunk_id in store.index_to_docstore_id.items()
+                                    if mapping[position] >= 0}
+            store.index = index
+            store.index_to_docstore_id = index_to_docstore_id
+            self.metadata_index.remap(mapping)
+            self.doc_index.remap(mapping)
+            self.tombstones = set()
+            self._index_epoch += 1
+        
+        print(f"[Vectorstore] 🧹 Compacted {len(dead)} deleted vectors in {time.time() - start_time:.2f}s "
+              f"(total: {index.ntotal})")
+        return len(dead)
+    
+    def _schedule_document_index(self, sources, summaries=None):
+        """
+        Queue (re)building the document-level entries of these sources in the background
+        
+        Args:
+            summaries: Optional {source: saved summary} - reused instead of asking the LLM
+        """
+        if self.vectorstore is None:
+            return
+        summaries = summaries or {}
+        for source in dict.fromkeys(sources):
+            self.pending_documents.add(source)
+            self.summary_pool.submit(self._index_document, source, self.collection, self.vectorstore,
+                                     summaries.get(source))
+    
+    def _index_document(self, source, collection, store, summary=None):
+        """
+        Background job: centroid and section entry for one source, then its summary
+        
+        Args:
+            source: File name (chunk metadata 'source')
+            collection: Collection the job was queued for
+            store: Its vectorstore at the time - results are dropped if it was cleared meanwhile
+            summary: Saved summary to reuse, if any
+        """
+        try:
+            start_time = time.time()
+            with collection.index_lock:
+                if store is not collection.vectorstore:
+                    return
+                positions = sorted(collection.metadata_index.select(source=source))
+                chunks = store.docstore.get_many(store.index_to_docstore_id[position] for position in positions)
+                if not positions:
+                    collection.doc_index.remove(source)
+                    return
+                vectors = store.index.reconstruct_batch(np.asarray(positions, dtype=np.int64))
+                entry = collection.doc_index.build_entry(source, positions, vectors, [c.metadata for c in chunks])
+            print(f"[DocIndex] 📑 {source}: {len(positions)} chunks, {len(entry['sections'])} section(s) "
+                  f"indexed in {time.time() - start_time:.2f}s")
+        finally:
+            collection.pending_documents.discard(source)
+        
+        try:
+            if not summary:
+                summary = self._summarize_document(source, chunks, vectors, entry["centroid"])
+            summary_vector = self.embeddings.embed_documents([summary])[0]
+        except Exception as e:
+            print(f"[DocIndex] ⚠️ Summary failed for {source} (routing uses its centroid only): {e}")
+            return
+        
+        with collection.index_lock:
+            if store is not collection.vectorstore:
+                return
+            collection.doc_index.set_summary(source, summary, summary_vector)
+        print(f"[DocIndex] ✅ {source}: summary ready ({len(summary)} chars) in {time.time() - start_time:.1f}s")
+        self._save_document_index(collection)
+    
+    def _summarize_document(self, source, chunks, vectors, centroid):
+        """LLM summary from the document's opening chunks plus the chunks closest to its centroid"""
+        if self.summary_llm is None:
+            self.summary_llm = ChatOllama(
+                model=self.model,
+                temperature=0.2,
+                num_predict=256,
+                num_ctx=4096,
+                timeout=120,
+                keep_alive="10m"
+            )
+        
+        order = sorted(range(len(chunks)), key=lambda i: (
+            chunks[i].metadata.get("page", 0) if isinstance(chunks[i].metadata.get("page"), int) else 0,
+            chunks[i].metadata.get("row", 0), chunks[i].metadata.get("start_index", 0)))
+        typical = np.argsort(-(vectors @ centroid))
+        
+        # Half the budget for the opening, the rest for the most representative chunks
+        selected = []
+        size = 0
+        for i in order[:8]:
+            if size > SUMMARY_CONTEXT_CHARS // 2:
+                break
+            selected.append(i)
+            size += len(chunks[i].page_content)
+        for i in typical:
+            if size > SUMMARY_CONTEXT_CHARS:
+                break
+            if i not in selected:
+                selected.append(int(i))
+                size += len(chunks[i].page_content)
+        
+        context = "\n\n---\n\n".join(chunks[i].page_content for i in sorted(selected, key=order.index))
+        return self.summary_llm.invoke(SUMMARY_PROMPT.format(
+            source=source, context=context[:SUMMARY_CONTEXT_CHARS + 1500])).content.strip()
+    
+    def _save_document_index(self, collection):
+        if collection.read_only:
+            return
+        try:
+            os.makedirs(collection.directory, exist_ok=True)
+            with collection.index_lock:
+                data = collection.doc_index.to_json()
+            write_json_atomic(os.path.join(collection.directory, "documents.json"), data)
+        except Exception as e:
+            print(f"[DocIndex] Could not save: {e}")
+    
+    def get_document_summary(self, source):
+        """Stored summary of a file, or None while it is still being written"""
+        entry = self.doc_index.entries.get(source)
+        return entry["summary"] if entry else None
     
     def create_vectorstore(self, chunks):
         """Create FAISS vectorstore from chunks"""
+        self._check_writable()
         print(f"[Vectorstore] Creating from {len(chunks)} chunks...")
         start_time = time.time()
         
         if not chunks:
             raise ValueError("No chunks provided")
         
-        self.vectorstore = FAISS.from_documents(chunks, embedding=self.embeddings)
+        self.vectorstore = None
+        if self.deduplicator:
+            self.deduplicator.reset()
+        self.doc_index = DocumentIndex()
+        self.metadata_index.clear()
+        self.tombstones = set()
+        self._index_epoch += 1
+        self.add_to_vectorstore(chunks)
         
         elapsed = time.time() - start_time
         print(f"[Vectorstore] ✅ Created in {elapsed:.2f}s")
         print(f"[Vectorstore] 📊 Total vectors: {self.vectorstore.index.ntotal}")
         
-        # Save vectorstore
-        os.makedirs(self.vector_dir, exist_ok=True)
-        try:
-            self.vectorstore.save_local(self.vector_dir)
-            print(f"[Vectorstore] 💾 Saved to disk")
-        except Exception as e:
-            print(f"[Vectorstore] Could not save: {e}")
+        self._save_vectorstore()
+        self._schedule_document_index([chunk.metadata.get("source") for chunk in chunks])
     
     def setup_chain(self):
         """
@@ -513,37 +1596,20 @@ Answer (be thorough and complete):""",
         
         # 🚀 ENHANCED RETRIEVAL: Configure based on mode
         if self.retrieval_mode == "mmr":
-            # MMR: Maximal Marginal Relevance - diverse results
-            search_type = "mmr"
-            search_kwargs = {
-                "k": self.num_chunks,
-                "fetch_k": self.num_chunks * 3,  # Fetch 3x more for diversity
-                "lambda_mult": 0.7                # Balance relevance vs diversity
-            }
             print(f"[Chain] Using MMR retrieval (diverse results)")
-            
         elif self.retrieval_mode == "hybrid":
-            # Hybrid: Get more and re-rank
-            search_type = "similarity"
-            search_kwargs = {
-                "k": self.num_chunks,
-                "score_threshold": 0.3  # Only include relevant results
-            }
             print(f"[Chain] Using Hybrid retrieval (filtered results)")
-            
-        else:  # similarity (default)
-            # Simple similarity search
-            search_type = "similarity"
-            search_kwargs = {"k": self.num_chunks}
+        elif self.retrieval_mode == "multi_query":
+            print(f"[Chain] Using Multi-query retrieval (parallel fan-out + rank fusion)")
+        else:
             print(f"[Chain] Using Similarity retrieval (relevance-based)")
+        if self.chunking_mode == "parent_child":
+            print(f"[Chain] Parent-child: matching {CHILD_CHUNK_SIZE}-char children, returning parent sections")
         
         # Create chain with enhanced settings
         self.chain = ConversationalRetrievalChain.from_llm(
             llm=self.llm,
-            retriever=self.vectorstore.as_retriever(
-                search_type=search_type,
-                search_kwargs=search_kwargs
-            ),
+            retriever=self._build_retriever(),
             memory=self.memory,
             return_source_documents=True,
             combine_docs_chain_kwargs={"prompt": qa_prompt},
@@ -553,6 +1619,379 @@ Answer (be thorough and complete):""",
         print(f"[Chain] ✅ Ready!")
         print(f"[Chain] 📊 Will retrieve {self.num_chunks} chunks (~{self.num_chunks * 0.8:.0f}-{self.num_chunks:.0f} pages)")
     
+    def _route(self, embedding):
+        """
+        Pick the documents (and their sections) to search
+        
+        Returns:
+            (sources, positions) - best-matching sources, and the FAISS positions
+            to restrict the chunk search to (None = search everything)
+        """
+        with self.index_lock:
+            if not len(self.doc_index):
+                return [], None
+            sources = self.doc_index.route(embedding)
+            # Documents not (yet) in the document index are invisible to the router - search everything meanwhile
+            if (not self.document_routing or self.pending_documents
+                    or len(self.doc_index) < ROUTE_MIN_DOCUMENTS
+                    or len(self.doc_index) < len(self.metadata_index.values("source"))):
+                return sources, None
+            positions = self.doc_index.positions_for(sources, embedding)
+        print(f"[Retrieval] 📑 Routed to {', '.join(sources)} "
+              f"({len(positions)} of {self.vectorstore.index.ntotal} chunks)")
+        return sources, positions
+    
+    def _candidates(self, query, embedding, filters=None):
+        """
+        Stage one of retrieval: metadata prefilter, then document routing
+        
+        Filters come from the caller, the engine's search_filters and file
+        names / pages / sheets / file kinds mentioned in the question; the
+        detected ones only narrow the chosen ones. When the detected filters
+        match nothing they are dropped, but filters the user chose are never
+        widened - nothing matching them means no results.
+        
+        Returns:
+            (sources, positions) as for _route - positions are only valid until
+            the next compaction (see _candidate_search)
+        """
+        chosen = {**self.search_filters, **(filters or {})}
+        filters = _narrow_filters(chosen, self.metadata_index.detect_filters(query))
+        if not filters:
+            return self._route(embedding)
+        
+        with self.index_lock:
+            allowed = self.metadata_index.select(**filters)
+        if not allowed and filters != chosen:
+            print(f"[Retrieval] ⚠️ No chunks match {_describe_filters(filters)} - "
+                  f"{f'keeping only {_describe_filters(chosen)}' if chosen else 'searching everything'}")
+            if not chosen:
+                return self._route(embedding)
+            filters = chosen
+            with self.index_lock:
+                allowed = self.metadata_index.select(**filters)
+        if not allowed:
+            print(f"[Retrieval] ⚠️ No chunks match {_describe_filters(filters)}")
+            return [], []
+        print(f"[Retrieval] 🏷️ Prefilter {_describe_filters(filters)}: "
+              f"{len(allowed)} of {self.vectorstore.index.ntotal} chunks")
+        
+        # Explicitly named files are searched whole; otherwise routing narrows the filtered set further
+        if "source" in filters:
+            sources = [source for source in self.metadata_index.values("source")
+                       if source in _accepted(filters["source"])]
+            return sources, sorted(allowed)
+        sources, routed = self._route(embedding)
+        if routed is not None and allowed.intersection(routed):
+            return sources, sorted(allowed.intersection(routed))
+        return sources, sorted(allowed)
+    
+    def _candidate_search(self, query, embedding, filters, search):
+        """
+        Run search(positions, epoch) on the query's candidates
+        
+        A compaction between choosing the candidates and searching them
+        renumbers the index; the candidates are then chosen again.
+        
+        Returns:
+            (sources, search results)
+        """
+        while True:
+            epoch = self._index_epoch
+            sources, positions = self._candidates(query, embedding, filters)
+            try:
+                return sources, search(positions, epoch)
+            except _StalePositions:
+                print("[Retrieval] Index compacted during the search - choosing candidates again")
+    
+    def _search_positions(self, embedding, k, positions, mode, epoch=None):
+        """
+        Chunk search restricted to the given FAISS positions
+        
+        Small subsets are scored directly from their reconstructed vectors;
+        larger ones go through the index with an IDSelector (other rows skipped).
+        positions=None searches every chunk that is not tombstoned.
+        
+        Args:
+            epoch: Index epoch the positions were computed in - raises
+                   _StalePositions when a compaction has renumbered them since
+        """
+        import faiss
+        from langchain_community.vectorstores.utils import maximal_marginal_relevance
+        
+        if positions is not None and not len(positions):
+            return []
+        
+        # Compaction swaps in a new index, mapping and tombstone set - use one consistent snapshot
+        with self.index_lock:
+            if epoch is not None and epoch != self._index_epoch:
+                raise _StalePositions()
+            index = self.vectorstore.index
+            index_to_docstore_id = self.vectorstore.index_to_docstore_id
+            tombstones = set(self.tombstones)
+        # Other sessions may be adding to the index in place
+        with self.search_lock.reading():
+            query = np.asarray([embedding], dtype=np.float32)
+            depth = k * 3 if mode == "mmr" else k
+            if positions is None:
+                inner = faiss.IDSelectorBatch(np.asarray(sorted(tombstones), dtype=np.int64))
+                selector = faiss.IDSelectorNot(inner)
+                fetch_k = min(depth, index.ntotal - len(tombstones))
+                if fetch_k <= 0:
+                    return []
+                distances, found = index.search(query, fetch_k, params=faiss.SearchParameters(sel=selector))
+                hits = [(int(i), float(d)) for i, d in zip(found[0], distances[0]) if i != -1]
+            elif len(positions) * 8 <= index.ntotal:
+                fetch_k = min(depth, len(positions))
+                candidates = np.asarray(positions, dtype=np.int64)
+                distances = ((index.reconstruct_batch(candidates) - query) ** 2).sum(axis=1)
+                best = np.argsort(distances, kind="stable")[:fetch_k]
+                hits = [(int(candidates[j]), float(distances[j])) for j in best]
+            else:
+                fetch_k = min(depth, len(positions))
+                selector = faiss.IDSelectorBatch(np.asarray(positions, dtype=np.int64))
+                distances, found = index.search(query, fetch_k, params=faiss.SearchParameters(sel=selector))
+                hits = [(int(i), float(d)) for i, d in zip(found[0], distances[0]) if i != -1]
+        
+            if mode == "hybrid":
+                hits = [(i, d) for i, d in hits if d <= 0.3]
+            elif mode == "mmr" and hits:
+                vectors = index.reconstruct_batch(np.asarray([i for i, _ in hits], dtype=np.int64))
+                selected = maximal_marginal_relevance(query[0], vectors, k=k, lambda_mult=0.7)
+                hits = [hits[j] for j in selected]
+        
+            ids = [index_to_docstore_id[i] for i, _ in hits[:k]]
+        return [chunk for chunk in self.vectorstore.docstore.get_many(ids) if chunk is not None]
+    
+    def _search(self, query, k, embedding=None, positions=None, epoch=None):
+        """Vector search for k chunks using the configured retrieval mode (optionally within positions)"""
+        if embedding is None:
+            embedding = self.embeddings.embed_query(query)
+        if positions is not None or self.tombstones:
+            return self._search_positions(embedding, k, positions, self.retrieval_mode, epoch)
+        with self.search_lock.reading():
+            if self.retrieval_mode == "mmr":
+                # MMR: Maximal Marginal Relevance - fetch 3x more, balance relevance vs diversity
+                return self.vectorstore.max_marginal_relevance_search_by_vector(
+                    embedding, k=k, fetch_k=k * 3, lambda_mult=0.7)
+            elif self.retrieval_mode == "hybrid":
+                # Hybrid: only include relevant results
+                return self.vectorstore.similarity_search_by_vector(embedding, k=k, score_threshold=0.3)
+            return self.vectorstore.similarity_search_by_vector(embedding, k=k)
+    
+    def _expand_to_parents(self, children):
+        """Replace matched children with their parent sections, de-duplicated, best match first"""
+        results = []
+        seen = set()
+        for child in children:
+            parent_id = child.metadata.get("parent_id")
+            parent = self.parent_store.get(parent_id) if parent_id else None
+            if parent is None:
+                results.append(child)
+                continue
+            if parent_id in seen:
+                continue
+            seen.add(parent_id)
+            results.append(parent)
+            if len(results) >= self.num_chunks:
+                break
+        return results[:self.num_chunks]
+    
+    def _query_variants(self, query, max_variants=4):
+        """Heuristic variants, topped up by the expansion model when one is configured"""
+        variants = heuristic_variants(query, max_variants)
+        if not self.query_expansion_model or len(variants) >= max_variants:
+            return variants
+        
+        try:
+            if self.query_expansion_llm is None:
+                self.query_expansion_llm = ChatOllama(
+                    model=self.query_expansion_model,
+                    temperature=0.3,
+                    num_predict=128,
+                    timeout=20,
+                    keep_alive="10m"
+                )
+            wanted = max_variants - len(variants)
+            response = self.query_expansion_llm.invoke(EXPANSION_PROMPT.format(count=wanted, question=query))
+            for variant in parse_llm_variants(response.content, wanted):
+                if variant.lower() not in {v.lower() for v in variants}:
+                    variants.append(variant)
+        except Exception as e:
+            print(f"[Retrieval] ⚠️ Query expansion failed, using heuristic variants: {e}")
+        return variants[:max_variants]
+    
+    def _timed_search(self, query, embedding, k, positions=None, epoch=None):
+        start_time = time.time()
+        if positions is not None or self.tombstones:
+            results = self._search_positions(embedding, k, positions, "similarity", epoch)
+        else:
+            with self.search_lock.reading():
+                results = self.vectorstore.similarity_search_by_vector(embedding, k=k)
+        return results, (time.time() - start_time) * 1000, self._take_shard_ms()
+    
+    def _take_shard_ms(self):
+        """Per-shard latency of the calling thread's last search (None when not sharded)"""
+        index = self.vectorstore.index if self.vectorstore is not None else None
+        return index.take_shard_ms() if isinstance(index, ShardedIndex) else None
+    
+    def _multi_query_search(self, query, k):
+        """
+        Multi-query fan-out: variants embedded in one batch, searched in
+        parallel, fused with reciprocal rank fusion - still returns k chunks
+        """
+        start_time = time.time()
+        variants = self._query_variants(query)
+        expand_ms = (time.time() - start_time) * 1000
+        
+        cached = sum(1 for v in variants if self.embeddings.is_cached(v))
+        embeddings = self.embeddings.embed_queries(variants)
+        embed_ms = (time.time() - start_time) * 1000 - expand_ms
+        
+        # Every sub-query searches the documents the original question routes to;
+        # each looks deeper than k so fusion has material to rank
+        def search_all(positions, epoch):
+            futures = [self.search_pool.submit(self._timed_search, v, e, k * 2, positions, epoch)
+                       for v, e in zip(variants, embeddings)]
+            return [future.result() for future in futures]
+        
+        sources, searches = self._candidate_search(query, embeddings[0], None, search_all)
+        results = reciprocal_rank_fusion([hits for hits, _, _ in searches], k)
+        
+        sub_queries = [{"query": v, "ms": ms, "hits": len(hits), "shards_ms": shard_ms}
+                       for v, (hits, ms, shard_ms) in zip(variants, searches)]
+        timing = {
+            "expand_ms": expand_ms,
+            "embed_ms": embed_ms,
+            "search_ms": (time.time() - start_time) * 1000 - expand_ms - embed_ms,
+            "cache_hit": cached == len(variants),
+            "sub_queries": sub_queries,
+            "documents": sources
+        }
+        print(f"[Retrieval] 🔀 {len(variants)} sub-queries ({cached} cached embeddings), "
+              f"expand {expand_ms:.1f}ms, embed {embed_ms:.1f}ms, fused {len(results)} chunks")
+        for sub_query in sub_queries:
+            shards = (f"  shards {' / '.join(f'{ms:.1f}' for ms in sub_query['shards_ms'])}ms"
+                      if sub_query["shards_ms"] else "")
+            print(f"[Retrieval]   {sub_query['ms']:.1f}ms  {sub_query['hits']} hits{shards}  \"{sub_query['query']}\"")
+        return results, timing
+    
+    def _retrieve(self, query):
+        """Retrieval pipeline behind the chain's retriever"""
+        parent_child = self.chunking_mode == "parent_child" and self.parent_store
+        k = self.num_chunks * CHILDREN_PER_PARENT if parent_child else self.num_chunks
+        
+        if self.retrieval_mode == "multi_query":
+            results, timing = self._multi_query_search(query, k)
+        else:
+            start_time = time.time()
+            cache_hit = self.embeddings.is_cached(query)
+            embedding = self.embeddings.embed_query(query)
+            embed_ms = (time.time() - start_time) * 1000
+            sources, results = self._candidate_search(
+                query, embedding, None, lambda positions, epoch: self._search(query, k, embedding, positions, epoch))
+            timing = {"embed_ms": embed_ms, "search_ms": (time.time() - start_time) * 1000 - embed_ms,
+                      "cache_hit": cache_hit, "documents": sources, "shards_ms": self._take_shard_ms()}
+            print(f"[Retrieval] Query embedding: {'♻️ cached' if cache_hit else 'computed'} in {embed_ms:.1f}ms, "
+                  f"search {timing['search_ms']:.1f}ms ({self.embeddings.hits} hits / {self.embeddings.misses} misses)")
+            if timing["shards_ms"]:
+                print(f"[Retrieval] Shards: {' / '.join(f'{ms:.1f}' for ms in timing['shards_ms'])}ms")
+        
+        if parent_child:
+            results = self._expand_to_parents(results)
+        
+        # "Summarize X" questions get the precomputed summaries instead of only arbitrary fragments
+        if is_summary_question(query):
+            summaries = [
+                Document(page_content=f"Summary of {source}:\n{summary}",
+                         metadata={"source": source, "type": "document_summary"})
+                for source, summary in self.doc_index.summaries_for(timing["documents"][:2])
+            ]
+            results = summaries + results[:self.num_chunks - len(summaries)]
+        self.last_retrieval_timing = timing
+        return results
+    
+    def search(self, query, k=None, **filters):
+        """
+        Search chunks with explicit metadata filters
+        
+        Args:
+            query: Search text
+            k: Number of chunks (default: num_chunks)
+            **filters: source, file_type, page (0-based), sheet or type - a value
+                       or a list/range of values, e.g. search("totals", source="budget.xlsx")
+        """
+        if self.vectorstore is None:
+            return []
+        k = k or self.num_chunks
+        embedding = self.embeddings.embed_query(query)
+        _, results = self._candidate_search(
+            query, embedding, filters, lambda positions, epoch: self._search(query, k, embedding, positions, epoch))
+        return results
+    
+    def _chunks_for_sources(self, sources):
+        """Every indexed chunk Document of these files - read from the docstore by position"""
+        with self.index_lock:
+            if self.vectorstore is None:
+                return []
+            ids = [self.vectorstore.index_to_docstore_id[position]
+                   for position in sorted(self.metadata_index.select(source=list(sources)))]
+        return [chunk for chunk in self.docstore.get_many(ids) if chunk is not None]
+    
+    def _use_map_reduce(self, question):
+        if self.answer_mode == "map_reduce":
+            return True
+        return self.answer_mode == "auto" and is_exhaustive_question(question)
+    
+    def _answer_map_reduce(self, question, progress_callback=None):
+        """
+        Map-reduce answering: ask the question of every chunk group in the
+        sources where the best matches are, then merge the partial answers
+        """
+        hits = self._retrieve(question)
+        sources = list(dict.fromkeys(hit.metadata.get("source") for hit in hits))
+        hit_keys = {hit.metadata.get("parent_id") or hit.metadata.get("chunk_id") for hit in hits}
+        
+        # Document order: file, page/row, offset
+        source_rank = {source: i for i, source in enumerate(sources)}
+        chunks = self._chunks_for_sources(source_rank)
+        chunks.sort(key=lambda c: (source_rank[c.metadata.get("source")], c.metadata.get("page", 0),
+                                   c.metadata.get("row", 0), c.metadata.get("start_index", 0)))
+        
+        # Half the context window for excerpts (~4 chars per token)
+        _, num_ctx, _ = self._get_model_settings(self.model)
+        groups = group_chunks(chunks, num_ctx * 2)
+        
+        # Over the compute cap, groups holding the best matches are mapped first
+        if len(groups) > self.max_map_calls:
+            def _has_hit(group):
+                return any((c.metadata.get("parent_id") or c.metadata.get("chunk_id")) in hit_keys for c in group)
+            ranked = sorted(range(len(groups)), key=lambda i: (not _has_hit(groups[i]), i))
+            selected = sorted(ranked[:self.max_map_calls])
+            groups = [groups[i] for i in selected] + [groups[i] for i in sorted(ranked[self.max_map_calls:])]
+        
+        print(f"[MapReduce] 🗺️ {len(chunks)} chunks from {len(sources)} source(s) → {len(groups)} groups "
+              f"(cap {self.max_map_calls}, {self.map_concurrency} concurrent)")
+        
+        answerer = MapReduceAnswerer(self.llm, max_concurrency=self.map_concurrency,
+                                     max_map_calls=self.max_map_calls)
+        result = answerer.run(question, groups, progress_callback)
+        
+        answer = result["answer"]
+        if result["skipped"]:
+            covered = len(groups) - result["skipped"]
+            answer += (f"\n\n_⚠️ Covered {covered} of {len(groups)} document sections "
+                       f"(compute cap) - the answer may be incomplete._")
+        print(f"[MapReduce] ✅ {result['mapped']} mapped, {result['relevant']} relevant, "
+              f"{result['skipped']} skipped in {result['elapsed']:.1f}s")
+        
+        if self.memory:
+            self.memory.save_context({"question": question}, {"answer": answer})
+        return {"answer": answer, "source_documents": hits}
+    
+    def _build_retriever(self):
+        return EngineRetriever(engine=self)
+    
     def _is_casual_message(self, message):
         """Check if message is casual conversation"""
         msg_lower = message.lower().strip()
@@ -672,30 +2111,9 @@ Answer (be thorough and complete):""",
                 input_variables=["context", "question"]
             )
             
-            # Configure retrieval based on mode
-            if self.retrieval_mode == "mmr":
-                search_type = "mmr"
-                search_kwargs = {
-                    "k": self.num_chunks,
-                    "fetch_k": self.num_chunks * 3,
-                    "lambda_mult": 0.7
-                }
-            elif self.retrieval_mode == "hybrid":
-                search_type = "similarity"
-                search_kwargs = {
-                    "k": self.num_chunks,
-                    "score_threshold": 0.3
-                }
-            else:
-                search_type = "similarity"
-                search_kwargs = {"k": self.num_chunks}
-            
             self.chain = ConversationalRetrievalChain.from_llm(
                 llm=self.llm,
-                retriever=self.vectorstore.as_retriever(
-                    search_type=search_type,
-                    search_kwargs=search_kwargs
-                ),
+                retriever=self._build_retriever(),
                 memory=self.memory,
                 return_source_documents=True,
                 combine_docs_chain_kwargs={"prompt": qa_prompt},
@@ -705,8 +2123,13 @@ Answer (be thorough and complete):""",
         self.model = new_model
         print(f"[Model Switch] ✅ Switched to {new_model}")
     
-    def ask_question(self, question):
-        """Ask question with enhanced retrieval"""
+    def ask_question(self, question, progress_callback=None):
+        """
+        Ask question with enhanced retrieval
+        
+        Args:
+            progress_callback: Optional fn(stage, done, total) for map-reduce answers
+        """
         print(f"\n{'='*60}")
         print(f"[QUERY] {question}")
         print(f"[MODEL] {self.model}")
@@ -727,6 +2150,9 @@ Answer (be thorough and complete):""",
         total_start = time.time()
         
         try:
+            if self._use_map_reduce(question):
+                return self._answer_map_reduce(question, progress_callback)
+            
             chat_history = self.memory.chat_memory.messages if self.memory else []
             
             print(f"[INFO] Retrieving {self.num_chunks} chunks...")
@@ -739,6 +2165,11 @@ Answer (be thorough and complete):""",
             sources = response.get("source_documents", [])
             
             print(f"\n[INFO] ✅ Retrieved {len(sources)} chunks in {total_time:.2f}s")
+            timing = self.last_retrieval_timing
+            if timing:
+                print(f"[INFO] ⏱️ Query embedding {timing['embed_ms']:.1f}ms "
+                      f"({'cache hit' if timing['cache_hit'] else 'cache miss'}), "
+                      f"vector search {timing['search_ms']:.1f}ms")
             print(f"[INFO] 📊 Coverage: ~{len(sources) * 0.8:.0f}-{len(sources):.0f} pages")
             
             for i, doc in enumerate(sources, 1):
@@ -774,29 +2205,215 @@ Answer (be thorough and complete):""",
             }
     
     def clear_documents(self):
-        """Clear all documents"""
-        self.vectorstore = None
+        """Clear all documents of the open collection (for every engine using it)"""
+        self._check_writable()
         self.chain = None
         self.llm = None
         self.memory = None
-        self.processed_documents = []
-        
-        if os.path.exists(self.vector_dir):
-            import shutil
+        with self.index_lock:
+            self.vectorstore = None
+            self.processed_documents = []
+            self.doc_index = DocumentIndex()
+            self.pending_documents = set()
+            self.metadata_index.clear()
+            self.tombstones = set()
+            self._index_epoch += 1
+            self.segment_store.reset()
+            self._reset_unsaved()
+            if self.deduplicator:
+                self.deduplicator.reset()
+            
+            # Emptied in place - other sessions' searches may be reading the docstores right now
+            self._touch_docstore()
+            self._looked_up = {}
+            self.docstore.clear()
+            self.parent_store.clear()
             try:
-                shutil.rmtree(self.vector_dir)
+                self._remove_legacy_files()
+                documents_path = os.path.join(self.vector_dir, "documents.json")
+                if os.path.exists(documents_path):
+                    os.unlink(documents_path)
                 print("[RAG] Cleared saved vectors")
-            except:
-                pass
+            except OSError as e:
+                print(f"[RAG] ⚠️ Could not remove saved files: {e}")
+            self.collection.loaded = True
         
-        print("[RAG] All documents cleared")
+        print(f"[RAG] All documents cleared from collection '{self.collection.name}'")
+    
+    def open_collection(self, name, load=True):
+        """
+        Switch this engine to a named collection
+        
+        Collections are opened on demand and shared by every engine in the
+        process; the least recently used ones nobody has open are closed
+        once more than MAX_OPEN_COLLECTIONS are in memory. The conversation
+        and search filters start fresh.
+        
+        Args:
+            name: Collection name (letters, digits, '_', '-', '.')
+            load: Load its saved index now (otherwise on first use)
+        
+        Returns:
+            Number of chunks in the collection once loaded (0 when not loaded)
+        """
+        previous = self.collection
+        if previous is not None:
+            if previous.name == name:
+                return self.load_index() if load else 0
+            # Nothing pending is left behind on the collection being closed
+            self._save_vectorstore()
+        
+        collection = self.collection_manager.acquire(
+            name, self, dedup_threshold=self.dedup_threshold, compress_docstore=self.compress_docstore)
+        self.collection = collection
+        if previous is not None:
+            self.collection_manager.release(previous, self)
+            self.chain = None
+            self.memory = None
+            self.search_filters = {}
+            print(f"[RAG] 📚 Switched to collection '{name}'")
+        return self.load_index() if load else 0
+    
+    def list_collections(self):
+        return self.collection_manager.names()
+    
+    def collection_stats(self):
+        """Size and state of the open collection (with per-shard rows and latency when sharded)"""
+        stats = self.collection.stats()
+        index = self.vectorstore.index if self.vectorstore is not None else None
+        if isinstance(index, ShardedIndex):
+            stats["shards"] = index.shard_stats()
+        return stats
+    
+    def _chunking_parameters(self):
+        """Splitter settings new chunks are built with (recorded in bundles)"""
+        return {"mode": self.chunking_mode, "chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP,
+                "parent_chunk_size": PARENT_CHUNK_SIZE, "child_chunk_size": CHILD_CHUNK_SIZE}
+    
+    def _check_chunking(self, bundle):
+        """Chunks from other splitter settings still work - documents added later just won't match them"""
+        ours = {key: value for key, value in self._chunking_parameters().items() if key != "mode"}
+        theirs = {key: bundle["chunking"].get(key) for key in ours}
+        if theirs != ours:
+            print(f"[Bundle] ⚠️ Bundle chunked with {theirs}, this engine uses {ours}")
+    
+    def export_bundle(self, path, name=None):
+        """
+        Write the open collection as a portable knowledge-base bundle
+        
+        The bundle holds the live chunks as one segment (vectors + records),
+        a sealed SQLite docstore, document summaries, the embedding model,
+        chunking parameters and a SHA-256 checksum of every file. Other nodes
+        import it (import_bundle) or serve it in place (mount_bundle) without
+        re-embedding anything.
+        
+        Args:
+            path: New or empty directory
+            name: Collection name the bundle opens as (default: this collection's)
+        
+        Returns:
+            The bundle manifest
+        """
+        name = validate_collection_name(name or self.collection.name)
+        if os.path.exists(path) and os.listdir(path):
+            raise ValueError(f"{path} is not empty")
+        self.load_index()
+        if self.vectorstore is None:
+            raise ValueError(f"Collection '{self.collection.name}' is empty - nothing to export")
+        start_time = time.time()
+        
+        # Pending chunks and queued document summaries are saved first
+        self._save_vectorstore()
+        self.summary_pool.submit(self._save_document_index, self.collection).result()
+        
+        os.makedirs(path, exist_ok=True)
+        docstore_path = os.path.join(path, DOCSTORE_NAME)
+        docstore = SQLiteDocstore(docstore_path, "chunks", compress=self.compress_docstore)
+        try:
+            parent_store = SQLiteDocstore(docstore_path, "parents", compress=self.compress_docstore)
+            try:
+                manifest = self.segment_store.export(path, docstore, parent_store)
+            finally:
+                parent_store.close()
+            docstore.seal()
+        finally:
+            docstore.close()
+        summaries_path = os.path.join(self.vector_dir, "documents.json")
+        if os.path.exists(summaries_path):
+            shutil.copyfile(summaries_path, os.path.join(path, "documents.json"))
+        
+        bundle = write_bundle_manifest(path, name, manifest["dim"], manifest["segments"][0]["chunks"],
+                                       self.processed_documents, self._chunking_parameters(),
+                                       embedding_model=manifest["embedding_model"] or MODEL_NAME)
+        size = sum(entry["bytes"] for entry in bundle["files"].values())
+        print(f"[Bundle] 📦 Exported '{self.collection.name}' to {path}: {bundle['chunks']} chunks, "
+              f"{len(bundle['documents'])} file(s), {size / (1024 * 1024):.1f} MB in {time.time() - start_time:.2f}s")
+        return bundle
+    
+    def import_bundle(self, path, name=None):
+        """
+        Copy a bundle into a new writable collection and open it
+        
+        Every file is checked against the bundle's checksums first; bundles
+        built with another embedding model are refused.
+        
+        Args:
+            path: Bundle directory
+            name: New collection name (default: the bundle's)
+        
+        Returns:
+            Number of chunks in the imported collection
+        """
+        bundle = read_bundle(path, verify=True)
+        name = validate_collection_name(name or bundle["name"])
+        target = self.collection_manager.directory(name)
+        if os.path.exists(target) and os.listdir(target):
+            raise ValueError(f"Collection '{name}' already exists")
+        self._check_chunking(bundle)
+        start_time = time.time()
+        
+        # Copied next to the target and renamed into place - never half-imported
+        staging = os.path.join(os.path.dirname(target), f".{name}.importing")
+        if os.path.exists(staging):
+            shutil.rmtree(staging)
+        os.makedirs(staging)
+        for file_name in bundle["files"]:
+            shutil.copyfile(os.path.join(path, file_name), os.path.join(staging, file_name))
+        if os.path.exists(target):
+            os.rmdir(target)
+        os.replace(staging, target)
+        print(f"[Bundle] 📥 Imported {path} as '{name}' ({bundle['chunks']} chunks) in {time.time() - start_time:.2f}s")
+        return self.open_collection(name)
+    
+    def mount_bundle(self, path, name=None, verify=False):
+        """
+        Serve a bundle in place as a read-only collection and open it
+        
+        Nothing is copied or replayed: the docstore is opened immutable and
+        memory-mapped and vectors are read from the memory-mapped segment.
+        Bundles placed in vectors/bundles/ are mounted under their directory
+        name without calling this.
+        
+        Args:
+            path: Bundle directory
+            name: Collection name (default: the bundle's)
+            verify: Check every file's checksum first (reads the whole bundle once)
+        
+        Returns:
+            Number of chunks served
+        """
+        bundle = read_bundle(path, verify=verify)
+        name = name or bundle["name"]
+        self._check_chunking(bundle)
+        self.collection_manager.mount(name, os.path.abspath(path))
+        return self.open_collection(name)
     
     def set_retrieval_config(self, mode="mmr", num_chunks=12):
         """
         Change retrieval configuration dynamically
         
         Args:
-            mode: 'similarity', 'mmr', or 'hybrid'
+            mode: 'similarity', 'mmr', 'hybrid' or 'multi_query'
             num_chunks: Number of chunks to retrieve (1-20)
         """
         self.retrieval_mode = mode
@@ -807,3 +2424,34 @@ Answer (be thorough and complete):""",
         # Rebuild chain if it exists
         if self.chain:
             self.setup_chain()
+    
+    def set_search_filters(self, **filters):
+        """
+        Scope every question to matching chunks, e.g. set_search_filters(file_type=["pdf"])
+        
+        Call without arguments to search everything again.
+        """
+        unknown = set(filters) - set(INDEXED_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown metadata field(s): {', '.join(sorted(unknown))}")
+        self.search_filters = {field: value for field, value in filters.items() if value}
+        print(f"[Config] Search filters: {self.search_filters or 'none'}")
+    
+    def set_answer_mode(self, mode="auto"):
+        """
+        Args:
+            mode: 'standard', 'map_reduce' or 'auto'
+        """
+        self.answer_mode = mode
+        print(f"[Config] Answer mode: {mode.upper()}")
+    
+    def set_chunking_mode(self, mode="standard"):
+        """
+        Switch chunking for documents processed from now on
+        
+        Args:
+            mode: 'standard' or 'parent_child' - already indexed chunks keep
+                  working either way (chunks without a parent are returned as-is)
+        """
+        self.chunking_mode = mode
+        print(f"[Config] Chunking: {mode.upper()}")
@@ -0,0 +1,208 @@
+import json
+import base64
+import urllib.error
+import urllib.request
+
+from langchain_core.documents import Document
+
+from collection_manager import DEFAULT_COLLECTION
+from memory_loaders import get_upload_buffer
+from rag_engine_enhanced import RAGEngine
+
+
+def _jsonable_filters(filters):
+    """Filter values as JSON lists (ranges, sets and tuples included)"""
+    return {field: list(value) if isinstance(value, (range, set, tuple)) else value
+            for field, value in (filters or {}).items()}
+
+
+class RetrievalClient:
+    """HTTP client for retrieval_server.RetrievalServer"""
+
+    def __init__(self, url, timeout=600):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def _open(self, path, payload=None):
+        data = None if payload is None else json.dumps(payload, default=str).encode('utf-8')
+        request = urllib.request.Request(self.url + path, data=data, headers={"Content-Type": "application/json"})
+        try:
+            return urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read()).get("error", str(e))
+            except ValueError:
+                message = str(e)
+            if e.code == 400:
+                raise ValueError(message)
+            raise RuntimeError(f"Retrieval server error: {message}")
+        except urllib.error.URLError as e:
+            raise ConnectionError(f"Retrieval server {self.url} unreachable: {e.reason}")
+
+    def call(self, path, payload=None):
+        """GET (no payload) or POST a JSON request - returns the decoded reply"""
+        with self._open(path, payload) as response:
+            return json.loads(response.read())
+
+    def stream(self, path, payload):
+        """POST a request whose reply is newline-delimited JSON - yields each line"""
+        with self._open(path, payload) as response:
+            for line in response:
+                if line.strip():
+                    yield json.loads(line)
+
+    def health(self):
+        return self.call("/health")
+
+    def embed(self, texts, query=False):
+        return self.call("/embed", {"texts": list(texts), "query": query})["vectors"]
+
+
+class RemoteRAGEngine(RAGEngine):
+    """
+    RAGEngine whose embedding model and index live in a retrieval server
+
+    Answers are still generated here (chain, map-reduce, chat); embedding,
+    search, ingestion and collection management are requests to the
+    server, so app replicas share one model and one copy of each index.
+    Covers the RAGEngine interface app.py uses; index maintenance
+    (compaction, rebalancing, document summaries) runs on the server.
+    """
+
+    # Stand-ins for the collection state RAGEngine keeps locally
+    vectorstore = property(lambda self: self.client if self._has_vectors else None)
+    processed_documents = property(lambda self: list(self._documents))
+
+    def __init__(self, server_url, model="qwen2.5:7b", vision_model="llama3.2-vision:latest",
+                 retrieval_mode="mmr", num_chunks=12, chunking_mode="standard", answer_mode="auto",
+                 map_concurrency=2, max_map_calls=48, collection=DEFAULT_COLLECTION, timeout=600):
+        """
+        Args:
+            server_url: Retrieval server, e.g. http://retrieval:8600
+            vision_model: Accepted for compatibility - images are analysed by the server's vision model
+            timeout: Seconds to wait for one request (ingestion of large batches included)
+            (other arguments as for RAGEngine)
+        """
+        print(f"[RAG] 🛰️ Using retrieval server {server_url}")
+        print(f"[RAG] Text Model: {model}")
+        self.client = RetrievalClient(server_url, timeout=timeout)
+        self.model = model
+        self.vision_model = vision_model
+        self.retrieval_mode = retrieval_mode
+        self.num_chunks = min(num_chunks, 20)
+        self.chunking_mode = chunking_mode
+        self.answer_mode = answer_mode
+        self.map_concurrency = map_concurrency
+        self.max_map_calls = max_map_calls
+        self.chain = None
+        self.llm = None
+        self.memory = None
+        self.search_filters = {}
+        self.last_retrieval_timing = None
+
+        self.collection_name = collection
+        self._documents = []
+        self._summaries = {}
+        self._has_vectors = False
+
+        health = self.client.health()
+        print(f"[RAG] ✅ Retrieval server ready ({health['status']})")
+
+    def _request(self, path, **payload):
+        """POST with this engine's collection and retrieval settings"""
+        return self.client.call(path, {
+            "collection": self.collection_name,
+            "retrieval_mode": self.retrieval_mode,
+            "num_chunks": self.num_chunks,
+            "chunking_mode": self.chunking_mode,
+            "search_filters": _jsonable_filters(self.search_filters),
+            **payload
+        })
+
+    def _refresh(self, info):
+        """Cache the collection's file list and summaries - other replicas may have changed them"""
+        self._documents = info["documents"]
+        self._summaries = info["summaries"]
+        self._has_vectors = info["has_vectors"]
+        return info
+
+    # --- collection ---
+
+    def load_index(self):
+        """Chunks in the server's copy of the collection (loaded there on first use)"""
+        return self._refresh(self._request("/collection"))["stats"]["chunks"]
+
+    def open_collection(self, name, load=True):
+        if name == self.collection_name:
+            return self.load_index() if load else 0
+        previous = self.collection_name
+        self.collection_name = name
+        try:
+            chunks = self.load_index()
+        except ValueError:
+            self.collection_name = previous
+            raise
+        self.chain = None
+        self.memory = None
+        self.search_filters = {}
+        print(f"[RAG] 📚 Switched to collection '{name}'")
+        return chunks if load else 0
+
+    def list_collections(self):
+        return self.client.call("/collections")["collections"]
+
+    def collection_stats(self):
+        return self._refresh(self._request("/collection"))["stats"]
+
+    def get_document_summary(self, source):
+        return self._summaries.get(source)
+
+    # --- ingestion ---
+
+    def process_uploaded_files(self, uploaded_files, progress_callback=None):
+        """Send a batch of uploads to the server - progress arrives as each file is indexed"""
+        files = [{"name": uploaded_file.name,
+                  "data": base64.b64encode(get_upload_buffer(uploaded_file)).decode('ascii')}
+                 for uploaded_file in uploaded_files]
+        payload = {
+            "collection": self.collection_name,
+            "chunking_mode": self.chunking_mode,
+            "files": files
+        }
+        for event in self.client.stream("/ingest", payload):
+            if "error" in event:
+                raise RuntimeError(event["error"])
+            if "result" in event:
+                return self._refresh(event["result"])["chunks"]
+            if progress_callback:
+                progress_callback(event["file"], event["done"], event["total"])
+        raise RuntimeError("Retrieval server closed the connection during ingestion")
+
+    def delete_document(self, source, save=True):
+        self._refresh(self._request("/delete", source=source))
+        print(f"[Delete] 🗑️ {source} removed on the retrieval server")
+
+    def clear_documents(self):
+        self.chain = None
+        self.llm = None
+        self.memory = None
+        self._refresh(self._request("/clear"))
+        print(f"[RAG] All documents cleared from collection '{self.collection_name}'")
+
+    # --- retrieval ---
+
+    def _documents_from(self, reply):
+        return [Document(page_content=document["page_content"], metadata=document["metadata"])
+                for document in reply["documents"]]
+
+    def _retrieve(self, query):
+        reply = self._request("/search", query=query)
+        self.last_retrieval_timing = reply["timing"]
+        return self._documents_from(reply)
+
+    def search(self, query, k=None, **filters):
+        return self._documents_from(self._request("/search", query=query, k=k or self.num_chunks,
+                                                  filters=_jsonable_filters(filters)))
+
+    def _chunks_for_sources(self, sources):
+        return self._documents_from(self._request("/chunks", sources=list(sources)))
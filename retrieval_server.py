@@ -0,0 +1,359 @@
+import io
+import copy
+import json
+import base64
+import time
+import queue
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from collection_manager import DEFAULT_COLLECTION
+from embeddings import CachedQueryEmbeddings
+from metadata_index import INDEXED_FIELDS
+
+
+DEFAULT_PORT = 8600
+MAX_BATCH = 64        # texts per coalesced model call
+MAX_WAIT_MS = 5       # how long the first request of a batch waits for company
+LISTEN_BACKLOG = 128  # pending connections - the socketserver default of 5 resets bursts from many replicas
+
+
+class BatchingEmbeddings(Embeddings):
+    """
+    Coalesces concurrent embedding calls into one model call
+
+    Queries from many app replicas arrive one at a time; a single worker
+    thread collects whatever is queued within MAX_WAIT_MS (up to
+    MAX_BATCH texts) and embeds it in one batch. Calls that are already a
+    full batch (ingestion) go straight to the model.
+    """
+
+    def __init__(self, base, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS):
+        self.base = base
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self.stats = {"calls": 0, "batches": 0, "texts": 0}
+        self._worker = threading.Thread(target=self._run, name="embed-batcher", daemon=True)
+        self._worker.start()
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        if len(texts) >= self.max_batch:
+            return self.base.embed_documents(texts)
+        return self._submit(texts)
+
+    def embed_query(self, text):
+        return self._submit([text])[0]
+
+    def _submit(self, texts):
+        if not texts:
+            return []
+        future = Future()
+        self._queue.put((texts, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            pending = [self._queue.get()]
+            size = len(pending[0][0])
+            deadline = time.time() + self.max_wait
+            while size < self.max_batch:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                pending.append(item)
+                size += len(item[0])
+
+            texts = [text for item_texts, _ in pending for text in item_texts]
+            try:
+                vectors = self.base.embed_documents(texts)
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for item_texts, future in pending:
+                future.set_result(vectors[start:start + len(item_texts)])
+                start += len(item_texts)
+            with self._stats_lock:
+                self.stats["calls"] += len(pending)
+                self.stats["batches"] += 1
+                self.stats["texts"] += len(texts)
+
+
+def _document_json(document):
+    return {"page_content": document.page_content, "metadata": document.metadata}
+
+
+def _check_filters(filters):
+    unknown = set(filters or {}) - set(INDEXED_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown metadata field(s): {', '.join(sorted(unknown))}")
+    return {field: value for field, value in (filters or {}).items() if value}
+
+
+def _required(request, field):
+    """Field the endpoint can't do without - a missing one is the client's error (400)"""
+    if not isinstance(request, dict) or field not in request:
+        raise ValueError(f"Missing field '{field}'")
+    return request[field]
+
+
+class RetrievalServer:
+    """
+    One embedding model and one copy of each index, served over HTTP
+
+    App replicas use it through retrieval_client.RemoteRAGEngine instead of
+    loading their own model and index. Every request names its collection
+    and retrieval settings, so the server keeps no per-client state: each
+    request runs on a shallow copy of the engine pointed at the shared
+    collection. Writes (ingest, delete, clear) to one collection are
+    serialized; searches run concurrently with each other, and only wait
+    while a write is adding vectors to the index (the collection's
+    search_lock).
+
+    Endpoints (JSON):
+        GET  /health, /collections
+        POST /embed, /search, /ingest (streams progress lines), /delete,
+             /clear, /collection, /chunks
+    """
+
+    def __init__(self, engine, host="127.0.0.1", port=DEFAULT_PORT):
+        """
+        Args:
+            engine: RAGEngine providing the embedding model, vision model and collections
+            host: Interface to listen on (no authentication - keep it on a private network)
+            port: TCP port
+        """
+        self.engine = engine
+        self.batcher = BatchingEmbeddings(engine.embeddings.base)
+        engine.embeddings = CachedQueryEmbeddings(self.batcher)
+        self._write_locks = defaultdict(threading.Lock)
+        self._write_locks_guard = threading.Lock()
+        self.httpd = _HTTPServer((host, port), _Handler)
+        self.httpd.retrieval = self
+
+    @property
+    def address(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def serve_forever(self):
+        print(f"[Server] 🛰️ Retrieval server on {self.address}")
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.httpd.server_close()
+
+    def shutdown(self):
+        self.httpd.shutdown()
+
+    @contextmanager
+    def _engine(self, request):
+        """Engine view on the request's collection, with the request's retrieval settings"""
+        manager = self.engine.collection_manager
+        engine = copy.copy(self.engine)
+        engine.collection = manager.acquire(
+            request.get("collection") or DEFAULT_COLLECTION, engine,
+            dedup_threshold=self.engine.dedup_threshold, compress_docstore=self.engine.compress_docstore)
+        try:
+            engine.retrieval_mode = request.get("retrieval_mode", engine.retrieval_mode)
+            engine.num_chunks = min(int(request.get("num_chunks", engine.num_chunks)), 20)
+            engine.chunking_mode = request.get("chunking_mode", engine.chunking_mode)
+            engine.search_filters = _check_filters(request.get("search_filters"))
+            engine.load_index()
+            yield engine
+        finally:
+            manager.release(engine.collection, engine)
+
+    def _write_lock(self, request):
+        with self._write_locks_guard:
+            return self._write_locks[request.get("collection") or DEFAULT_COLLECTION]
+
+    # --- endpoints ---
+
+    def health(self, request):
+        return {"status": "ok", "embedding_batches": dict(self.batcher.stats),
+                "query_cache": {"hits": self.engine.embeddings.hits, "misses": self.engine.embeddings.misses}}
+
+    def collections(self, request):
+        return {"collections": self.engine.list_collections()}
+
+    def embed(self, request):
+        texts = _required(request, "texts")
+        if request.get("query"):
+            vectors = self.engine.embeddings.embed_queries(texts)
+        else:
+            vectors = self.engine.embeddings.embed_documents(texts)
+        return {"vectors": np.asarray(vectors, dtype=np.float32).tolist()}
+
+    def search(self, request):
+        """The engine's retrieval pipeline - or an explicit filtered search when k/filters are given"""
+        query = _required(request, "query")
+        with self._engine(request) as engine:
+            if "k" in request or "filters" in request:
+                results = engine.search(query, k=request.get("k"),
+                                        **_check_filters(request.get("filters")))
+                timing = None
+            elif engine.vectorstore is None:
+                results, timing = [], None
+            else:
+                results = engine._retrieve(query)
+                timing = engine.last_retrieval_timing
+        return {"documents": [_document_json(document) for document in results], "timing": timing}
+
+    def collection(self, request):
+        """Open (or create) a collection - its stats, files and summaries"""
+        with self._engine(request) as engine:
+            return self._describe(engine)
+
+    def _describe(self, engine):
+        documents = list(engine.processed_documents)
+        summaries = {}
+        for source in documents:
+            summary = engine.get_document_summary(source)
+            if summary:
+                summaries[source] = summary
+        return {
+            "stats": engine.collection_stats(),
+            "documents": documents,
+            "summaries": summaries,
+            "has_vectors": engine.vectorstore is not None
+        }
+
+    def chunks(self, request):
+        with self._engine(request) as engine:
+            chunks = engine._chunks_for_sources(_required(request, "sources"))
+            return {"documents": [_document_json(chunk) for chunk in chunks]}
+
+    def delete(self, request):
+        with self._write_lock(request), self._engine(request) as engine:
+            engine.delete_document(_required(request, "source"))
+            return self._describe(engine)
+
+    def clear(self, request):
+        with self._write_lock(request), self._engine(request) as engine:
+            engine.clear_documents()
+            return self._describe(engine)
+
+    def ingest(self, request, emit):
+        """Process uploaded files - emit(event) is called after each file"""
+        uploads = []
+        for upload in _required(request, "files"):
+            buffer = io.BytesIO(base64.b64decode(_required(upload, "data")))
+            buffer.name = _required(upload, "name")
+            uploads.append(buffer)
+
+        def on_file_done(file_name, done, total):
+            emit({"file": file_name, "done": done, "total": total})
+
+        with self._write_lock(request), self._engine(request) as engine:
+            start_time = time.time()
+            chunks = engine.process_uploaded_files(uploads, progress_callback=on_file_done)
+            print(f"[Server] 📥 {len(uploads)} file(s) → {chunks} chunks in "
+                  f"'{engine.collection.name}' ({time.time() - start_time:.1f}s)")
+            result = self._describe(engine)
+        result["chunks"] = chunks
+        return result
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = LISTEN_BACKLOG
+
+
+class _Handler(BaseHTTPRequestHandler):
+    GET_ROUTES = {"/health": "health", "/collections": "collections"}
+    POST_ROUTES = {"/embed": "embed", "/search": "search", "/collection": "collection",
+                   "/chunks": "chunks", "/delete": "delete", "/clear": "clear"}
+
+    def do_GET(self):
+        self._dispatch(self.GET_ROUTES, {})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError as e:
+            self._reply(400, {"error": f"Invalid JSON: {e}"})
+            return
+        if urlparse(self.path).path == "/ingest":
+            self._ingest(request)
+        else:
+            self._dispatch(self.POST_ROUTES, request)
+
+    def _dispatch(self, routes, request):
+        name = routes.get(urlparse(self.path).path)
+        if name is None:
+            self._reply(404, {"error": f"Unknown endpoint {self.path}"})
+            return
+        try:
+            self._reply(200, getattr(self.server.retrieval, name)(request))
+        except ValueError as e:
+            # Bad input (missing fields, unknown filters, read-only collection) - anything else is ours
+            self._reply(400, {"error": str(e)})
+        except Exception as e:
+            print(f"[Server] ❌ {self.path}: {e}")
+            self._reply(500, {"error": str(e)})
+
+    def _ingest(self, request):
+        """Newline-delimited JSON: one progress line per file, then the result (or an error)"""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+
+        def emit(event):
+            self.wfile.write(json.dumps(event, default=str).encode('utf-8') + b"\n")
+            self.wfile.flush()
+
+        try:
+            emit({"result": self.server.retrieval.ingest(request, emit)})
+        except Exception as e:
+            print(f"[Server] ❌ /ingest: {e}")
+            emit({"error": str(e)})
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # one line per request is too noisy at replica traffic; errors are printed above
+
+
+if __name__ == "__main__":
+    # Shared retrieval backend for app replicas:
+    #   python retrieval_server.py [--host 0.0.0.0] [--port 8600]
+    # then start each app with RAG_RETRIEVAL_SERVER=http://<host>:8600
+    import argparse
+    from rag_engine_enhanced import RAGEngine
+
+    parser = argparse.ArgumentParser(description="Serve embedding, search and ingestion to app replicas")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--model", default="qwen2.5:7b", help="Ollama model for document summaries")
+    parser.add_argument("--vision-model", default="llama3.2-vision:latest")
+    parser.add_argument("--embedding-backend", default="auto")
+    parser.add_argument("--num-shards", type=int, default=1)
+    parser.add_argument("--shard-by", default="hash")
+    args = parser.parse_args()
+
+    engine = RAGEngine(model=args.model, vision_model=args.vision_model, embedding_backend=args.embedding_backend,
+                       num_shards=args.num_shards, shard_by=args.shard_by)
+    RetrievalServer(engine, host=args.host, port=args.port).serve_forever()
@@ -0,0 +1,224 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import faiss
+
+
+SHARD_STRATEGIES = ("hash", "source")
+REBALANCE_RATIO = 1.5   # source sharding: rebalance once the largest shard is this far above the mean
+REBALANCE_MIN_ROWS = 10000
+
+
+class ShardedIndex:
+    """
+    Flat L2 index split into shards that are searched in parallel
+
+    Each shard is an IndexIDMap2 whose ids are the global row positions,
+    so results, the metadata index, the document index and tombstones all
+    keep using the same positions as with one IndexFlatL2. Implements the
+    part of the faiss index API the engine and langchain's FAISS wrapper
+    use: ntotal, d, add, search (with IDSelector params), reconstruct,
+    reconstruct_batch and remove_ids.
+
+    Rows are placed by position ('hash' - always balanced) or by source
+    file ('source' - a file's chunks stay together; sources are moved
+    between shards when one grows too large).
+    """
+
+    def __init__(self, d, num_shards=4, strategy="hash"):
+        if strategy not in SHARD_STRATEGIES:
+            raise ValueError(f"Unknown shard strategy '{strategy}' (use {', '.join(SHARD_STRATEGIES)})")
+        self.d = d
+        self.num_shards = max(1, num_shards)
+        self.strategy = strategy
+        self.metric_type = faiss.METRIC_L2
+        self.shards = [self._new_shard() for _ in range(self.num_shards)]
+        self.shard_of = np.zeros(0, dtype=np.int32)     # position → shard
+        self.source_of = np.zeros(0, dtype=np.int32)    # position → index into self.sources
+        self.sources = []
+        self._source_ids = {}
+        self.source_shard = {}                          # source → shard ('source' strategy)
+        self._next_sources = None
+        self._pool = ThreadPoolExecutor(max_workers=self.num_shards, thread_name_prefix="shard")
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._stats = [{"searches": 0, "total_ms": 0.0, "max_ms": 0.0} for _ in range(self.num_shards)]
+
+    def _new_shard(self):
+        return faiss.IndexIDMap2(faiss.IndexFlatL2(self.d))
+
+    @property
+    def ntotal(self):
+        return len(self.shard_of)
+
+    # --- adding ---
+
+    def set_next_sources(self, sources):
+        """Source file of each row of the next add() call (used for placement and rebalancing)"""
+        self._next_sources = list(sources)
+
+    def _source_id(self, source):
+        if source not in self._source_ids:
+            self._source_ids[source] = len(self.sources)
+            self.sources.append(source)
+        return self._source_ids[source]
+
+    def _place(self, positions, sources):
+        if self.strategy == "hash":
+            return positions % self.num_shards
+        sizes = np.bincount(self.shard_of, minlength=self.num_shards)
+        placement = np.empty(len(positions), dtype=np.int32)
+        for row, source in enumerate(sources):
+            if source is None:
+                placement[row] = positions[row] % self.num_shards
+                sizes[placement[row]] += 1
+                continue
+            if source not in self.source_shard:
+                # New files go to the smallest shard
+                self.source_shard[source] = int(np.argmin(sizes))
+            placement[row] = self.source_shard[source]
+            sizes[placement[row]] += 1
+        return placement
+
+    def add(self, x):
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        sources = self._next_sources if self._next_sources and len(self._next_sources) == len(x) else [None] * len(x)
+        self._next_sources = None
+        positions = np.arange(self.ntotal, self.ntotal + len(x), dtype=np.int64)
+        placement = self._place(positions, sources)
+        for shard in range(self.num_shards):
+            mask = placement == shard
+            if mask.any():
+                self.shards[shard].add_with_ids(x[mask], positions[mask])
+        self.shard_of = np.concatenate([self.shard_of, placement.astype(np.int32)])
+        self.source_of = np.concatenate([self.source_of,
+                                         np.asarray([self._source_id(s) for s in sources], dtype=np.int32)])
+
+    # --- searching ---
+
+    def _search_shard(self, shard, x, k, params):
+        start_time = time.time()
+        index = self.shards[shard]
+        if index.ntotal:
+            distances, ids = index.search(x, min(k, index.ntotal), params=params)
+        else:
+            distances = np.zeros((len(x), 0), dtype=np.float32)
+            ids = np.zeros((len(x), 0), dtype=np.int64)
+        elapsed = (time.time() - start_time) * 1000
+        with self._stats_lock:
+            stats = self._stats[shard]
+            stats["searches"] += 1
+            stats["total_ms"] += elapsed
+            stats["max_ms"] = max(stats["max_ms"], elapsed)
+        return distances, ids, elapsed
+
+    def search(self, x, k, params=None):
+        """Search every shard in parallel and merge their top-k (same return shape as faiss)"""
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        futures = [self._pool.submit(self._search_shard, shard, x, k, params) for shard in range(self.num_shards)]
+        results = [future.result() for future in futures]
+        self._local.shard_ms = [elapsed for _, _, elapsed in results]
+
+        distances = np.concatenate([d for d, _, _ in results], axis=1)
+        ids = np.concatenate([i for _, i, _ in results], axis=1)
+        distances = np.where(ids < 0, np.inf, distances)
+        # Ties go to the lower position, as in a single flat index
+        order = np.lexsort((ids, distances), axis=-1)[:, :k]
+        top_distances = np.take_along_axis(distances, order, axis=1)
+        top_ids = np.take_along_axis(ids, order, axis=1)
+        if top_ids.shape[1] < k:
+            pad = k - top_ids.shape[1]
+            top_distances = np.pad(top_distances, ((0, 0), (0, pad)), constant_values=np.inf)
+            top_ids = np.pad(top_ids, ((0, 0), (0, pad)), constant_values=-1)
+        top_ids[~np.isfinite(top_distances)] = -1
+        return top_distances.astype(np.float32), top_ids.astype(np.int64)
+
+    def take_shard_ms(self):
+        """Per-shard latency of this thread's last search (cleared once read)"""
+        shard_ms = getattr(self._local, "shard_ms", None)
+        self._local.shard_ms = None
+        return shard_ms
+
+    def shard_stats(self):
+        with self._stats_lock:
+            return [
+                {"shard": shard, "rows": int(self.shards[shard].ntotal), "searches": stats["searches"],
+                 "avg_ms": stats["total_ms"] / stats["searches"] if stats["searches"] else 0.0,
+                 "max_ms": stats["max_ms"]}
+                for shard, stats in enumerate(self._stats)
+            ]
+
+    # --- reading vectors back ---
+
+    def reconstruct(self, position):
+        return self.shards[int(self.shard_of[position])].reconstruct(int(position))
+
+    def reconstruct_batch(self, positions):
+        positions = np.asarray(positions, dtype=np.int64)
+        vectors = np.empty((len(positions), self.d), dtype=np.float32)
+        placement = self.shard_of[positions]
+        for shard in np.unique(placement):
+            mask = placement == shard
+            vectors[mask] = self.shards[int(shard)].reconstruct_batch(positions[mask])
+        return vectors
+
+    # --- rebuilding ---
+
+    def _rebuilt(self, keep, source_shard):
+        """New index with the kept rows, renumbered 0..n-1 in order, placed by source_shard"""
+        positions = np.flatnonzero(keep)
+        index = ShardedIndex(self.d, self.num_shards, self.strategy)
+        index.source_shard = dict(source_shard)
+        index._stats = [dict(stats) for stats in self._stats]
+        batch = 65536
+        for start in range(0, len(positions), batch):
+            chunk = positions[start:start + batch]
+            index.set_next_sources([self.sources[i] for i in self.source_of[chunk]])
+            index.add(self.reconstruct_batch(chunk))
+        return index
+
+    def clone(self):
+        return self._rebuilt(np.ones(self.ntotal, dtype=bool), self.source_shard)
+
+    def remove_ids(self, ids):
+        """Drop rows and renumber the rest (like IndexFlat.remove_ids) - returns the number removed"""
+        keep = np.ones(self.ntotal, dtype=bool)
+        ids = np.asarray(ids, dtype=np.int64)
+        keep[ids[(ids >= 0) & (ids < self.ntotal)]] = False
+        removed = int(self.ntotal - keep.sum())
+        if removed:
+            rebuilt = self._rebuilt(keep, self.source_shard)
+            self.shards, self.shard_of, self.source_of = rebuilt.shards, rebuilt.shard_of, rebuilt.source_of
+            self.sources, self._source_ids = rebuilt.sources, rebuilt._source_ids
+        return removed
+
+    def needs_rebalance(self):
+        if self.strategy != "source" or self.ntotal < REBALANCE_MIN_ROWS:
+            return False
+        sizes = np.bincount(self.shard_of, minlength=self.num_shards)
+        return sizes.max() > sizes.mean() * REBALANCE_RATIO
+
+    def rebalanced(self):
+        """
+        Copy with sources spread evenly over the shards (largest first, each
+        to the currently smallest shard) - positions don't change
+        """
+        source_sizes = np.bincount(self.source_of, minlength=len(self.sources))
+        sizes = np.zeros(self.num_shards, dtype=np.int64)
+        source_shard = {}
+        for source_id in np.argsort(-source_sizes, kind="stable"):
+            if not source_sizes[source_id]:
+                continue
+            shard = int(np.argmin(sizes))
+            source_shard[self.sources[source_id]] = shard
+            sizes[shard] += source_sizes[source_id]
+        return self._rebuilt(np.ones(self.ntotal, dtype=bool), source_shard)
+
+
+def clone_index(index):
+    """faiss.clone_index that also handles ShardedIndex"""
+    if isinstance(index, ShardedIndex):
+        return index.clone()
+    return faiss.clone_index(index)
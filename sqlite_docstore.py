@@ -0,0 +1,280 @@
+import os
+import json
+import sqlite3
+import threading
+from urllib.request import pathname2url
+
+from langchain_core.documents import Document
+from langchain_community.docstore.base import Docstore, AddableMixin
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+
+CODEC_PLAIN = 0
+CODEC_ZSTD = 1
+_MAX_VARIABLES = 500  # stay under SQLite's bound-parameter limit
+
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    """
+    Disk-backed docstore for the FAISS wrapper
+
+    Chunk text (zstd-compressed when available) and JSON metadata live in
+    one SQLite table; only the documents a query returns are read and
+    decoded, so memory stays flat as the corpus grows. Also usable as a
+    dict-like parent store (store[id] = doc, .get, del, in).
+
+    Documents come back as fresh objects - changed metadata must be
+    written back with update().
+    """
+
+    def __init__(self, path, table="chunks", compress=True, zstd_level=3, read_only=False):
+        """
+        Args:
+            path: SQLite file (shared by several tables)
+            table: Table name - 'chunks' or 'parents'
+            compress: zstd-compress text when the zstandard package is installed
+            read_only: Open an existing, sealed file (a bundle) immutable and
+                       memory-mapped - nothing is written, not even lock files
+        """
+        if not table.isidentifier():
+            raise ValueError(f"Invalid table name: {table}")
+        self.path = path
+        self.table = table
+        self.read_only = read_only
+        self.compress = compress and ZSTD_AVAILABLE
+        self._lock = threading.RLock()  # one connection, shared by ingestion and background threads
+        self.zstd_level = zstd_level
+        self._codecs = threading.local()  # zstd (de)compressors must not be shared between threads
+
+        if read_only:
+            uri = f"file:{pathname2url(os.path.abspath(path))}?mode=ro&immutable=1"
+            self._connection = sqlite3.connect(uri, uri=True, check_same_thread=False, isolation_level=None)
+            self._connection.execute(f"PRAGMA mmap_size={os.path.getsize(path)}")
+            return
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} "
+            f"(id TEXT PRIMARY KEY, source TEXT, codec INTEGER, text BLOB, metadata TEXT)")
+        self._connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_source ON {table} (source)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    # --- encoding ---
+
+    def _compressor(self):
+        if not hasattr(self._codecs, "compressor"):
+            self._codecs.compressor = zstandard.ZstdCompressor(level=self.zstd_level)
+        return self._codecs.compressor
+
+    def _decompressor(self):
+        if not hasattr(self._codecs, "decompressor"):
+            self._codecs.decompressor = zstandard.ZstdDecompressor()
+        return self._codecs.decompressor
+
+    def _encode(self, chunk_id, document):
+        text = document.page_content.encode('utf-8')
+        codec = CODEC_PLAIN
+        if self.compress and len(text) > 64:
+            text = self._compressor().compress(text)
+            codec = CODEC_ZSTD
+        metadata = json.dumps(document.metadata, default=str)
+        return chunk_id, document.metadata.get("source"), codec, text, metadata
+
+    def _decode(self, codec, text, metadata):
+        if codec == CODEC_ZSTD:
+            if not ZSTD_AVAILABLE:
+                raise RuntimeError("Docstore holds zstd-compressed text - install the zstandard package")
+            text = self._decompressor().decompress(text)
+        return Document(page_content=bytes(text).decode('utf-8'), metadata=json.loads(metadata))
+
+    def _write(self, statement, rows):
+        with self._lock:
+            self._connection.execute("BEGIN")
+            try:
+                self._connection.executemany(statement, rows)
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    # --- Docstore interface (used by langchain's FAISS) ---
+
+    def add(self, texts):
+        """Add {id: Document} - ids must be new, like InMemoryDocstore"""
+        try:
+            self._write(f"INSERT INTO {self.table} VALUES (?, ?, ?, ?, ?)",
+                        [self._encode(chunk_id, document) for chunk_id, document in texts.items()])
+        except sqlite3.IntegrityError as e:
+            raise ValueError(f"Tried to add ids that already exist: {e}")
+
+    def search(self, search):
+        with self._lock:
+            row = self._connection.execute(
+                f"SELECT codec, text, metadata FROM {self.table} WHERE id = ?", (search,)).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return self._decode(*row)
+
+    def delete(self, ids):
+        self._write(f"DELETE FROM {self.table} WHERE id = ?", [(chunk_id,) for chunk_id in ids])
+
+    # --- bulk access ---
+
+    def update(self, documents):
+        """Write back {id: Document} - inserted when new, rewritten in place (same order) otherwise"""
+        self._write(f"INSERT INTO {self.table} VALUES (?, ?, ?, ?, ?) ON CONFLICT(id) DO UPDATE SET "
+                    f"source = excluded.source, codec = excluded.codec, text = excluded.text, "
+                    f"metadata = excluded.metadata",
+                    [self._encode(chunk_id, document) for chunk_id, document in documents.items()])
+
+    def update_metadata(self, metadatas):
+        """Replace the metadata of stored documents ({id: metadata}) without touching their text"""
+        self._write(f"UPDATE {self.table} SET source = ?, metadata = ? WHERE id = ?",
+                    [(metadata.get("source"), json.dumps(metadata, default=str), chunk_id)
+                     for chunk_id, metadata in metadatas.items()])
+
+    def get_many(self, ids):
+        """Documents for ids, same order (None where missing) - one query per 500 ids"""
+        ids = list(ids)
+        found = {}
+        for start in range(0, len(ids), _MAX_VARIABLES):
+            batch = ids[start:start + _MAX_VARIABLES]
+            with self._lock:
+                rows = self._connection.execute(
+                    f"SELECT id, codec, text, metadata FROM {self.table} "
+                    f"WHERE id IN ({', '.join('?' * len(batch))})", batch).fetchall()
+            for chunk_id, codec, text, metadata in rows:
+                found[chunk_id] = self._decode(codec, text, metadata)
+        return [found.get(chunk_id) for chunk_id in ids]
+
+    def iter_documents(self, metadata_contains=None, batch_size=1000):
+        """
+        Yield (id, Document) in insertion order, a batch at a time
+
+        Args:
+            metadata_contains: Only rows whose metadata JSON contains this substring
+        """
+        last_rowid = 0
+        while True:
+            query = f"SELECT rowid, id, codec, text, metadata FROM {self.table} WHERE rowid > ?"
+            params = [last_rowid]
+            if metadata_contains is not None:
+                query += " AND instr(metadata, ?) > 0"
+                params.append(metadata_contains)
+            with self._lock:
+                rows = self._connection.execute(query + " ORDER BY rowid LIMIT ?",
+                                                params + [batch_size]).fetchall()
+            if not rows:
+                return
+            for rowid, chunk_id, codec, text, metadata in rows:
+                yield chunk_id, self._decode(codec, text, metadata)
+            last_rowid = rows[-1][0]
+
+    def iter_metadata(self, batch_size=5000):
+        """Yield (id, metadata) in insertion order - text is not read"""
+        last_rowid = 0
+        while True:
+            with self._lock:
+                rows = self._connection.execute(
+                    f"SELECT rowid, id, metadata FROM {self.table} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                    (last_rowid, batch_size)).fetchall()
+            if not rows:
+                return
+            for rowid, chunk_id, metadata in rows:
+                yield chunk_id, json.loads(metadata)
+            last_rowid = rows[-1][0]
+
+    def ids(self):
+        """Every id, in insertion order"""
+        with self._lock:
+            return [row[0] for row in self._connection.execute(f"SELECT id FROM {self.table} ORDER BY rowid")]
+
+    def ids_for_source(self, source):
+        with self._lock:
+            return [row[0] for row in self._connection.execute(
+                f"SELECT id FROM {self.table} WHERE source = ?", (source,))]
+
+    def missing(self, ids):
+        """How many of ids are not stored"""
+        ids = list(ids)
+        present = 0
+        for start in range(0, len(ids), _MAX_VARIABLES):
+            batch = ids[start:start + _MAX_VARIABLES]
+            with self._lock:
+                present += self._connection.execute(
+                    f"SELECT COUNT(*) FROM {self.table} WHERE id IN ({', '.join('?' * len(batch))})",
+                    batch).fetchone()[0]
+        return len(ids) - present
+
+    def retain(self, ids):
+        """Delete every row whose id is not in ids (leftovers of an interrupted session)"""
+        keep = set(ids)
+        with self._lock:
+            stored = [row[0] for row in self._connection.execute(f"SELECT id FROM {self.table}")]
+        self.delete([chunk_id for chunk_id in stored if chunk_id not in keep])
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute(f"DELETE FROM {self.table}")
+
+    def get_meta(self, key):
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, str(value)))
+
+    def seal(self):
+        """
+        Fold the WAL into the file and switch to a rollback journal, so the
+        file can be copied or opened read-only on its own (bundles) - no
+        other connection may be open
+        """
+        with self._lock:
+            self._connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._connection.execute("PRAGMA journal_mode=DELETE")
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    # --- dict-like access (parent store) ---
+
+    def __setitem__(self, chunk_id, document):
+        self.update({chunk_id: document})
+
+    def __getitem__(self, chunk_id):
+        document = self.search(chunk_id)
+        if not isinstance(document, Document):
+            raise KeyError(chunk_id)
+        return document
+
+    def __delitem__(self, chunk_id):
+        self.delete([chunk_id])
+
+    def get(self, chunk_id, default=None):
+        document = self.search(chunk_id)
+        return document if isinstance(document, Document) else default
+
+    def __contains__(self, chunk_id):
+        with self._lock:
+            return self._connection.execute(
+                f"SELECT 1 FROM {self.table} WHERE id = ?", (chunk_id,)).fetchone() is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def __bool__(self):
+        with self._lock:
+            return self._connection.execute(f"SELECT 1 FROM {self.table} LIMIT 1").fetchone() is not None
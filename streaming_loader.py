@@ -0,0 +1,112 @@
+import os
+import mmap
+import codecs
+
+from langchain_core.documents import Document
+
+
+# Text files above this size are streamed instead of loaded whole
+STREAMING_THRESHOLD = 32 * 1024 * 1024
+
+STREAMING_TYPES = {'txt', 'md', 'markdown', 'yaml', 'yml'}
+
+# Cut points, strongest first - same hierarchy as the chunk splitter
+_CUT_SEPARATORS = ["\n\n\n", "\n\n", "\n", ". ", " "]
+
+
+def _find_cut(text, min_cut):
+    """Last position >= min_cut right after the strongest separator found there"""
+    for separator in _CUT_SEPARATORS:
+        position = text.rfind(separator, min_cut)
+        if position != -1:
+            return position + len(separator)
+    return len(text)
+
+
+class StreamingTextLoader:
+    """
+    Incremental loader for very large text / Markdown / YAML files
+
+    The file is memory-mapped (or an in-memory buffer is used as-is) and
+    decoded one window at a time. Each window is cut on the strongest
+    separator near its end, split with the normal chunk splitter and
+    yielded, so peak memory is a couple of windows, not the whole file.
+    """
+
+    def __init__(self, source, file_name=None, encoding='utf-8', window_chars=None):
+        """
+        Args:
+            source: File path (memory-mapped) or bytes/memoryview buffer
+            file_name: Name for 'source' metadata (default: basename of path)
+            encoding: Text encoding (undecodable bytes are replaced)
+            window_chars: Decode window; default is set from the splitter's chunk size
+        """
+        self.source = source
+        self.file_name = file_name or (os.path.basename(source) if isinstance(source, str) else "buffer")
+        self.encoding = encoding
+        self.window_chars = window_chars
+
+    def _iter_text_windows(self, view, window_bytes):
+        decoder = codecs.getincrementaldecoder(self.encoding)(errors='replace')
+        for offset in range(0, len(view), window_bytes):
+            text = decoder.decode(bytes(view[offset:offset + window_bytes]))
+            if text:
+                yield text
+        tail = decoder.decode(b"", final=True)
+        if tail:
+            yield tail
+
+    def _iter_segments(self, view, window_chars):
+        """Yield (char_offset, text segment) cut on separator boundaries"""
+        carry = ""
+        offset = 0
+        for text in self._iter_text_windows(view, window_chars):
+            carry += text
+            if len(carry) < window_chars:
+                continue
+            cut = _find_cut(carry, len(carry) // 2)
+            yield offset, carry[:cut]
+            offset += cut
+            carry = carry[cut:]
+        if carry:
+            yield offset, carry
+
+    def lazy_chunks(self, text_splitter):
+        """
+        Yield chunk Documents one by one
+
+        Args:
+            text_splitter: FastTextSplitter (start_index/end_index are file-wide character offsets)
+        """
+        chunk_size = getattr(text_splitter, "_chunk_size", 1500)
+        window_chars = self.window_chars or max(chunk_size * 64, 64 * 1024)
+
+        if isinstance(self.source, str):
+            with open(self.source, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    yield from self._chunks_from_view(mapped, window_chars, text_splitter)
+        else:
+            yield from self._chunks_from_view(memoryview(self.source), window_chars, text_splitter)
+
+    def _chunks_from_view(self, view, window_chars, text_splitter):
+        for segment_index, (offset, segment) in enumerate(self._iter_segments(view, window_chars)):
+            for start, end in text_splitter.split_spans(segment):
+                yield Document(
+                    page_content=segment[start:end],
+                    metadata={"source": self.file_name, "segment": segment_index,
+                              "start_index": offset + start, "end_index": offset + end}
+                )
+
+
+def iter_batches(iterable, batch_size):
+    """Group an iterator into lists of batch_size"""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,252 @@
+"""
+Crash-safe segment persistence (index_store.SegmentStore) and the FAISS
+positions the engine keeps on top of it
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+import index_store
+from index_store import SegmentStore
+from sqlite_docstore import SQLiteDocstore
+
+
+def _chunk(chunk_id, source="a.txt"):
+    return Document(page_content=f"text of {chunk_id}", metadata={"chunk_id": chunk_id, "source": source})
+
+
+def _vectors(n, dim=4, offset=0):
+    return np.arange(offset, offset + n * dim, dtype=np.float32).reshape(n, dim)
+
+
+def _docstores(directory):
+    path = os.path.join(directory, "docstore.sqlite")
+    return SQLiteDocstore(path, "chunks"), SQLiteDocstore(path, "parents")
+
+
+def _segment_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.startswith("seg-"))
+
+
+def test_interrupted_commit_leaves_previous_manifest_and_orphan_is_removed(tmp_path, monkeypatch):
+    directory = str(tmp_path)
+    store = SegmentStore(directory)
+    store.commit([_chunk("a1"), _chunk("a2")], _vectors(2))
+
+    # Crash between writing the segment and swapping the manifest
+    def crash(path, data):
+        raise OSError("power cut")
+
+    monkeypatch.setattr(index_store, "write_json_atomic", crash)
+    with pytest.raises(OSError):
+        store.commit([_chunk("b1", "b.txt")], _vectors(1, offset=100))
+    monkeypatch.undo()
+    assert "seg-000002.npy" in _segment_files(directory)
+
+    docstore, parent_store = _docstores(directory)
+    data = SegmentStore(directory).load(docstore, parent_store)
+
+    assert data["ids"] == ["a1", "a2"]
+    np.testing.assert_array_equal(data["vectors"], _vectors(2))
+    assert _segment_files(directory) == ["seg-000001.jsonl", "seg-000001.npy"]
+    assert docstore.search("b1") == "ID b1 not found."
+
+
+@pytest.mark.parametrize("stage", ["_scan_segments", "_write_segment"])
+def test_merge_finishing_after_reset_is_dropped(tmp_path, monkeypatch, stage):
+    directory = str(tmp_path)
+    store = SegmentStore(directory)
+    for i in range(3):
+        store.commit([_chunk(f"old{i}")], _vectors(1, offset=i))
+
+    # The reset lands while the merge is reading its segments, or once it has written the merged one
+    reached = threading.Event()
+    reset_done = threading.Event()
+    original = getattr(store, stage)
+
+    def pause(*args, **kwargs):
+        result = original(*args, **kwargs)
+        if threading.current_thread() is not threading.main_thread():
+            reached.set()
+            reset_done.wait(10)
+        return result
+
+    monkeypatch.setattr(store, stage, pause)
+    merged = []
+    thread = threading.Thread(target=lambda: merged.append(store.merge()))
+    thread.start()
+    assert reached.wait(10)
+    store.reset()
+    store.commit([_chunk("new", "b.txt")], _vectors(1, offset=50))
+    reset_done.set()
+    thread.join(10)
+
+    assert merged == [0]
+    with open(os.path.join(directory, index_store.MANIFEST_NAME), encoding="utf-8") as f:
+        manifest = json.load(f)
+    assert [segment["name"] for segment in manifest["segments"]] == [store.manifest["segments"][0]["name"]]
+    assert _segment_files(directory) == sorted(f"{manifest['segments'][0]['name']}.{extension}"
+                                               for extension in ("jsonl", "npy"))
+
+    docstore, parent_store = _docstores(directory)
+    assert SegmentStore(directory).load(docstore, parent_store)["ids"] == ["new"]
+
+
+def test_merge_keeps_commits_made_while_it_runs(tmp_path):
+    directory = str(tmp_path)
+    store = SegmentStore(directory)
+    for i in range(3):
+        store.commit([_chunk(f"c{i}")], _vectors(1, offset=i))
+    store.commit(deleted=["c1"])
+
+    assert store.merge() == 4
+    store.commit([_chunk("c3")], _vectors(1, offset=3))
+
+    docstore, parent_store = _docstores(directory)
+    data = SegmentStore(directory).load(docstore, parent_store)
+    assert data["ids"] == ["c0", "c2", "c3"]
+    np.testing.assert_array_equal(data["vectors"], _vectors(1, offset=0).tolist() + _vectors(1, offset=2).tolist()
+                                  + _vectors(1, offset=3).tolist())
+
+
+def test_docstore_of_another_generation_is_replayed(tmp_path):
+    directory = str(tmp_path)
+    store = SegmentStore(directory)
+    store.commit([_chunk("a1"), _chunk("a2")], _vectors(2))
+    docstore, parent_store = _docstores(directory)
+    assert store.load(docstore, parent_store)["rebuilt"]
+
+    # Matching generation - trusted as is
+    assert not SegmentStore(directory).load(docstore, parent_store)["rebuilt"]
+
+    # A later save whose docstore never caught up (the session crashed before mark_current)
+    store.commit([_chunk("a3")], _vectors(1, offset=10), updates=[
+        Document(page_content="text of a1", metadata={"chunk_id": "a1", "source": "a.txt", "page": 7})])
+    docstore.update({"stale": _chunk("stale")})
+    docstore.delete(["a2"])
+
+    data = SegmentStore(directory).load(docstore, parent_store)
+    assert data["rebuilt"]
+    assert data["ids"] == ["a1", "a2", "a3"]
+    assert [chunk.page_content for chunk in docstore.get_many(data["ids"])] == [
+        "text of a1", "text of a2", "text of a3"]
+    assert docstore.search("a1").metadata["page"] == 7
+    assert docstore.search("stale") == "ID stale not found."
+    assert docstore.get_meta("generation") == str(store.manifest["generation"])
+
+
+class _WordEmbeddings(Embeddings):
+    """Deterministic bag-of-words vectors - distinct words give distinct, exact matches"""
+
+    def _vector(self, text):
+        vector = np.zeros(64, dtype=np.float32)
+        for word in text.lower().split():
+            vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % 64] += 1
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._vector(text)
+
+
+@pytest.fixture
+def make_engine(tmp_path, monkeypatch):
+    """Engines on a private collection manager under tmp_path (new_manager=True simulates a restart)"""
+    rag = pytest.importorskip("rag_engine_enhanced")
+    import collection_manager
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(rag.RAGEngine, "_load_embeddings", lambda self, backend, device: _WordEmbeddings())
+    managers = []
+
+    def make(new_manager=False):
+        if new_manager or not managers:
+            if managers:
+                managers[-1].shutdown()
+            managers.append(collection_manager.CollectionManager(root=str(tmp_path / "vectors")))
+            monkeypatch.setattr(collection_manager, "_COLLECTION_MANAGER", managers[-1])
+        return rag.RAGEngine(retrieval_mode="similarity", dedup_threshold=None, document_routing=False,
+                             collection="positions")
+
+    yield make
+    for manager in managers:
+        manager.shutdown()
+
+
+def _file(source, count):
+    return [Document(page_content=f"{source} word{i} {source}unique{i}", metadata={"source": source})
+            for i in range(count)]
+
+
+def _assert_positions_consistent(engine, expected):
+    store = engine.vectorstore
+    assert store.index.ntotal == sum(expected.values())
+    assert sorted(store.index_to_docstore_id) == list(range(store.index.ntotal))
+    for source, count in expected.items():
+        positions = sorted(engine.metadata_index.select(source=source))
+        assert len(positions) == count
+        for chunk in engine.docstore.get_many(store.index_to_docstore_id[p] for p in positions):
+            assert chunk.metadata["source"] == source
+        # Every chunk's own text finds that chunk at its position
+        for position in positions:
+            chunk = engine.docstore.search(store.index_to_docstore_id[position])
+            found = store.similarity_search_by_vector(engine.embeddings.embed_query(chunk.page_content), k=1)
+            assert found[0].metadata["chunk_id"] == chunk.metadata["chunk_id"]
+
+
+def test_positions_after_delete_and_compaction(make_engine):
+    engine = make_engine()
+    for source, count in (("a.txt", 5), ("b.txt", 4), ("c.txt", 6)):
+        engine.add_to_vectorstore(_file(source, count))
+    engine._save_vectorstore()
+
+    epoch = engine._index_epoch
+    assert engine.delete_document("b.txt", save=False) == 4
+    assert len(engine.tombstones) == 4
+    assert not engine.search("b.txt word1", k=3, source=["b.txt"])
+
+    assert engine.compact() == 4
+    assert engine._index_epoch > epoch
+    assert not engine.tombstones
+    _assert_positions_consistent(engine, {"a.txt": 5, "c.txt": 6})
+    hits = engine.search("c.txt word3 c.txtunique3", k=1, source=["c.txt"])
+    assert hits[0].page_content == "c.txt word3 c.txtunique3"
+
+    # Added after the compaction, then reloaded from the segments
+    engine.add_to_vectorstore(_file("d.txt", 2))
+    engine._save_vectorstore()
+    reloaded = make_engine(new_manager=True)
+    assert reloaded.load_index() == 13
+    _assert_positions_consistent(reloaded, {"a.txt": 5, "c.txt": 6, "d.txt": 2})
+
+
+def test_stale_positions_are_recomputed_after_a_compaction(make_engine):
+    engine = make_engine()
+    engine.add_to_vectorstore(_file("a.txt", 3) + _file("b.txt", 3) + _file("c.txt", 3))
+    engine.delete_document("a.txt", save=False)
+
+    # Candidates chosen before a compaction renumbers the index
+    search = engine._search
+    calls = []
+
+    def compact_first(query, k, embedding=None, positions=None, epoch=None):
+        if not calls:
+            engine.compact()
+        calls.append(epoch)
+        return search(query, k, embedding, positions, epoch)
+
+    engine._search = compact_first
+    hits = engine._retrieve("c.txt word2 c.txtunique2")
+
+    assert len(calls) == 2 and calls[0] != calls[1]
+    assert hits[0].page_content == "c.txt word2 c.txtunique2"
@@ -0,0 +1,85 @@
+"""
+UNO conversion bridge for office_converter.py
+
+LibreOffice's Python bridge (pyuno) only imports into the interpreter it
+was built for - Debian's python3-uno into /usr/bin/python3, not the app's
+own python in the Docker image. office_converter runs this script under
+that interpreter, one per warm worker, and sends it conversions:
+
+    python3 uno_bridge.py PORT
+    stdin:  {"input": path, "output": path, "filter": export filter}  (one JSON object per line)
+    stdout: {"ready": true} once connected, then {"ok": true} or {"error": message} per request
+
+Only the standard library and uno may be imported here.
+"""
+import os
+import sys
+import json
+import time
+
+import uno
+
+
+CONNECT_TIMEOUT = 60  # seconds for the office to accept UNO connections
+
+
+def _properties(**values):
+    """UNO PropertyValue sequence"""
+    properties = []
+    for name, value in values.items():
+        prop = uno.createUnoStruct("com.sun.star.beans.PropertyValue")
+        prop.Name = name
+        prop.Value = value
+        properties.append(prop)
+    return tuple(properties)
+
+
+def connect(port, timeout=CONNECT_TIMEOUT):
+    """Desktop of the office listening on port (waits for it to accept connections)"""
+    local = uno.getComponentContext()
+    resolver = local.ServiceManager.createInstanceWithContext("com.sun.star.bridge.UnoUrlResolver", local)
+    deadline = time.time() + timeout
+    while True:
+        try:
+            context = resolver.resolve(f"uno:socket,host=127.0.0.1,port={port};urp;StarOffice.ComponentContext")
+            break
+        except Exception:  # NoConnectException until the office is up
+            if time.time() > deadline:
+                raise
+            time.sleep(0.2)
+    return context.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", context)
+
+
+def convert(desktop, input_path, output_path, filter_name):
+    """Load and store through the office - storeToURL returns once the output is completely written"""
+    document = desktop.loadComponentFromURL(
+        uno.systemPathToFileUrl(os.path.abspath(input_path)), "_blank", 0,
+        _properties(Hidden=True, ReadOnly=True))
+    if document is None:
+        raise RuntimeError("LibreOffice could not open the document")
+    try:
+        document.storeToURL(uno.systemPathToFileUrl(os.path.abspath(output_path)),
+                            _properties(FilterName=filter_name, Overwrite=True))
+    finally:
+        document.close(True)
+
+
+def _reply(message):
+    sys.stdout.write(json.dumps(message) + "\n")
+    sys.stdout.flush()
+
+
+def main():
+    desktop = connect(int(sys.argv[1]))
+    _reply({"ready": True})
+    for line in sys.stdin:
+        request = json.loads(line)
+        try:
+            convert(desktop, request["input"], request["output"], request["filter"])
+            _reply({"ok": True})
+        except Exception as e:
+            _reply({"error": f"{type(e).__name__}: {e}"})
+
+
+if __name__ == "__main__":
+    main()